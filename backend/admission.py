@@ -0,0 +1,255 @@
+"""
+Admission control for the LLM endpoints.
+
+Two layers keep one busy client from using up the OpenAI rate limit:
+
+- Per-client token buckets: each client address may start
+  ADMISSION_CLIENT_RATE requests per second with bursts of
+  ADMISSION_CLIENT_BURST. Over that it gets 429 immediately.
+- A global limit of ADMISSION_MAX_CONCURRENCY cold completions at a time.
+  Further completions wait in a FIFO queue of up to ADMISSION_MAX_QUEUE
+  for at most ADMISSION_QUEUE_TIMEOUT seconds. A full queue or a wait that
+  times out gets 429 with a Retry-After estimated from recent completion
+  times.
+
+Only cold work takes a slot: requests answered from the cache, or by
+joining a completion already in flight, never queue, so they skip past
+queued cold completions.
+
+The client address is the connection's peer unless that peer is listed in
+ADMISSION_TRUSTED_PROXIES (comma-separated addresses or CIDR ranges, or "*"
+for any, e.g. behind the App Service front end that is the only way in).
+Then it is the nearest X-Forwarded-For entry that is not itself a trusted
+proxy. Without this setting, every user behind a proxy shares the proxy's
+bucket. ADMISSION_TRUST_CLIENT_ID keys buckets on the X-Client-ID header
+instead; clients choose that header freely, so only enable it where clients
+are authenticated upstream.
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+from cache import LRUCache
+
+# 0 disables per-client rate limiting
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "1"))
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "10"))
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "15"))
+ADMISSION_TRUSTED_PROXIES = os.getenv("ADMISSION_TRUSTED_PROXIES", "")
+ADMISSION_TRUST_CLIENT_ID = os.getenv("ADMISSION_TRUST_CLIENT_ID", "false").lower() == "true"
+# Clients idle this long forget their bucket (it would be full again anyway)
+CLIENT_BUCKET_TTL = 600
+CLIENT_BUCKET_MAX = 10000
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+def parse_trusted_proxies(value: str):
+    """Networks from a comma-separated list; True for "*" (trust any peer)"""
+    entries = [entry.strip() for entry in value.split(",") if entry.strip()]
+    if "*" in entries:
+        return True
+    return [ipaddress.ip_network(entry, strict=False) for entry in entries]
+
+TRUSTED_PROXIES = parse_trusted_proxies(ADMISSION_TRUSTED_PROXIES)
+
+def is_trusted_proxy(address: str) -> bool:
+    if TRUSTED_PROXIES is True:
+        return True
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def strip_port(hop: str) -> str:
+    """Azure's front end appends the client's port to X-Forwarded-For entries"""
+    if hop.startswith("["):
+        return hop[1:].split("]")[0]
+    if hop.count(":") == 1:
+        return hop.split(":")[0]
+    return hop
+
+def client_address(request) -> str:
+    """The address of the client, looking through trusted proxies"""
+    address = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(address):
+        return address
+    # Proxies append to the right. With "*" the nearest entry is the client;
+    # otherwise walk back past the proxies we trust.
+    forwarded = [strip_port(hop.strip()) for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if not forwarded:
+        return address
+    if TRUSTED_PROXIES is True:
+        return forwarded[-1]
+    for hop in reversed(forwarded):
+        if not is_trusted_proxy(hop):
+            return hop
+    return forwarded[0]
+
+def client_key(request) -> str:
+    """Identify the client of a request: its address, or its X-Client-ID header if trusted"""
+    if ADMISSION_TRUST_CLIENT_ID:
+        client_id = request.headers.get("x-client-id")
+        if client_id:
+            return f"id:{client_id[:128]}"
+    return f"ip:{client_address(request)}"
+
+class AdmissionController:
+    def __init__(self, rate: float, burst: float, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.buckets = LRUCache(CLIENT_BUCKET_MAX, CLIENT_BUCKET_TTL)
+        self.active = 0
+        self._waiters = []
+        # Moving average of how long a slot is held, for Retry-After
+        self.avg_hold = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.queue_timeouts = 0
+
+    def check_rate(self, client_id: str):
+        """Charge one request to client_id's bucket; raises AdmissionRejected when empty"""
+        if not self.rate:
+            return
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        # Re-set on every request so an active client's bucket is never expired
+        self.buckets.set(client_id, bucket)
+        wait = bucket.take()
+        if wait:
+            self.rate_limited += 1
+            raise AdmissionRejected("Too many requests from this client", wait)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _retry_after(self) -> float:
+        return self.avg_hold * (self.waiting + 1) / self.max_concurrency
+
+    async def acquire(self):
+        """Take a completion slot, waiting in the queue if all are busy"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.queue_full += 1
+            raise AdmissionRejected("Server busy, queue full", self._retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            # release() hands the slot over by resolving the future
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived just as we gave up; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.queue_timeouts += 1
+                raise AdmissionRejected("Server busy, timed out in queue", self._retry_after()) from None
+            raise
+        self.admitted += 1
+
+    def release(self, held: float = None):
+        """Give a slot back (to the first waiter, if any); held is how long it was used"""
+        if held is not None:
+            self.avg_hold = 0.9 * self.avg_hold + 0.1 * held
+        while self._waiters:
+            waiter = self._waiters.pop(0)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a completion slot for the duration of the block"""
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def ticket(self) -> "Ticket":
+        return Ticket(self)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "client_rate": self.rate,
+            "client_burst": self.burst,
+            "clients": len(self.buckets),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rate_limited": self.rate_limited,
+            "queue_full": self.queue_full,
+            "queue_timeouts": self.queue_timeouts,
+            "avg_slot_seconds": round(self.avg_hold, 3)
+        }
+
+class Ticket:
+    """A slot taken before a streamed response starts and released when it ends
+
+    release() is idempotent, so it can be called both from the stream's
+    cleanup and from a background task that runs if the stream never starts.
+    """
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+        self.acquired_at = None
+
+    async def acquire(self):
+        await self.controller.acquire()
+        self.acquired_at = time.monotonic()
+
+    def release(self):
+        if self.acquired_at is not None:
+            self.controller.release(time.monotonic() - self.acquired_at)
+            self.acquired_at = None
+
+admission = AdmissionController(
+    ADMISSION_CLIENT_RATE, ADMISSION_CLIENT_BURST,
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT
+)
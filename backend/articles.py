@@ -0,0 +1,56 @@
+"""
+Server-side article sessions.
+
+The popup registers an article's extracted text once and then refers to it
+by ID (the SHA-256 of the content) in every summary and question, instead of
+uploading up to 15,000 characters with each call. Articles live in the
+tiered cache (in-process, then shared by the workers on the host) backed by
+the shared Postgres `articles` table, so any worker can resolve an ID another
+worker registered.
+"""
+import hashlib
+import os
+
+from cache import TieredCache
+from database import get_article, save_article
+
+ARTICLE_CACHE_SIZE = int(os.getenv("ARTICLE_CACHE_SIZE", "512"))
+ARTICLE_CACHE_TTL = float(os.getenv("ARTICLE_CACHE_TTL", str(24 * 3600)))
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+class ArticleStore:
+    def __init__(self, max_entries: int, ttl: float):
+        self.memory = TieredCache("articles", max_entries, ttl)
+        self.db_hits = 0
+        self.registered = 0
+
+    async def register(self, title: str, url: str, content: str) -> str:
+        """Store an article and return its ID"""
+        article_id = content_hash(content)
+        if await self.memory.get(article_id) is None:
+            self.memory.set(article_id, {"title": title, "url": url, "content": content})
+            await save_article(article_id, title, url, content)
+            self.registered += 1
+        return article_id
+
+    async def get(self, article_id: str):
+        article = await self.memory.get(article_id)
+        if article is not None:
+            return article
+
+        article = await get_article(article_id)
+        if article is not None:
+            self.db_hits += 1
+            self.memory.set(article_id, article)
+        return article
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "db_hits": self.db_hits,
+            "registered": self.registered
+        }
+
+article_store = ArticleStore(ARTICLE_CACHE_SIZE, ARTICLE_CACHE_TTL)
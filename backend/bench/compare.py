@@ -0,0 +1,68 @@
+"""
+Compare two bench/run.py reports.
+
+Prints p50/p95/p99 latency, throughput and DB queries per request for each
+scenario in both reports, with the relative change. Exits non-zero when any
+p95 latency grew by more than --threshold percent.
+
+Usage (from backend/):
+    python bench/compare.py baseline.json candidate.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+METRICS = (
+    ("p50_ms", lambda result: result["latency"]["p50_ms"]),
+    ("p95_ms", lambda result: result["latency"]["p95_ms"]),
+    ("p99_ms", lambda result: result["latency"]["p99_ms"]),
+    ("throughput_rps", lambda result: result["throughput_rps"]),
+    ("db_queries_per_request", lambda result: result["db_queries_per_request"]),
+)
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="fail if any p95 latency grew by more than this percent")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline:  {baseline.get('commit')} ({baseline['timestamp']})")
+    print(f"candidate: {candidate.get('commit')} ({candidate['timestamp']})")
+    if baseline["config"] != candidate["config"]:
+        print("warning: the reports were run with different configurations")
+
+    regressions = []
+    for name, after in candidate["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        print(f"\n{name}")
+        for metric, value in METRICS:
+            print(f"  {metric:<24} {value(before):>10} -> {value(after):>10}  {change(value(before), value(after))}")
+
+        p95_before, p95_after = before["latency"]["p95_ms"], after["latency"]["p95_ms"]
+        if p95_before and (p95_after - p95_before) / p95_before * 100 > args.threshold:
+            regressions.append(name)
+
+    if regressions:
+        print(f"\np95 regressions over {args.threshold}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
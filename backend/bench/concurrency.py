@@ -0,0 +1,116 @@
+"""
+Concurrency load test against stubbed slow upstreams.
+
+Fires N concurrent /api/question requests at the app while OpenAI and
+Pinecone are replaced by stubs that take LATENCY seconds each. With the
+upstream calls off the event loop, the batch should finish in roughly one
+request's worth of latency (embedding + query + completion), not N of them,
+and /health should keep answering while the batch is in flight.
+
+Usage (from backend/):
+    python bench/concurrency.py [N] [LATENCY]
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+# Keep the app away from real services before it is imported
+os.environ["PINECONE_API_KEY"] = ""
+os.environ["VECTOR_STORE"] = "none"
+os.environ["DATABASE_URL"] = ""
+os.environ["SHARED_CACHE_PATH"] = ""
+os.environ.setdefault("PINECONE_MAX_CONCURRENCY", str(N))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import clients  # noqa: E402
+import main  # noqa: E402
+from vector_store import PineconeVectorStore  # noqa: E402
+
+
+class FakeCompletions:
+    async def create(self, **kwargs):
+        await asyncio.sleep(LATENCY)
+        message = SimpleNamespace(content="stubbed answer")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeEmbeddings:
+    async def create(self, model, input):
+        await asyncio.sleep(LATENCY)
+        texts = input if isinstance(input, list) else [input]
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=[0.0] * 1536) for i in range(len(texts))
+        ])
+
+
+class FakeOpenAI:
+    chat = SimpleNamespace(completions=FakeCompletions())
+    embeddings = FakeEmbeddings()
+
+
+class FakeIndex:
+    """Blocking stand-in for the synchronous Pinecone SDK"""
+
+    def query(self, **kwargs):
+        time.sleep(LATENCY)
+        return SimpleNamespace(matches=[])
+
+    def upsert(self, **kwargs):
+        time.sleep(LATENCY)
+
+
+async def run():
+    clients._openai_client = FakeOpenAI()
+    main.vector_store = PineconeVectorStore(index=FakeIndex())
+
+    # One request = embedding + Pinecone query + completion
+    expected = 3 * LATENCY
+    payload = {
+        "question": "What is this about?",
+        "title": "Stub article",
+        "content": "Lorem ipsum " * 100,
+        "url": "https://example.com/stub",
+    }
+
+    async with httpx.AsyncClient(app=main.app, base_url="http://bench", timeout=60) as client:
+        async def probe_health():
+            await asyncio.sleep(LATENCY / 2)
+            start = time.perf_counter()
+            await client.get("/health")
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            probe_health(),
+            *(client.post("/api/question", json=payload) for _ in range(N))
+        )
+        elapsed = time.perf_counter() - start
+
+    health_latency, responses = results[0], results[1:]
+    failed = [r for r in responses if r.status_code != 200]
+
+    print(f"requests:        {N}")
+    print(f"stub latency:    {LATENCY:.3f}s per upstream call")
+    print(f"single request:  ~{expected:.3f}s")
+    print(f"batch elapsed:   {elapsed:.3f}s")
+    print(f"serial would be: {expected * N:.3f}s")
+    print(f"/health latency: {health_latency * 1000:.1f}ms (during batch)")
+    print(f"failures:        {len(failed)}")
+
+    ok = not failed and elapsed < expected * 2 and health_latency < LATENCY
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
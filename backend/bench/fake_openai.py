@@ -0,0 +1,174 @@
+"""
+Fake OpenAI API server for offline benchmarks.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings with the
+response shapes the openai client expects. Each call waits LATENCY seconds
+before responding, and completions then produce COMPLETION_TOKENS tokens at
+TOKEN_RATE tokens per second, so a streamed answer arrives at a realistic
+pace. Requests with a response_format get the completion wrapped in the
+JSON object an article analysis expects, streamed in as many pieces.
+Embeddings are derived from a hash of the input text, so identical texts get
+identical vectors.
+
+Usage (from backend/):
+    python bench/fake_openai.py [--port 8765] [--latency 0.3] [--token-rate 80]
+                                [--completion-tokens 120] [--embedding-latency 0.05]
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1 and any
+OPENAI_API_KEY.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from functools import lru_cache
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+EMBEDDING_DIMENSION = 1536
+WORDS = (
+    "the article argues that careful measurement beats intuition when tuning "
+    "systems because latency hides in queues caches and network round trips"
+).split()
+
+app = FastAPI()
+settings = argparse.Namespace(
+    latency=0.3, token_rate=80.0, completion_tokens=120, embedding_latency=0.05
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def completion_words(count: int) -> list:
+    return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+
+def analysis_json(text: str) -> str:
+    sentences = [text[i:i + 60].strip() for i in range(0, len(text), 60)]
+    return json.dumps({
+        "summary": text,
+        "key_points": sentences[:5],
+        "suggested_questions": [f"Why does {sentence}?" for sentence in sentences[:3]]
+    })
+
+
+@lru_cache(maxsize=4096)
+def embedding_for(text: str) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSION, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in body["messages"])
+    completion_tokens = min(settings.completion_tokens, body.get("max_tokens") or settings.completion_tokens)
+    words = completion_words(completion_tokens)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    await asyncio.sleep(settings.latency)
+
+    if body.get("stream"):
+        pieces = words
+        if body.get("response_format"):
+            content = analysis_json("".join(words).strip())
+            step = -(-len(content) // len(words))
+            pieces = [content[i:i + step] for i in range(0, len(content), step)]
+
+        async def chunks():
+            for word in pieces:
+                await asyncio.sleep(1 / settings.token_rate)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body["model"],
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    await asyncio.sleep(completion_tokens / settings.token_rate)
+    content = "".join(words).strip()
+    if body.get("response_format"):
+        content = analysis_json(content)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": body["model"],
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(settings.embedding_latency)
+    tokens = sum(estimate_tokens(text) for text in texts)
+    return {
+        "object": "list",
+        "model": body["model"],
+        "data": [
+            {"object": "embedding", "index": i, "embedding": embedding_for(text)}
+            for i, text in enumerate(texts)
+        ],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=settings.latency,
+                        help="seconds before each response starts")
+    parser.add_argument("--token-rate", type=float, default=settings.token_rate,
+                        help="completion tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=settings.completion_tokens,
+                        help="tokens per completion (capped by max_tokens)")
+    parser.add_argument("--embedding-latency", type=float, default=settings.embedding_latency,
+                        help="seconds per embeddings call")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    settings.latency = args.latency
+    settings.token_rate = args.token_rate
+    settings.completion_tokens = args.completion_tokens
+    settings.embedding_latency = args.embedding_latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,116 @@
+"""
+Check that re-importing a conversation brings it up to date.
+
+Imports a conversation through /api/conversations/import, imports it again
+unchanged, then again with two more messages, as the extension's history
+sync does for a conversation continued since its last sync. The second
+import must change nothing; the third must add exactly the new messages and
+update the conversation row and the user_stats rollup to match. The
+conversation is deleted again at the end.
+
+Needs a Postgres database in DATABASE_URL.
+
+Usage (from backend/):
+    python bench/import_merge.py
+"""
+import asyncio
+import json
+import os
+import sys
+import uuid
+
+os.environ["PINECONE_API_KEY"] = ""
+os.environ["VECTOR_STORE"] = "none"
+os.environ["SHARED_CACHE_PATH"] = ""
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from database import DEFAULT_USER_ID, connect_db, database, delete_conversation, disconnect_db  # noqa: E402
+
+
+def exported(conversation_id: str, count: int) -> dict:
+    return {
+        "id": conversation_id,
+        "article_url": "https://example.com/import-merge",
+        "article_title": "Import merge",
+        "started_at": "2026-01-01T10:00:00",
+        "messages": [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"message {i}",
+                "created_at": f"2026-01-01T10:00:{i:02d}"
+            }
+            for i in range(count)
+        ]
+    }
+
+
+async def snapshot(conversation_id: str) -> dict:
+    row = await database.fetch_one(
+        """
+        SELECT
+            c.message_count, c.last_message_at, c.first_question,
+            (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = c.id) AS stored,
+            (SELECT message_count FROM user_stats WHERE user_id = c.user_id) AS user_messages
+        FROM conversations c
+        WHERE c.id = CAST(:id AS uuid)
+        """,
+        {"id": conversation_id}
+    )
+    return dict(row._mapping)
+
+
+async def run():
+    if not os.getenv("DATABASE_URL"):
+        print("DATABASE_URL is not set")
+        return False
+    await connect_db()
+    conversation_id = str(uuid.uuid4())
+    stats_before = await database.fetch_val(
+        "SELECT COALESCE((SELECT message_count FROM user_stats WHERE user_id = CAST(:id AS uuid)), 0)",
+        {"id": DEFAULT_USER_ID}
+    )
+
+    ok = True
+    try:
+        async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=30) as client:
+            async def sync(count: int) -> dict:
+                body = json.dumps(exported(conversation_id, count)) + "\n"
+                response = await client.post("/api/conversations/import", content=body)
+                return response.json()
+
+            first = await sync(2)
+            again = await sync(2)
+            continued = await sync(4)
+        after = await snapshot(conversation_id)
+
+        for name, result, expected in (
+            ("first import", first, (1, 2, 0, 0)),
+            ("same again", again, (0, 0, 0, 1)),
+            ("continued", continued, (0, 2, 1, 0))
+        ):
+            counts = (result["imported"], result["messages"], result["updated"], result["skipped"])
+            print(f"{name}: imported {counts[0]}, messages {counts[1]}, updated {counts[2]}, skipped {counts[3]}")
+            ok &= counts == expected
+
+        print(f"conversation: {after['message_count']} messages counted, {after['stored']} stored, "
+              f"last at {after['last_message_at']}")
+        ok &= after["message_count"] == after["stored"] == 4
+        ok &= after["last_message_at"].isoformat() == "2026-01-01T10:00:03"
+        ok &= after["first_question"] == "message 0"
+        ok &= after["user_messages"] - stats_before == 4
+    finally:
+        await delete_conversation(conversation_id)
+        await disconnect_db()
+
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run()) else 1)
@@ -0,0 +1,360 @@
+"""
+Offline benchmark of the API against local stand-ins.
+
+Starts bench/fake_openai.py as the OpenAI backend and serves the app with
+uvicorn in this process. The app uses the in-memory vector store instead of
+Pinecone and, when a database URL is given, a local Postgres for history.
+Once /ready reports the app warm, each scenario is driven with a fixed number
+of requests at the configured concurrency and the results are written as a
+JSON report. The report has p50/p95/p99 latency, throughput, errors,
+database queries per request and the mean time per instrumented stage.
+Compare two reports with bench/compare.py.
+
+Scenarios:
+    summarize         POST /api/summarize, distinct articles (cache misses)
+    summarize_stream  POST /api/summarize/stream, time to first token and total
+    question          POST /api/question about the summarized articles
+    history           GET /api/conversations, following next_cursor
+    search            GET /api/conversations/search/{query}
+
+history and search need the database. The queries are Postgres-specific
+(full-text search, advisory locks), so use a throwaway local Postgres
+database; the benchmark writes conversations to it.
+
+Usage (from backend/):
+    python bench/run.py [--requests 200] [--concurrency 20]
+                        [--scenarios summarize,question,history,search]
+                        [--database-url postgresql://...] [--output bench.json]
+                        [--latency 0.3] [--token-rate 80] [--embedding-latency 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+SCENARIOS = ("summarize", "summarize_stream", "question", "history", "search")
+SEARCH_TERMS = ("measurement", "latency", "queues", "caches", "network")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--scenarios", default="summarize,question,history,search",
+                        help=f"comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", ""),
+                        help="local Postgres for history (default: $BENCH_DATABASE_URL, none = no history)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake OpenAI time to first byte")
+    parser.add_argument("--token-rate", type=float, default=80.0, help="fake OpenAI tokens per second")
+    parser.add_argument("--completion-tokens", type=int, default=120)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=0, help="fake OpenAI port (default: a free one)")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_openai(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "fake_openai.py"),
+        "--port", str(args.port),
+        "--latency", str(args.latency),
+        "--token-rate", str(args.token_rate),
+        "--completion-tokens", str(args.completion_tokens),
+        "--embedding-latency", str(args.embedding_latency),
+    ])
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", args.port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("fake OpenAI server did not start")
+
+
+def configure_environment(args):
+    """Point the app at the stand-ins; must run before the app is imported"""
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["PINECONE_API_KEY"] = ""
+    os.environ["VECTOR_STORE"] = "memory"
+    os.environ["DATABASE_URL"] = args.database_url
+    # No cross-run cache hits: every run measures the full request path
+    os.environ["RESPONSE_CACHE_DB"] = "false"
+    os.environ["SHARED_CACHE_PATH"] = ""
+    # Every request comes from this one client; the global queue still applies
+    os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+class QueryCounter:
+    """Counts statements sent through `databases` connections"""
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        from databases.core import Connection
+
+        counter = self
+
+        def counted(method, per_value=False):
+            async def wrapper(self, query, values=None, *args, **kwargs):
+                counter.count += len(values) if per_value and values else 1
+                return await method(self, query, values, *args, **kwargs)
+            return wrapper
+
+        for name in ("fetch_all", "fetch_one", "fetch_val", "execute"):
+            setattr(Connection, name, counted(getattr(Connection, name)))
+        Connection.execute_many = counted(Connection.execute_many, per_value=True)
+
+
+def article(i: int) -> dict:
+    topic = SEARCH_TERMS[i % len(SEARCH_TERMS)]
+    sentences = " ".join(
+        f"Paragraph {j} of benchmark article {i} discusses {topic} in some depth."
+        for j in range(60)
+    )
+    return {
+        "title": f"Benchmark article {i} on {topic}",
+        "url": f"https://bench.example.com/articles/{i}",
+        "content": sentences
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0
+    }
+
+
+def stage_snapshot() -> dict:
+    from telemetry import stage_seconds
+    totals = {}
+    for (name, _outcome), (_counts, total, count) in stage_seconds.series.items():
+        seconds, calls = totals.get(name, (0.0, 0))
+        totals[name] = (seconds + total, calls + count)
+    return totals
+
+
+def stage_delta(before: dict, after: dict) -> dict:
+    stages = {}
+    for name, (seconds, calls) in sorted(after.items()):
+        seconds -= before.get(name, (0.0, 0))[0]
+        calls -= before.get(name, (0.0, 0))[1]
+        if calls:
+            stages[name] = {"calls": calls, "mean_ms": round(seconds / calls * 1000, 2)}
+    return stages
+
+
+class Bench:
+    def __init__(self, client, args, queries: QueryCounter):
+        self.client = client
+        self.args = args
+        self.queries = queries
+        self.conversations = []
+
+    async def run_scenario(self, name: str) -> dict:
+        request = getattr(self, f"request_{name}")
+        latencies, first_tokens, errors = [], [], []
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+            while next_index < self.args.requests:
+                i = next_index
+                next_index += 1
+                start = time.perf_counter()
+                try:
+                    first_token = await request(i)
+                    latencies.append(time.perf_counter() - start)
+                    if first_token is not None:
+                        first_tokens.append(first_token - start)
+                except Exception as e:
+                    errors.append(repr(e))
+
+        stages_before = stage_snapshot()
+        queries_before = self.queries.count
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - start
+        queries = self.queries.count - queries_before
+
+        result = {
+            "requests": self.args.requests,
+            "errors": len(errors),
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "latency": summarize_latencies(latencies),
+            "db_queries": queries,
+            "db_queries_per_request": round(queries / self.args.requests, 2),
+            "stages": stage_delta(stages_before, stage_snapshot())
+        }
+        if first_tokens:
+            result["first_token"] = summarize_latencies(first_tokens)
+        if errors:
+            result["sample_errors"] = sorted(set(errors))[:5]
+        return result
+
+    async def post(self, path: str, body: dict) -> dict:
+        response = await self.client.post(path, json=body)
+        response.raise_for_status()
+        return response.json()
+
+    async def get(self, path: str, params: dict = None) -> dict:
+        response = await self.client.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def request_summarize(self, i: int):
+        result = await self.post("/api/summarize", article(i))
+        if result.get("conversation_id"):
+            self.conversations.append(result["conversation_id"])
+
+    async def request_summarize_stream(self, i: int):
+        # Offset so these articles miss the cache left by the summarize scenario
+        body = article(self.args.requests + i)
+        first_token = None
+        async with self.client.stream("POST", "/api/summarize/stream", json=body) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if first_token is None and line == "event: token":
+                    first_token = time.perf_counter()
+                if line == "event: error":
+                    raise RuntimeError("stream reported an error")
+        return first_token
+
+    async def request_question(self, i: int):
+        body = dict(article(i), question=f"What does article {i} say about {SEARCH_TERMS[i % len(SEARCH_TERMS)]}?")
+        if self.conversations:
+            body["conversation_id"] = self.conversations[i % len(self.conversations)]
+        await self.post("/api/question", body)
+
+    async def request_history(self, i: int):
+        # First page plus one more, as a client scrolling the list would
+        page = await self.get("/api/conversations", {"limit": 20})
+        if page.get("next_cursor"):
+            await self.get("/api/conversations", {"limit": 20, "cursor": page["next_cursor"]})
+
+    async def request_search(self, i: int):
+        await self.get(f"/api/conversations/search/{SEARCH_TERMS[i % len(SEARCH_TERMS)]}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    sys.path.insert(0, BACKEND_DIR)
+    import httpx
+    import uvicorn
+
+    queries = QueryCounter()
+    queries.install()
+    import main
+
+    # Serve the app over real HTTP in this process, so streamed responses
+    # arrive incrementally and the query counter and stage metrics see it
+    app_port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=app_port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            server_task.result()
+            raise RuntimeError("app server did not start")
+        await asyncio.sleep(0.05)
+
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=120, limits=limits) as client:
+            # Warm-up (database, vector store) runs after startup
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+            bench = Bench(client, args, queries)
+            results = {}
+            for name in args.scenarios:
+                print(f"running {name}...", file=sys.stderr)
+                results[name] = await bench.run_scenario(name)
+    finally:
+        server.should_exit = True
+        await server_task
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "database": bool(args.database_url),
+            "vector_store": "memory",
+            "openai_latency_s": args.latency,
+            "openai_token_rate": args.token_rate,
+            "completion_tokens": args.completion_tokens,
+            "embedding_latency_s": args.embedding_latency
+        },
+        "scenarios": results
+    }
+
+
+def main_cli(argv=None) -> int:
+    args = parse_args(argv)
+    args.port = args.port or free_port()
+    fake_openai = start_fake_openai(args)
+    try:
+        configure_environment(args)
+        report = asyncio.run(run(args))
+    finally:
+        fake_openai.terminate()
+        fake_openai.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 1 if any(result["errors"] for result in report["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,114 @@
+"""
+Check that /api/summarize/stream streams the analysis as it is generated.
+
+OpenAI is replaced by a stub that streams the analysis JSON in small pieces.
+On a cache miss the summary must arrive as several `token` events before
+`done`, concurrent requests for the same article must share one completion,
+and the key-points request that follows must be served from the cached
+analysis in a single token event.
+
+Usage (from backend/):
+    python bench/streaming.py
+"""
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+os.environ["PINECONE_API_KEY"] = ""
+os.environ["VECTOR_STORE"] = "none"
+os.environ["DATABASE_URL"] = ""
+os.environ["SHARED_CACHE_PATH"] = ""
+os.environ["RESPONSE_CACHE_DB"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("ADMISSION_CLIENT_RATE", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import clients  # noqa: E402
+import main  # noqa: E402
+
+ANALYSIS = {
+    "summary": "Careful measurement beats intuition when tuning systems, because latency hides in queues.",
+    "key_points": ["Measure first", "Latency hides in queues", "Caches change the picture"],
+    "suggested_questions": ["Where does latency hide?"]
+}
+
+
+def delta_chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, stream=False, **kwargs):
+        self.calls += 1
+        content = json.dumps(ANALYSIS)
+        if not stream:
+            await asyncio.sleep(0.2)
+            message = SimpleNamespace(content=content)
+            usage = SimpleNamespace(prompt_tokens=100, completion_tokens=50)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+        async def chunks():
+            for i in range(0, len(content), 8):
+                await asyncio.sleep(0.01)
+                yield delta_chunk(content[i:i + 8])
+
+        return chunks()
+
+
+class FakeEmbeddings:
+    async def create(self, model, input):
+        texts = input if isinstance(input, list) else [input]
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=[0.0] * 1536) for i in range(len(texts))
+        ])
+
+
+def parse_events(text: str) -> list:
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+async def run():
+    completions = FakeCompletions()
+    clients._openai_client = SimpleNamespace(
+        chat=SimpleNamespace(completions=completions), embeddings=FakeEmbeddings()
+    )
+    body = {"title": "Streaming", "url": "https://example.com/streaming", "content": "Some article text. " * 100}
+
+    async with httpx.AsyncClient(app=main.app, base_url="http://test", timeout=30) as client:
+        async def stream(summary_type: str) -> list:
+            response = await client.post("/api/summarize/stream", json=dict(body, type=summary_type))
+            return parse_events(response.text)
+
+        first, second = await asyncio.gather(stream("summary"), stream("summary"))
+        key_points = await stream("key-points")
+
+    ok = True
+    for name, events in (("leader", first), ("follower", second), ("key points", key_points)):
+        kinds = [kind for kind, _ in events]
+        tokens = "".join(data["content"] for kind, data in events if kind == "token")
+        done = events[-1][1] if kinds[-1] == "done" else {}
+        print(f"{name}: {kinds.count('token')} token events, last event {kinds[-1]}")
+        ok &= kinds[0] == "meta" and kinds[-1] == "done" and tokens == done.get("summary")
+
+    print(f"completions: {completions.calls}")
+    ok &= [kind for kind, _ in first].count("token") > 1
+    ok &= [kind for kind, _ in key_points].count("token") == 1
+    ok &= completions.calls == 1
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run()) else 1)
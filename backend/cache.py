@@ -0,0 +1,389 @@
+"""
+Caching: in-process LRUs, the tier shared by the workers on a host, and the
+response cache for summary and key-points completions.
+
+A TieredCache puts an in-process LRU (L1) in front of a SQLite database in
+WAL mode at SHARED_CACHE_PATH (L2), which every gunicorn worker on the host
+opens. A value one worker computed is then a local-file read away for the
+others and survives restarts. The L2 store is capped at SHARED_CACHE_MAX_MB
+and evicts least recently used entries; access times are only refreshed
+every SHARED_CACHE_TOUCH_INTERVAL seconds, so hits rarely write. L1 is
+checked inline; L2 statements (which may wait on another worker's write,
+or run an eviction) go to one thread per worker, so the event loop never
+blocks on SQLite. L2 reads are awaited, writes are queued to that thread
+without waiting. Any SQLite error counts as a miss.
+
+Response cache entries are keyed on (content hash, request type, model,
+prompt version). Lookups go through the tiers first and, when
+RESPONSE_CACHE_DB is on, fall back to the Postgres `response_cache` table
+shared by every worker on every host.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from database import get_cached_response, save_cached_response, purge_stale_responses
+from prompts import CHAT_MODEL, PROMPT_VERSION
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "true").lower() == "true"
+
+# Empty disables the shared tier
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "resonance-cache.sqlite3"))
+SHARED_CACHE_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", "256"))
+SHARED_CACHE_TOUCH_INTERVAL = 60
+# How long a write waits for another worker's; longer waits are treated as misses
+SHARED_CACHE_BUSY_TIMEOUT = 0.05
+# Check the store size every this many writes
+SHARED_CACHE_EVICT_EVERY = 100
+# Share of entries dropped when the store is over its size limit
+SHARED_CACHE_EVICT_FRACTION = 0.1
+
+class LRUCache:
+    """Bounded in-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class SharedStore:
+    """Key-value store in a SQLite file shared by the workers on one host"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily, and again in a forked worker: connections must not cross processes
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=SHARED_CACHE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries (accessed_at)")
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def submit(self, fn, *args):
+        """Queue fn on the store's thread; a forked worker gets its own"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+            self._executor_pid = os.getpid()
+        return self._executor.submit(fn, *args)
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _failed(self, action: str, error: Exception):
+        self.errors += 1
+        logger.warning("Shared cache error", extra={"action": action, "error": str(error)})
+
+    def get(self, key: str):
+        """(value, seconds until it expires), or None"""
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT value, expires_at, accessed_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                value, expires_at, accessed_at = row
+                if expires_at < now:
+                    connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return None
+                if now - accessed_at > SHARED_CACHE_TOUCH_INTERVAL:
+                    connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                return value, expires_at - now
+        except sqlite3.Error as e:
+            self._failed("get", e)
+            return None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now + ttl, now)
+                )
+                self._writes += 1
+                if self._writes % SHARED_CACHE_EVICT_EVERY == 0:
+                    self._evict(connection, now)
+        except sqlite3.Error as e:
+            self._failed("set", e)
+
+    def delete(self, key: str):
+        try:
+            with self._lock:
+                self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+
+    def _used_bytes(self, connection: sqlite3.Connection) -> int:
+        # Pages freed by deletes are reused, so they do not count
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """Drop expired entries, then least recently used ones, while over the size limit"""
+        if self._used_bytes(connection) <= self.max_bytes:
+            return
+        self.evictions += connection.execute("DELETE FROM entries WHERE expires_at < ?", (now,)).rowcount
+        while self._used_bytes(connection) > self.max_bytes:
+            count = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if not count:
+                break
+            self.evictions += connection.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                (max(1, int(count * SHARED_CACHE_EVICT_FRACTION)),)
+            ).rowcount
+
+    def stats(self) -> dict:
+        try:
+            with self._lock:
+                connection = self._connect()
+                entries = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                used = self._used_bytes(connection)
+        except sqlite3.Error as e:
+            self._failed("stats", e)
+            entries, used = None, None
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "errors": self.errors
+        }
+
+shared_store = SharedStore(SHARED_CACHE_PATH, int(SHARED_CACHE_MAX_MB * 1024 * 1024)) if SHARED_CACHE_PATH else None
+
+# Every TieredCache by name, for per-tier stats
+tiered_caches = {}
+
+def encode_json(value) -> bytes:
+    return json.dumps(value).encode()
+
+def decode_json(data: bytes):
+    return json.loads(data)
+
+class TieredCache:
+    """An in-process L1 over the host-wide shared L2
+
+    Like LRUCache, except that get() is a coroutine: an L1 miss reads L2 on
+    the store's thread. set() and delete() update L1 and queue the L2 write.
+    encode/decode turn values into the bytes stored in L2 and back. clear()
+    only empties L1; the shared tier is left to its TTL and eviction.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: float,
+                 encode=encode_json, decode=decode_json, store: SharedStore = None):
+        self.name = name
+        self.ttl = ttl
+        self.l1 = LRUCache(max_entries, ttl)
+        self.store = store if store is not None else shared_store
+        self.encode = encode
+        self.decode = decode
+        self.l2_hits = 0
+        self.l2_misses = 0
+        tiered_caches[name] = self
+
+    def _key(self, key) -> str:
+        return f"{self.name}:{key}"
+
+    async def get(self, key):
+        value = self.l1.get(key)
+        if value is not None or self.store is None:
+            return value
+
+        found = await self.store.run(self.store.get, self._key(key))
+        if found is None:
+            self.l2_misses += 1
+            return None
+        data, ttl = found
+        value = self.decode(data)
+        self.l2_hits += 1
+        self.l1.set(key, value, ttl)
+        return value
+
+    def set(self, key, value):
+        self.l1.set(key, value)
+        if self.store is not None:
+            self.store.submit(self.store.set, self._key(key), self.encode(value), self.ttl)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        if self.store is not None:
+            self.store.submit(self.store.delete, self._key(key))
+
+    def clear(self):
+        self.l1.clear()
+
+    def __len__(self):
+        return len(self.l1)
+
+    def stats(self) -> dict:
+        l1 = self.l1.stats()
+        l2_lookups = self.l2_hits + self.l2_misses
+        hits = l1["hits"] + self.l2_hits
+        misses = self.l2_misses if self.store is not None else l1["misses"]
+        return {
+            "l1": l1,
+            "l2": {
+                "enabled": self.store is not None,
+                "hits": self.l2_hits,
+                "misses": self.l2_misses,
+                "hit_rate": round(self.l2_hits / l2_lookups, 4) if l2_lookups else 0.0
+            },
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0
+        }
+
+async def tiered_cache_stats() -> dict:
+    return {
+        "shared": await shared_store.run(shared_store.stats) if shared_store is not None else None,
+        "caches": {name: cache.stats() for name, cache in tiered_caches.items()}
+    }
+
+class ResponseCache:
+    """Tiered response cache with an optional Postgres level behind it"""
+
+    def __init__(self, max_entries: int, ttl: float, use_db: bool):
+        self.memory = TieredCache("responses", max_entries, ttl)
+        self.ttl = ttl
+        self.use_db = use_db
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for_hash(content_hash: str, request_type: str, model: str = CHAT_MODEL,
+                     prompt_version: str = PROMPT_VERSION) -> str:
+        """Key for a response to content with this hash, e.g. a near-duplicate's canonical copy"""
+        return f"{content_hash}:{request_type}:{model}:{prompt_version}"
+
+    async def get(self, key: str):
+        value = await self.memory.get(key)
+        if value is not None:
+            return value
+
+        if self.use_db:
+            value = await get_cached_response(key, self.ttl)
+            if value is not None:
+                self.db_hits += 1
+                self.memory.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        self.memory.set(key, value)
+        if self.use_db:
+            await save_cached_response(key, PROMPT_VERSION, value)
+
+    async def invalidate_stale(self):
+        """Remove entries written under a previous prompt version
+
+        Shared-tier entries carry the version in their key, so old ones are
+        never read again and age out there.
+        """
+        self.memory.clear()
+        if self.use_db:
+            removed = await purge_stale_responses(PROMPT_VERSION)
+            if removed:
+                logger.info("Purged cached responses from older prompt versions", extra={"count": removed})
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + self.db_hits + self.misses
+        return {
+            "prompt_version": PROMPT_VERSION,
+            "memory": memory,
+            "db_enabled": self.use_db,
+            "db_hits": self.db_hits,
+            "hits": memory["hits"] + self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round((memory["hits"] + self.db_hits) / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_DB)
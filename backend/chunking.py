@@ -0,0 +1,79 @@
+"""
+Split extracted article text into overlapping, token-bounded chunks.
+
+Chunks are built from whole sentences where possible so retrieved passages
+read cleanly; a sentence longer than the budget is split on words, and a
+word longer than the budget (e.g. a URL or an unbroken run of characters)
+is cut on token boundaries. Sizes are counted with the embedding model's
+tokenizer.
+"""
+import os
+import re
+
+from embeddings import EMBEDDING_MODEL
+from tokens import count_tokens, count_tokens_batch, split_to_tokens
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+def _split_long_sentence(sentence: str, max_tokens: int, model: str) -> list:
+    pieces, current = [], []
+    for word in sentence.split():
+        if count_tokens(word, model) > max_tokens:
+            if current:
+                pieces.append(" ".join(current))
+                current = []
+            pieces.extend(split_to_tokens(word, max_tokens, model))
+            continue
+        if current and count_tokens(" ".join(current + [word]), model) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+def _joined_sizes(sentences: list, model: str) -> list:
+    return count_tokens_batch([" " + sentence for sentence in sentences], model)
+
+def split_into_chunks(text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS, model: str = EMBEDDING_MODEL) -> list:
+    """Return overlapping chunks of at most max_tokens, split on sentence boundaries"""
+    segments = [" ".join(sentence.split()) for sentence in _SENTENCE_END.split(text)]
+    segments = [segment for segment in segments if segment]
+
+    # Sizes include the joining space, so a chunk's size is the sum of its sentences'
+    sentences, sizes = [], []
+    for sentence, size in zip(segments, _joined_sizes(segments, model)):
+        if size > max_tokens:
+            pieces = _split_long_sentence(sentence, max_tokens - 1, model)
+            sentences.extend(pieces)
+            sizes.extend(_joined_sizes(pieces, model))
+        else:
+            sentences.append(sentence)
+            sizes.append(size)
+
+    chunks, current, current_tokens = [], [], 0
+    for sentence, tokens in zip(sentences, sizes):
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(" ".join(text for text, _ in current))
+
+            # Carry trailing sentences into the next chunk as overlap
+            overlap, overlap_size = [], 0
+            for previous, size in reversed(current):
+                if overlap_size + size > overlap_tokens:
+                    break
+                overlap.insert(0, (previous, size))
+                overlap_size += size
+            current, current_tokens = overlap, overlap_size
+            while current and current_tokens + tokens > max_tokens:
+                current_tokens -= current.pop(0)[1]
+
+        current.append((sentence, tokens))
+        current_tokens += tokens
+
+    if current:
+        chunks.append(" ".join(text for text, _ in current))
+    return chunks
@@ -0,0 +1,139 @@
+"""
+Async access to the upstream services (OpenAI and Pinecone).
+
+OpenAI calls go through a shared AsyncOpenAI client. The Pinecone SDK is
+synchronous, so its calls run on a bounded thread pool instead of blocking
+the event loop. Each side is an upstream.Upstream with a concurrency cap, a
+per-call deadline, retries and optional hedging for idempotent calls
+(embeddings, queries), and a circuit breaker. The SDK's own retries are off
+so that policy is the only one.
+
+The openai package is imported when the client is first created, since
+importing it is a large part of worker boot time; the app warms it up in a
+background task after startup.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from dotenv import load_dotenv
+
+from telemetry import stage, stage_seconds
+from upstream import Upstream
+
+load_dotenv()
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+PINECONE_MAX_CONCURRENCY = int(os.getenv("PINECONE_MAX_CONCURRENCY", "8"))
+PINECONE_TIMEOUT = float(os.getenv("PINECONE_TIMEOUT", "10"))
+# Hedge an idempotent call when the first attempt is slower than this (0 = off)
+OPENAI_HEDGE_AFTER_MS = float(os.getenv("OPENAI_HEDGE_AFTER_MS", "0"))
+PINECONE_HEDGE_AFTER_MS = float(os.getenv("PINECONE_HEDGE_AFTER_MS", "0"))
+
+openai_upstream = Upstream("openai", OPENAI_TIMEOUT, OPENAI_MAX_CONCURRENCY, OPENAI_HEDGE_AFTER_MS)
+pinecone_upstream = Upstream("pinecone", PINECONE_TIMEOUT, PINECONE_MAX_CONCURRENCY, PINECONE_HEDGE_AFTER_MS)
+
+_openai_client = None
+_pinecone_executor = ThreadPoolExecutor(
+    max_workers=PINECONE_MAX_CONCURRENCY,
+    thread_name_prefix="pinecone"
+)
+
+# ============================================
+# OPENAI
+# ============================================
+
+def get_openai_client():
+    """Return the shared AsyncOpenAI client, creating it on first use"""
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=OPENAI_TIMEOUT,
+            max_retries=0
+        )
+    return _openai_client
+
+async def chat_completion(**kwargs):
+    """Create a chat completion without blocking the event loop (never retried)"""
+    with stage("openai.chat"):
+        return await openai_upstream.call(lambda: get_openai_client().chat.completions.create(**kwargs))
+
+async def stream_chat_completion(**kwargs):
+    """Yield completion text deltas as the model produces them
+
+    Records time to first token separately from the whole stream. The
+    deadline covers opening the stream; the circuit breaker sees the outcome
+    of the whole stream.
+    """
+    start = time.perf_counter()
+    first_token = True
+    with stage("openai.chat_stream"):
+        openai_upstream.admit()
+        try:
+            async with openai_upstream.semaphore:
+                stream = await asyncio.wait_for(
+                    get_openai_client().chat.completions.create(stream=True, **kwargs),
+                    timeout=OPENAI_TIMEOUT
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            first_token = False
+                            stage_seconds.observe(time.perf_counter() - start, "openai.chat_first_token", "ok")
+                        yield chunk.choices[0].delta.content
+        except (asyncio.CancelledError, GeneratorExit):
+            openai_upstream.breaker.release_probe()
+            raise
+        except Exception as e:
+            openai_upstream.record(e)
+            raise
+        openai_upstream.record()
+
+async def create_embeddings(input, model: str = "text-embedding-ada-002"):
+    """Create embeddings for a string or a list of strings (idempotent: retried and hedged)"""
+    with stage("openai.embeddings"):
+        return await openai_upstream.call(
+            lambda: get_openai_client().embeddings.create(model=model, input=input),
+            idempotent=True
+        )
+
+# ============================================
+# PINECONE
+# ============================================
+
+async def run_pinecone(fn, *args, idempotent: bool = False, **kwargs):
+    """Run a blocking Pinecone SDK call on the bounded executor
+
+    A call abandoned at its deadline (or losing a hedge) keeps its thread
+    until the SDK returns; the executor size bounds how many can pile up.
+    """
+    loop = asyncio.get_running_loop()
+    return await pinecone_upstream.call(
+        lambda: loop.run_in_executor(_pinecone_executor, partial(fn, *args, **kwargs)),
+        idempotent=idempotent
+    )
+
+def upstream_stats() -> dict:
+    return {upstream.name: upstream.stats() for upstream in (openai_upstream, pinecone_upstream)}
+
+# ============================================
+# LIFECYCLE
+# ============================================
+
+async def close_clients():
+    """Release the HTTP connection pool and executor threads"""
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    _pinecone_executor.shutdown(wait=False)
@@ -1,9 +1,20 @@
 import os
+import asyncio
+import base64
+import logging
 from databases import Database
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
+import json
+import re
+import zstandard
 from dotenv import load_dotenv
 
+from migrations import apply_migrations
+from telemetry import timed
+
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
@@ -25,22 +36,25 @@ async def connect_db():
     if database and DATABASE_URL:
         try:
             await database.connect()
-            print("✅ Database connected")
+            logger.info("Database connected")
+            await apply_migrations(database)
         except Exception as e:
-            print(f"⚠️  Database connection failed: {e}")
+            logger.warning("Database connection failed", extra={"error": str(e)})
     else:
-        print("⚠️  DATABASE_URL not found - conversations will not be saved")
+        logger.warning("DATABASE_URL not found - conversations will not be saved")
 
 async def disconnect_db():
     """Disconnect from database"""
     if database and database.is_connected:
+        await message_buffer.flush()
         await database.disconnect()
-        print("Database disconnected")
+        logger.info("Database disconnected")
 
 # ============================================
 # CONVERSATION MANAGEMENT
 # ============================================
 
+@timed("db.create_conversation")
 async def create_conversation(article_url: str, article_title: str) -> str:
     """Create a new conversation and return its ID"""
     if not database:
@@ -49,10 +63,17 @@ async def create_conversation(article_url: str, article_title: str) -> str:
     try:
         conversation_id = str(uuid.uuid4())
         
+        # The user's stats rollup is bumped in the same statement
         query = """
-        INSERT INTO conversations (id, user_id, article_url, article_title, started_at, message_count)
-        VALUES (:id, :user_id, :url, :title, :started_at, 0)
-        RETURNING id
+        WITH created AS (
+            INSERT INTO conversations (id, user_id, article_url, article_title, started_at, message_count)
+            VALUES (:id, :user_id, :url, :title, :started_at, 0)
+            RETURNING id, user_id
+        )
+        INSERT INTO user_stats (user_id, conversation_count, message_count)
+        SELECT user_id, 1, 0 FROM created
+        ON CONFLICT (user_id) DO UPDATE SET conversation_count = user_stats.conversation_count + 1
+        RETURNING (SELECT id FROM created) AS id
         """
         
         result = await database.fetch_one(
@@ -66,86 +87,295 @@ async def create_conversation(article_url: str, article_title: str) -> str:
             }
         )
         
-        print(f"✅ Created conversation: {conversation_id}")
+        logger.info("Created conversation", extra={"conversation_id": conversation_id})
         return conversation_id
     except Exception as e:
-        print(f"Error creating conversation: {e}")
+        logger.error("Error creating conversation", extra={"error": str(e)})
         return None
 
+# ============================================
+# MESSAGE PERSISTENCE
+# ============================================
+
+MESSAGE_WRITE_BEHIND = os.getenv("MESSAGE_WRITE_BEHIND", "false").lower() == "true"
+MESSAGE_FLUSH_INTERVAL_MS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "10"))
+MESSAGE_FLUSH_MAX_BATCH = int(os.getenv("MESSAGE_FLUSH_MAX_BATCH", "200"))
+
+def _message_rows(conversation_id: str, messages: list) -> list:
+    """Give each message an ID and a distinct, ordered timestamp"""
+    now = datetime.now()
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "conversation_id": conversation_id,
+            "role": message["role"],
+            "content": message["content"],
+            "input_method": message.get("input_method", "text"),
+            "created_at": message.get("created_at") or now + timedelta(microseconds=i)
+        }
+        for i, message in enumerate(messages)
+    ]
+
+@timed("db.write_messages")
+async def _write_messages(conversation_id: str, rows: list):
+    """Insert messages and update the conversation row and stats rollup in one atomic statement"""
+    placeholders, values = [], {"conversation_id": conversation_id}
+    for i, row in enumerate(rows):
+        placeholders.append(f"(:id{i}, :conversation_id, :role{i}, :content{i}, :input_method{i}, :created_at{i})")
+        values.update({
+            f"id{i}": row["id"],
+            f"role{i}": row["role"],
+            f"content{i}": row["content"],
+            f"input_method{i}": row["input_method"],
+            f"created_at{i}": row["created_at"]
+        })
+
+    query = f"""
+    WITH inserted AS (
+        INSERT INTO messages (id, conversation_id, role, content, input_method, created_at)
+        VALUES {", ".join(placeholders)}
+        RETURNING role, content, created_at
+    ),
+    conversation AS (
+        UPDATE conversations
+        SET
+            message_count = message_count + (SELECT COUNT(*) FROM inserted),
+            last_message_at = (SELECT MAX(created_at) FROM inserted),
+            first_question = COALESCE(
+                first_question,
+                (SELECT content FROM inserted WHERE role = 'user' ORDER BY created_at LIMIT 1)
+            )
+        WHERE id = :conversation_id
+        RETURNING user_id
+    )
+    UPDATE user_stats
+    SET message_count = message_count + (SELECT COUNT(*) FROM inserted)
+    WHERE user_id = (SELECT user_id FROM conversation)
+    """
+
+    await database.execute(query=query, values=values)
+
+class MessageWriteBuffer:
+    """Group commit for message writes
+
+    Writes arriving within MESSAGE_FLUSH_INTERVAL_MS are flushed together in
+    one transaction with pipelined executemany calls. Each caller waits until
+    the batch holding its messages has committed, so nothing is acknowledged
+    before it is durable.
+    """
+
+    def __init__(self, interval_ms: float, max_batch: int):
+        self.interval = interval_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._flush_handle = None
+        self.flushes = 0
+        self.messages_written = 0
+
+    async def write(self, conversation_id: str, rows: list):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((conversation_id, rows, future))
+        if sum(len(item[1]) for item in self._pending) >= self.max_batch:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.interval)
+        await future
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self.flush())
+        )
+
+    async def flush(self):
+        """Commit everything queued so far"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        try:
+            await self._write_batch(batch)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+        except Exception as e:
+            # One bad conversation must not sink the others: retry one by one
+            logger.warning("Batched message write failed, retrying individually", extra={"error": str(e)})
+            for conversation_id, rows, future in batch:
+                try:
+                    await _write_messages(conversation_id, rows)
+                    if not future.done():
+                        future.set_result(None)
+                except Exception as row_error:
+                    if not future.done():
+                        future.set_exception(row_error)
+
+    @timed("db.write_batch")
+    async def _write_batch(self, batch: list):
+        message_args = [
+            (row["id"], row["conversation_id"], row["role"], row["content"], row["input_method"], row["created_at"])
+            for _, rows, _ in batch
+            for row in rows
+        ]
+        update_args = [
+            (
+                conversation_id,
+                len(rows),
+                max(row["created_at"] for row in rows),
+                next((row["content"] for row in rows if row["role"] == "user"), None)
+            )
+            for conversation_id, rows, _ in batch
+        ]
+
+        async with database.connection() as connection:
+            async with connection.transaction():
+                raw = connection.raw_connection
+                await raw.executemany(
+                    """
+                    INSERT INTO messages (id, conversation_id, role, content, input_method, created_at)
+                    VALUES ($1, $2, $3, $4, $5, $6)
+                    """,
+                    message_args
+                )
+                await raw.executemany(
+                    """
+                    UPDATE conversations
+                    SET
+                        message_count = message_count + $2,
+                        last_message_at = GREATEST(last_message_at, $3),
+                        first_question = COALESCE(first_question, $4)
+                    WHERE id = $1
+                    """,
+                    update_args
+                )
+                await raw.execute(
+                    """
+                    UPDATE user_stats s
+                    SET message_count = s.message_count + added.count
+                    FROM (
+                        SELECT c.user_id, SUM(batch.count) AS count
+                        FROM unnest($1::uuid[], $2::bigint[]) AS batch (conversation_id, count)
+                        JOIN conversations c ON c.id = batch.conversation_id
+                        GROUP BY c.user_id
+                    ) added
+                    WHERE s.user_id = added.user_id
+                    """,
+                    [conversation_id for conversation_id, _, _, _ in update_args],
+                    [count for _, count, _, _ in update_args]
+                )
+
+        self.flushes += 1
+        self.messages_written += len(message_args)
+
+message_buffer = MessageWriteBuffer(MESSAGE_FLUSH_INTERVAL_MS, MESSAGE_FLUSH_MAX_BATCH)
+
+@timed("db.save_messages")
+async def save_messages(conversation_id: str, messages: list):
+    """Atomically save several messages (e.g. a question and its answer)
+
+    `messages` is a list of dicts with role, content and optionally
+    input_method and created_at. The inserts and the conversation counters
+    are written together, so message_count can never drift.
+    """
+    if not database or not conversation_id or not messages:
+        return
+
+    try:
+        rows = _message_rows(conversation_id, messages)
+        if MESSAGE_WRITE_BEHIND:
+            await message_buffer.write(conversation_id, rows)
+        else:
+            await _write_messages(conversation_id, rows)
+
+        logger.debug("Saved messages", extra={"conversation_id": conversation_id, "count": len(rows)})
+    except Exception as e:
+        logger.error("Error saving messages", extra={"conversation_id": conversation_id, "error": str(e)})
+
 async def save_message(
     conversation_id: str,
     role: str,
     content: str,
     input_method: str = "text"
 ):
-    """Save a message to the database"""
-    if not database or not conversation_id:
-        return
-        
+    """Save a single message to the database"""
+    await save_messages(conversation_id, [
+        {"role": role, "content": content, "input_method": input_method}
+    ])
+
+def encode_cursor(started_at: datetime, conversation_id) -> str:
+    """Opaque keyset cursor for the conversation list"""
+    raw = f"{started_at.isoformat()}|{conversation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(started_at, conversation_id) of a cursor; ValueError if it is not one encode_cursor made"""
     try:
-        query = """
-        INSERT INTO messages (id, conversation_id, role, content, input_method, created_at)
-        VALUES (:id, :conversation_id, :role, :content, :input_method, :created_at)
-        """
-        
-        await database.execute(
-            query=query,
-            values={
-                "id": str(uuid.uuid4()),
-                "conversation_id": conversation_id,
-                "role": role,
-                "content": content,
-                "input_method": input_method,
-                "created_at": datetime.now()
-            }
-        )
-        
-        # Update message count
-        await database.execute(
-            query="UPDATE conversations SET message_count = message_count + 1 WHERE id = :id",
-            values={"id": conversation_id}
-        )
-        
-        print(f"✅ Saved {role} message to conversation {conversation_id}")
-    except Exception as e:
-        print(f"Error saving message: {e}")
+        started_at, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(started_at), uuid.UUID(conversation_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+@timed("db.get_conversations")
+async def get_conversations(limit: int = 50, cursor: str = None):
+    """Get recent conversations, newest first, one keyset page at a time
+
+    Returns the page and the cursor for the next one (None on the last page).
+    Pages are read straight off the (user_id, started_at, id) index, so the
+    cost is the same however deep the user scrolls. Raises ValueError for a
+    malformed cursor.
+    """
+    values = {"user_id": DEFAULT_USER_ID, "limit": limit + 1}
+    keyset = ""
+    if cursor:
+        values["cursor_started_at"], values["cursor_id"] = decode_cursor(cursor)
+        keyset = "AND (c.started_at, c.id) < (:cursor_started_at, :cursor_id)"
 
-async def get_conversations(limit: int = 50):
-    """Get recent conversations"""
     if not database:
-        return []
-        
+        return [], None
+
     try:
-        query = """
-        SELECT 
+
+        query = f"""
+        SELECT
             c.id,
             c.article_url,
             c.article_title,
             c.started_at,
             c.message_count,
-            (SELECT content FROM messages WHERE conversation_id = c.id AND role = 'user' ORDER BY created_at ASC LIMIT 1) as first_question
+            c.first_question,
+            c.last_message_at
         FROM conversations c
         WHERE c.user_id = :user_id
-        ORDER BY c.started_at DESC
+        {keyset}
+        ORDER BY c.started_at DESC, c.id DESC
         LIMIT :limit
         """
-        
-        results = await database.fetch_all(
-            query=query,
-            values={"user_id": DEFAULT_USER_ID, "limit": limit}
-        )
-        
-        return [dict(row) for row in results]
+
+        results = await database.fetch_all(query=query, values=values)
+
+        rows = [dict(row) for row in results]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["started_at"], rows[-1]["id"])
+        return rows, next_cursor
     except Exception as e:
-        print(f"Error fetching conversations: {e}")
-        return []
+        logger.error("Error fetching conversations", extra={"error": str(e)})
+        return [], None
 
+@timed("db.get_conversation_messages")
 async def get_conversation_messages(conversation_id: str):
-    """Get all messages in a conversation"""
+    """Get all messages in a conversation, including any moved to the archive"""
     if not database:
         return []
         
     try:
+        archived = await get_archived_messages(conversation_id)
+
         query = """
         SELECT 
             id,
@@ -163,81 +393,473 @@ async def get_conversation_messages(conversation_id: str):
             values={"conversation_id": conversation_id}
         )
         
-        return [dict(row) for row in results]
+        return archived + [dict(row) for row in results]
     except Exception as e:
-        print(f"Error fetching messages: {e}")
+        logger.error("Error fetching messages", extra={"conversation_id": conversation_id, "error": str(e)})
         return []
 
-async def search_conversations(query_text: str, limit: int = 10):
-    """Search conversations by content"""
+@timed("db.get_conversation_memory")
+async def get_conversation_memory(conversation_id: str, limit: int = None):
+    """Get a conversation's rolling summary and the messages it does not cover yet
+
+    Returns {"summary", "summarized_until", "messages"} with messages oldest
+    first; with limit, only the most recent ones. None if the conversation
+    does not exist.
+    """
     if not database:
-        return []
-        
+        return None
+
     try:
-        query = """
-        SELECT DISTINCT
-            c.id,
-            c.article_url,
-            c.article_title,
-            c.started_at,
-            c.message_count
+        query = f"""
+        SELECT
+            c.memory_summary,
+            c.memory_summarized_until,
+            m.role,
+            m.content,
+            m.created_at
         FROM conversations c
-        JOIN messages m ON m.conversation_id = c.id
-        WHERE 
-            c.user_id = :user_id
-            AND (
-                m.content ILIKE :search
-                OR c.article_title ILIKE :search
+        LEFT JOIN LATERAL (
+            SELECT role, content, created_at
+            FROM messages
+            WHERE conversation_id = c.id
+                AND created_at > COALESCE(c.memory_summarized_until, '-infinity'::timestamp)
+            ORDER BY created_at DESC
+            {"LIMIT :limit" if limit else ""}
+        ) m ON TRUE
+        WHERE c.id = :conversation_id
+        """
+
+        values = {"conversation_id": conversation_id}
+        if limit:
+            values["limit"] = limit
+        results = await database.fetch_all(query=query, values=values)
+        if not results:
+            return None
+
+        return {
+            "summary": results[0]["memory_summary"],
+            "summarized_until": results[0]["memory_summarized_until"],
+            "messages": [
+                {"role": row["role"], "content": row["content"], "created_at": row["created_at"]}
+                for row in reversed(results) if row["role"] is not None
+            ]
+        }
+    except Exception as e:
+        logger.error("Error fetching conversation memory", extra={"conversation_id": conversation_id, "error": str(e)})
+        return None
+
+@timed("db.save_conversation_memory")
+async def save_conversation_memory(conversation_id: str, summary: str, summarized_until: datetime,
+                                   previous_until: datetime) -> bool:
+    """Store a new rolling summary unless another worker moved it on since previous_until"""
+    if not database:
+        return False
+
+    try:
+        result = await database.fetch_one(
+            query="""
+            UPDATE conversations
+            SET memory_summary = :summary, memory_summarized_until = :until
+            WHERE id = :conversation_id
+                AND memory_summarized_until IS NOT DISTINCT FROM :previous_until
+            RETURNING id
+            """,
+            values={
+                "conversation_id": conversation_id,
+                "summary": summary,
+                "until": summarized_until,
+                "previous_until": previous_until
+            }
+        )
+        return result is not None
+    except Exception as e:
+        logger.error("Error saving conversation memory", extra={"conversation_id": conversation_id, "error": str(e)})
+        return False
+
+# ============================================
+# EXPORT / IMPORT
+# ============================================
+
+IMPORT_NAMESPACE = uuid.UUID("6f1d7a52-3c1e-4c8e-9a57-2b0f4f6c9d10")
+
+async def iterate_conversation_export():
+    """Yield every conversation with its messages, newest conversation first
+
+    Rows come from a server-side cursor over conversations joined with
+    their messages, so only one conversation is held in memory at a time.
+    Archived messages are included; the archive is only selected on each
+    conversation's first row rather than repeated on every message row.
+    """
+    if not database:
+        return
+
+    query = """
+    SELECT
+        c.id,
+        c.article_url,
+        c.article_title,
+        c.started_at,
+        c.message_count,
+        c.first_question,
+        c.last_message_at,
+        m.id AS message_id,
+        m.role,
+        m.content,
+        m.input_method,
+        m.created_at,
+        CASE WHEN ROW_NUMBER() OVER (
+            PARTITION BY c.started_at, c.id ORDER BY m.created_at, m.id
+        ) = 1 THEN a.payload END AS archive
+    FROM conversations c
+    LEFT JOIN conversation_archive a ON a.conversation_id = c.id
+    LEFT JOIN messages m ON m.conversation_id = c.id
+    WHERE c.user_id = :user_id
+    ORDER BY c.started_at DESC, c.id DESC, m.created_at ASC, m.id ASC
+    """
+
+    def isoformat(value):
+        return value.isoformat() if value else None
+
+    conversation = None
+    try:
+        async for row in database.iterate(query=query, values={"user_id": DEFAULT_USER_ID}):
+            if conversation is None or conversation["id"] != str(row["id"]):
+                if conversation is not None:
+                    yield conversation
+                conversation = {
+                    "id": str(row["id"]),
+                    "article_url": row["article_url"],
+                    "article_title": row["article_title"],
+                    "started_at": isoformat(row["started_at"]),
+                    "message_count": row["message_count"],
+                    "first_question": row["first_question"],
+                    "last_message_at": isoformat(row["last_message_at"]),
+                    "messages": [
+                        dict(message, id=str(message["id"]), created_at=isoformat(message["created_at"]))
+                        for message in unpack_messages(row["archive"])
+                    ] if row["archive"] else []
+                }
+            if row["message_id"] is not None:
+                conversation["messages"].append({
+                    "id": str(row["message_id"]),
+                    "role": row["role"],
+                    "content": row["content"],
+                    "input_method": row["input_method"],
+                    "created_at": isoformat(row["created_at"])
+                })
+        if conversation is not None:
+            yield conversation
+    except Exception as e:
+        logger.error("Error exporting conversations", extra={"error": str(e)})
+        raise
+
+def _parse_timestamp(value):
+    """ISO timestamp (as exported, or with a Z suffix from the extension) to naive local time"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def _parse_uuid(value, *fallback_parts) -> uuid.UUID:
+    """The given ID if it is a UUID, else one derived from fallback_parts so re-imports match"""
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.uuid5(IMPORT_NAMESPACE, "|".join(str(part) for part in fallback_parts))
+
+def import_records(conversation: dict):
+    """Turn one exported conversation into (conversation record, message records) for COPY
+
+    Raises ValueError or KeyError for malformed input.
+    """
+    started_at = _parse_timestamp(conversation.get("started_at")) or datetime.now()
+    conversation_id = _parse_uuid(conversation.get("id"), conversation.get("article_url"), started_at.isoformat())
+
+    messages = []
+    for i, message in enumerate(conversation.get("messages") or []):
+        if message["role"] not in ("user", "assistant"):
+            raise ValueError(f"Unknown message role: {message['role']}")
+        created_at = _parse_timestamp(message.get("created_at")) or started_at + timedelta(microseconds=i)
+        messages.append((
+            _parse_uuid(message.get("id"), conversation_id, i),
+            conversation_id,
+            message["role"],
+            str(message["content"]),
+            message.get("input_method") or "text",
+            created_at,
+            i
+        ))
+
+    record = (
+        conversation_id,
+        conversation.get("article_url"),
+        conversation.get("article_title"),
+        started_at,
+        len(messages),
+        next((message[3] for message in messages if message[2] == "user"), None),
+        max((message[5] for message in messages), default=None)
+    )
+    return record, messages
+
+@timed("db.import_conversations")
+async def import_conversations(conversations: list, messages: list) -> dict:
+    """Bulk-load records from import_records() with COPY, in one transaction
+
+    Rows are copied into temporary staging tables and inserted from there.
+    A conversation that already exists (by ID) only gets the messages past
+    its stored message_count, so one continued since the last import is
+    brought up to date; message IDs are deterministic, so importing the same
+    export twice is harmless. Conversation rows and the stats rollup are
+    updated in the same statement.
+    """
+    if not database:
+        return {"conversations": 0, "messages": 0, "updated": 0, "skipped": len(conversations)}
+
+    async with database.connection() as connection:
+        async with connection.transaction():
+            raw = connection.raw_connection
+            await raw.execute("""
+            CREATE TEMP TABLE import_conversations (
+                id UUID, article_url TEXT, article_title TEXT, started_at TIMESTAMP,
+                message_count INT, first_question TEXT, last_message_at TIMESTAMP
+            ) ON COMMIT DROP;
+            CREATE TEMP TABLE import_messages (
+                id UUID, conversation_id UUID, role TEXT, content TEXT,
+                input_method TEXT, created_at TIMESTAMP, position INT
+            ) ON COMMIT DROP;
+            """)
+            await raw.copy_records_to_table("import_conversations", records=conversations)
+            await raw.copy_records_to_table("import_messages", records=messages)
+
+            result = await raw.fetchrow(
+                """
+                WITH existing AS (
+                    SELECT c.id, c.message_count
+                    FROM conversations c
+                    JOIN import_conversations i ON i.id = c.id
+                    FOR UPDATE OF c
+                ),
+                new_conversations AS (
+                    INSERT INTO conversations (
+                        id, user_id, article_url, article_title, started_at,
+                        message_count, first_question, last_message_at
+                    )
+                    SELECT
+                        id, $1, article_url, article_title, started_at,
+                        message_count, first_question, last_message_at
+                    FROM import_conversations
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING id, user_id
+                ),
+                new_messages AS (
+                    INSERT INTO messages (id, conversation_id, role, content, input_method, created_at)
+                    SELECT m.id, m.conversation_id, m.role, m.content, m.input_method, m.created_at
+                    FROM import_messages m
+                    LEFT JOIN existing e ON e.id = m.conversation_id
+                    WHERE m.position >= e.message_count
+                       OR m.conversation_id IN (SELECT id FROM new_conversations)
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING conversation_id, role, content, created_at
+                ),
+                appended AS (
+                    SELECT
+                        conversation_id,
+                        COUNT(*) AS count,
+                        MAX(created_at) AS last_message_at,
+                        (ARRAY_AGG(content ORDER BY created_at) FILTER (WHERE role = 'user'))[1] AS first_question
+                    FROM new_messages
+                    WHERE conversation_id IN (SELECT id FROM existing)
+                    GROUP BY conversation_id
+                ),
+                updated AS (
+                    UPDATE conversations c
+                    SET
+                        message_count = c.message_count + a.count,
+                        last_message_at = GREATEST(c.last_message_at, a.last_message_at),
+                        first_question = COALESCE(c.first_question, a.first_question)
+                    FROM appended a
+                    WHERE c.id = a.conversation_id
+                    RETURNING c.user_id, a.count
+                ),
+                added AS (
+                    SELECT user_id, 1 AS conversations, 0 AS messages FROM new_conversations
+                    UNION ALL
+                    SELECT c.user_id, 0, 1
+                    FROM new_messages m
+                    JOIN new_conversations c ON c.id = m.conversation_id
+                    UNION ALL
+                    SELECT user_id, 0, count FROM updated
+                ),
+                stats AS (
+                    INSERT INTO user_stats (user_id, conversation_count, message_count)
+                    SELECT user_id, SUM(conversations), SUM(messages)
+                    FROM added
+                    GROUP BY user_id
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        conversation_count = user_stats.conversation_count + EXCLUDED.conversation_count,
+                        message_count = user_stats.message_count + EXCLUDED.message_count
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM new_conversations) AS conversations,
+                    (SELECT COUNT(*) FROM new_messages) AS messages,
+                    (SELECT COUNT(*) FROM updated) AS updated
+                """,
+                uuid.UUID(DEFAULT_USER_ID)
             )
-        ORDER BY c.started_at DESC
-        LIMIT :limit
+
+    return {
+        "conversations": result["conversations"],
+        "messages": result["messages"],
+        "updated": result["updated"],
+        "skipped": len(conversations) - result["conversations"] - result["updated"]
+    }
+
+def build_prefix_tsquery(query_text: str) -> str:
+    """Turn free text into a tsquery that prefix-matches every word"""
+    terms = re.findall(r"\w+", query_text.lower())
+    return " & ".join(f"{term}:*" for term in terms)
+
+@timed("db.search_conversations")
+async def search_conversations(query_text: str, limit: int = 10, page: int = 1):
+    """Full-text search over message content and article titles
+
+    Results are ranked by ts_rank, carry a highlighted snippet of the best
+    matching message and are paginated. Matching uses the GIN-indexed
+    tsvector columns, so the cost does not grow with total history size.
+    """
+    if not database:
+        return [], False
+
+    tsquery = build_prefix_tsquery(query_text)
+    if not tsquery:
+        return [], False
+
+    try:
+        query = """
+        WITH q AS (
+            SELECT to_tsquery('english', :tsquery) AS query
+        ),
+        hits AS (
+            SELECT m.conversation_id, ts_rank(m.search_tsv, q.query) AS rank, m.content
+            FROM messages m
+            JOIN conversations c ON c.id = m.conversation_id, q
+            WHERE c.user_id = :user_id AND m.search_tsv @@ q.query
+            UNION ALL
+            SELECT c.id, ts_rank(c.title_tsv, q.query) * 2 AS rank, NULL
+            FROM conversations c, q
+            WHERE c.user_id = :user_id AND c.title_tsv @@ q.query
+            UNION ALL
+            -- Archived conversations are found through their digest
+            SELECT c.id, ts_rank(c.digest_tsv, q.query) AS rank, c.digest
+            FROM conversations c, q
+            WHERE c.user_id = :user_id AND c.digest_tsv @@ q.query
+        ),
+        ranked AS (
+            SELECT
+                conversation_id,
+                MAX(rank) AS rank,
+                (ARRAY_AGG(content ORDER BY rank DESC) FILTER (WHERE content IS NOT NULL))[1] AS best_content
+            FROM hits
+            GROUP BY conversation_id
+        ),
+        page AS (
+            SELECT
+                c.id,
+                c.article_url,
+                c.article_title,
+                c.started_at,
+                c.message_count,
+                r.rank,
+                r.best_content
+            FROM ranked r
+            JOIN conversations c ON c.id = r.conversation_id
+            ORDER BY r.rank DESC, c.started_at DESC
+            LIMIT :limit OFFSET :offset
+        )
+        SELECT
+            p.id,
+            p.article_url,
+            p.article_title,
+            p.started_at,
+            p.message_count,
+            p.rank,
+            ts_headline(
+                'english',
+                COALESCE(p.best_content, p.article_title),
+                q.query,
+                'StartSel=<mark>, StopSel=</mark>, MaxWords=25, MinWords=8, MaxFragments=2'
+            ) AS snippet
+        FROM page p, q
+        ORDER BY p.rank DESC, p.started_at DESC
         """
-        
-        search_pattern = f"%{query_text}%"
+
+        # Fetch one extra row to know whether another page exists
         results = await database.fetch_all(
             query=query,
             values={
                 "user_id": DEFAULT_USER_ID,
-                "search": search_pattern,
-                "limit": limit
+                "tsquery": tsquery,
+                "limit": limit + 1,
+                "offset": (max(page, 1) - 1) * limit
             }
         )
-        
-        return [dict(row) for row in results]
+
+        rows = [dict(row) for row in results]
+        return rows[:limit], len(rows) > limit
     except Exception as e:
-        print(f"Error searching conversations: {e}")
-        return []
+        logger.error("Error searching conversations", extra={"error": str(e)})
+        return [], False
 
+@timed("db.delete_conversation")
 async def delete_conversation(conversation_id: str):
     """Delete a conversation and all its messages"""
     if not database:
         return False
         
     try:
-        # Messages will be auto-deleted due to CASCADE
+        # Messages will be auto-deleted due to CASCADE; the rollup is
+        # decremented in the same statement
         await database.execute(
-            query="DELETE FROM conversations WHERE id = :id",
+            query="""
+            WITH deleted AS (
+                DELETE FROM conversations WHERE id = :id RETURNING user_id, message_count
+            )
+            UPDATE user_stats s
+            SET
+                conversation_count = s.conversation_count - 1,
+                message_count = s.message_count - d.message_count
+            FROM deleted d
+            WHERE s.user_id = d.user_id
+            """,
             values={"id": conversation_id}
         )
-        print(f"✅ Deleted conversation: {conversation_id}")
+        logger.info("Deleted conversation", extra={"conversation_id": conversation_id})
         return True
     except Exception as e:
-        print(f"Error deleting conversation: {e}")
+        logger.error("Error deleting conversation", extra={"conversation_id": conversation_id, "error": str(e)})
         return False
 
+@timed("db.get_conversation_stats")
 async def get_conversation_stats():
-    """Get statistics about conversations"""
+    """Get statistics about conversations
+
+    Reads the user_stats rollup, which every conversation create/delete and
+    message write keeps current in the same statement or transaction, so
+    this is a primary-key lookup however much history there is.
+    """
     if not database:
         return {}
         
     try:
         query = """
-        SELECT 
-            COUNT(*) as total_conversations,
-            SUM(message_count) as total_messages,
-            AVG(message_count) as avg_messages_per_conversation
-        FROM conversations
-        WHERE user_id = :user_id
+        SELECT
+            COALESCE(s.conversation_count, 0) AS total_conversations,
+            s.message_count AS total_messages,
+            s.message_count::numeric / NULLIF(s.conversation_count, 0) AS avg_messages_per_conversation
+        FROM (SELECT CAST(:user_id AS uuid) AS user_id) u
+        LEFT JOIN user_stats s ON s.user_id = u.user_id
         """
         
         result = await database.fetch_one(
@@ -247,5 +869,366 @@ async def get_conversation_stats():
         
         return dict(result) if result else {}
     except Exception as e:
-        print(f"Error fetching stats: {e}")
-        return {}
\ No newline at end of file
+        logger.error("Error fetching stats", extra={"error": str(e)})
+        return {}
+
+# ============================================
+# ARCHIVE
+# ============================================
+
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "10"))
+
+def pack_messages(messages: list) -> bytes:
+    """zstd-compressed JSON of archived messages"""
+    rows = [
+        {
+            "id": str(message["id"]),
+            "role": message["role"],
+            "content": message["content"],
+            "input_method": message["input_method"],
+            "created_at": message["created_at"].isoformat()
+        }
+        for message in messages
+    ]
+    return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(json.dumps(rows).encode())
+
+def unpack_messages(payload: bytes) -> list:
+    """Archived messages in the shape get_conversation_messages() returns"""
+    rows = json.loads(zstandard.ZstdDecompressor().decompress(payload))
+    for row in rows:
+        row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return rows
+
+@timed("db.get_archived_messages")
+async def get_archived_messages(conversation_id: str) -> list:
+    """Rehydrate a conversation's archived messages, oldest first"""
+    if not database:
+        return []
+
+    result = await database.fetch_one(
+        query="SELECT payload FROM conversation_archive WHERE conversation_id = :conversation_id",
+        values={"conversation_id": conversation_id}
+    )
+    return unpack_messages(result["payload"]) if result else []
+
+@timed("db.get_retention_candidates")
+async def get_retention_candidates(older_than: datetime, limit: int) -> list:
+    """Conversations idle since before older_than that still have messages in the hot table"""
+    if not database:
+        return []
+
+    try:
+        results = await database.fetch_all(
+            query="""
+            SELECT c.id, c.last_message_at
+            FROM conversations c
+            WHERE c.last_message_at < :older_than
+              AND EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = c.id)
+            ORDER BY c.last_message_at
+            LIMIT :limit
+            """,
+            values={"older_than": older_than, "limit": limit}
+        )
+        return [dict(row) for row in results]
+    except Exception as e:
+        logger.error("Error fetching retention candidates", extra={"error": str(e)})
+        return []
+
+@timed("db.archive_conversation")
+async def archive_conversation(conversation_id: str, digest: str, until: datetime, previous_until: datetime):
+    """Move a conversation's messages up to until into its compressed archive
+
+    digest becomes the conversation's stored digest and rolling memory
+    summary, covering everything up to until. Like save_conversation_memory
+    this is a compare-and-set on the summary's timestamp, and returns None
+    if it moved since previous_until. Otherwise returns (messages archived,
+    archive size uncompressed, archive size compressed). Messages newer than
+    until stay where they are. message_count and the stats rollup count
+    archived messages too, so neither changes.
+    """
+    async with database.transaction():
+        locked = await database.fetch_one(
+            query="""
+            SELECT id FROM conversations
+            WHERE id = :conversation_id
+                AND memory_summarized_until IS NOT DISTINCT FROM :previous_until
+            FOR UPDATE
+            """,
+            values={"conversation_id": conversation_id, "previous_until": previous_until}
+        )
+        if locked is None:
+            return None
+
+        values = {"conversation_id": conversation_id, "until": until}
+        rows = await database.fetch_all(
+            query="""
+            SELECT id, role, content, input_method, created_at
+            FROM messages
+            WHERE conversation_id = :conversation_id AND created_at <= :until
+            ORDER BY created_at ASC
+            """,
+            values=values
+        )
+        if not rows:
+            return 0, 0, 0
+
+        # A conversation continued after it was archived adds to the same archive
+        messages = await get_archived_messages(conversation_id) + [dict(row) for row in rows]
+        payload = pack_messages(messages)
+        await database.execute(
+            query="""
+            INSERT INTO conversation_archive (conversation_id, message_count, payload)
+            VALUES (:conversation_id, :message_count, :payload)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                message_count = EXCLUDED.message_count,
+                payload = EXCLUDED.payload,
+                archived_at = NOW()
+            """,
+            values={"conversation_id": conversation_id, "message_count": len(messages), "payload": payload}
+        )
+        await database.execute(
+            query="DELETE FROM messages WHERE conversation_id = :conversation_id AND created_at <= :until",
+            values=values
+        )
+        await database.execute(
+            query="""
+            UPDATE conversations
+            SET
+                digest = :digest,
+                archived_at = :archived_at,
+                memory_summary = :digest,
+                memory_summarized_until = :until
+            WHERE id = :conversation_id
+            """,
+            values=dict(values, digest=digest, archived_at=datetime.now())
+        )
+
+    return len(rows), zstandard.frame_content_size(payload), len(payload)
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+
+@timed("db.get_cached_response")
+async def get_cached_response(cache_key: str, max_age_seconds: float):
+    """Fetch a cached LLM response younger than max_age_seconds"""
+    if not database:
+        return None
+
+    try:
+        query = """
+        SELECT value
+        FROM response_cache
+        WHERE cache_key = :cache_key
+            AND created_at > NOW() - make_interval(secs => :max_age)
+        """
+
+        result = await database.fetch_one(
+            query=query,
+            values={"cache_key": cache_key, "max_age": max_age_seconds}
+        )
+
+        return json.loads(result["value"]) if result else None
+    except Exception as e:
+        logger.error("Error reading response cache", extra={"error": str(e)})
+        return None
+
+@timed("db.save_cached_response")
+async def save_cached_response(cache_key: str, prompt_version: str, value: dict):
+    """Store an LLM response in the shared cache"""
+    if not database:
+        return
+
+    try:
+        query = """
+        INSERT INTO response_cache (cache_key, prompt_version, value, created_at)
+        VALUES (:cache_key, :prompt_version, :value, NOW())
+        ON CONFLICT (cache_key) DO UPDATE
+            SET value = EXCLUDED.value, prompt_version = EXCLUDED.prompt_version, created_at = NOW()
+        """
+
+        await database.execute(
+            query=query,
+            values={
+                "cache_key": cache_key,
+                "prompt_version": prompt_version,
+                "value": json.dumps(value)
+            }
+        )
+    except Exception as e:
+        logger.error("Error writing response cache", extra={"error": str(e)})
+
+@timed("db.purge_stale_responses")
+async def purge_stale_responses(prompt_version: str):
+    """Drop cached responses produced by an older prompt template"""
+    if not database:
+        return 0
+
+    try:
+        result = await database.fetch_one(
+            query="""
+            WITH deleted AS (
+                DELETE FROM response_cache WHERE prompt_version <> :prompt_version RETURNING 1
+            )
+            SELECT COUNT(*) AS count FROM deleted
+            """,
+            values={"prompt_version": prompt_version}
+        )
+        return result["count"] if result else 0
+    except Exception as e:
+        logger.error("Error purging response cache", extra={"error": str(e)})
+        return 0
+
+# ============================================
+# ARTICLES
+# ============================================
+
+@timed("db.save_article")
+async def save_article(article_id: str, title: str, url: str, content: str):
+    """Store extracted article text under its content hash"""
+    if not database:
+        return
+
+    try:
+        await database.execute(
+            query="""
+            INSERT INTO articles (id, title, url, content)
+            VALUES (:id, :title, :url, :content)
+            ON CONFLICT (id) DO NOTHING
+            """,
+            values={"id": article_id, "title": title, "url": url, "content": content}
+        )
+    except Exception as e:
+        logger.error("Error saving article", extra={"article_id": article_id, "error": str(e)})
+
+@timed("db.get_article")
+async def get_article(article_id: str):
+    """Fetch a registered article by its content hash"""
+    if not database:
+        return None
+
+    try:
+        result = await database.fetch_one(
+            query="SELECT title, url, content FROM articles WHERE id = :id",
+            values={"id": article_id}
+        )
+        return dict(result) if result else None
+    except Exception as e:
+        logger.error("Error fetching article", extra={"article_id": article_id, "error": str(e)})
+        return None
+
+@timed("db.get_article_fingerprint")
+async def get_article_fingerprint(content_hash: str):
+    """The canonical article an exact content hash was resolved to before, if any"""
+    if not database:
+        return None
+
+    try:
+        result = await database.fetch_one(
+            query="SELECT article_id, canonical_hash FROM article_fingerprints WHERE content_hash = :content_hash",
+            values={"content_hash": content_hash}
+        )
+        return dict(result) if result else None
+    except Exception as e:
+        logger.error("Error fetching article fingerprint", extra={"error": str(e)})
+        return None
+
+@timed("db.find_similar_fingerprints")
+async def find_similar_fingerprints(bands: list, limit: int = 50) -> list:
+    """Canonical articles sharing at least one SimHash band with a fingerprint
+
+    Candidates only; the caller checks the Hamming distance.
+    """
+    if not database:
+        return []
+
+    try:
+        rows = await database.fetch_all(
+            query="""
+            SELECT content_hash, article_id, canonical_url, simhash
+            FROM article_fingerprints
+            WHERE content_hash = canonical_hash
+              AND (band0 = :band0 OR band1 = :band1 OR band2 = :band2 OR band3 = :band3)
+            LIMIT :limit
+            """,
+            values={"band0": bands[0], "band1": bands[1], "band2": bands[2], "band3": bands[3], "limit": limit}
+        )
+        return [dict(row) for row in rows]
+    except Exception as e:
+        logger.error("Error finding similar fingerprints", extra={"error": str(e)})
+        return []
+
+async def save_article_fingerprint(content_hash: str, article_id: str, canonical_hash: str,
+                                   canonical_url: str, simhash: int, bands: list):
+    """Record which canonical article a content hash resolves to"""
+    if not database:
+        return
+
+    try:
+        await database.execute(
+            query="""
+            INSERT INTO article_fingerprints (
+                content_hash, article_id, canonical_hash, canonical_url, simhash, band0, band1, band2, band3
+            )
+            VALUES (
+                :content_hash, :article_id, :canonical_hash, :canonical_url, :simhash, :band0, :band1, :band2, :band3
+            )
+            ON CONFLICT (content_hash) DO NOTHING
+            """,
+            values={
+                "content_hash": content_hash,
+                "article_id": article_id,
+                "canonical_hash": canonical_hash,
+                "canonical_url": canonical_url,
+                "simhash": simhash,
+                "band0": bands[0] if bands else None,
+                "band1": bands[1] if bands else None,
+                "band2": bands[2] if bands else None,
+                "band3": bands[3] if bands else None
+            }
+        )
+    except Exception as e:
+        logger.error("Error saving article fingerprint", extra={"error": str(e)})
+
+# ============================================
+# LEASES
+# ============================================
+
+async def try_acquire_lease(key: str, holder: str, ttl: float) -> bool:
+    """Take the lease on key for ttl seconds unless someone else holds an unexpired one
+
+    A lease is a row, not a session lock, so no connection is held while it
+    is owned. Returns True when the caller may proceed, including when the
+    query itself fails (coordination is an optimisation, not a guarantee).
+    """
+    if not database:
+        return True
+
+    try:
+        result = await database.fetch_one(
+            query="""
+            INSERT INTO leases (key, holder, expires_at)
+            VALUES (:key, :holder, NOW() + make_interval(secs => :ttl))
+            ON CONFLICT (key) DO UPDATE
+                SET holder = EXCLUDED.holder, expires_at = EXCLUDED.expires_at
+                WHERE leases.expires_at < NOW()
+            RETURNING holder
+            """,
+            values={"key": key, "holder": holder, "ttl": ttl}
+        )
+        return result is not None
+    except Exception as e:
+        logger.error("Error taking lease", extra={"error": str(e)})
+        return True
+
+async def release_lease(key: str, holder: str):
+    if not database:
+        return
+
+    try:
+        await database.execute(
+            query="DELETE FROM leases WHERE key = :key AND holder = :holder",
+            values={"key": key, "holder": holder}
+        )
+    except Exception as e:
+        logger.error("Error releasing lease", extra={"error": str(e)})
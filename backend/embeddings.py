@@ -0,0 +1,134 @@
+"""
+Embedding service: a memoizing cache plus an async micro-batcher.
+
+Texts are cached under the hash of their whitespace-normalized form.
+Misses that arrive within EMBEDDING_BATCH_WINDOW_MS of each other are merged
+into one `embeddings.create(input=[...])` call, and concurrent requests for
+the same text share a single pending result.
+"""
+import asyncio
+import hashlib
+import os
+from array import array
+
+from cache import TieredCache
+from clients import create_embeddings
+from tokens import truncate_to_tokens
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(24 * 3600)))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "64"))
+# Input limit of the embedding model
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, float("inf"))
+
+def text_key(text: str) -> str:
+    """Hash of the whitespace-normalized text"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+class EmbeddingService:
+    def __init__(self, model: str, cache_size: int, cache_ttl: float,
+                 window_ms: float, max_batch: int):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        # Vectors are kept as float32 arrays to keep the cache compact, and
+        # stored in the shared tier as their raw bytes
+        self.cache = TieredCache(
+            "embeddings", cache_size, cache_ttl,
+            encode=lambda vector: vector.tobytes(), decode=lambda data: array("f", data)
+        )
+        self._pending = {}
+        self._queue = []
+        self._flush_handle = None
+        self.batches = 0
+        self.batched_texts = 0
+        self.max_batch_seen = 0
+        self.shared_in_flight = 0
+        self.batch_size_counts = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+
+    async def embed(self, text: str) -> list:
+        """Embed one text, served from cache or merged into the next batch"""
+        key = text_key(text)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached.tolist()
+
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            self._queue.append((key, truncate_to_tokens(text, EMBEDDING_MAX_INPUT_TOKENS, self.model)))
+            if len(self._queue) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        else:
+            self.shared_in_flight += 1
+
+        vector = await asyncio.shield(future)
+        return vector.tolist()
+
+    async def embed_many(self, texts: list) -> list:
+        """Embed several texts; they share batches with any concurrent callers"""
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: list):
+        self._record_batch(len(batch))
+        error = None
+        try:
+            response = await create_embeddings([text for _, text in batch], model=self.model)
+            items = sorted(response.data, key=lambda item: item.index)
+            for (key, _), item in zip(batch, items):
+                vector = array("f", item.embedding)
+                self.cache.set(key, vector)
+                self._pending.pop(key).set_result(vector)
+        except Exception as e:
+            error = e
+        finally:
+            # Anything still pending failed or was missing from the response
+            for key, _ in batch:
+                future = self._pending.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(error or RuntimeError("Embedding missing from batch response"))
+
+    def _record_batch(self, size: int):
+        self.batches += 1
+        self.batched_texts += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self.batch_size_counts[bucket] += 1
+                break
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "batches": self.batches,
+            "texts_embedded": self.batched_texts,
+            "avg_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "batch_size_histogram": {f"le_{bucket}": count for bucket, count in self.batch_size_counts.items()},
+            "shared_in_flight": self.shared_in_flight
+        }
+
+embedding_service = EmbeddingService(
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    EMBEDDING_BATCH_WINDOW_MS,
+    EMBEDDING_MAX_BATCH
+)
@@ -0,0 +1,169 @@
+"""
+Near-duplicate article detection.
+
+The same article often arrives under several URLs (tracking parameters, AMP
+pages, mobile hosts) and, when syndicated, with slightly different text.
+Each copy would otherwise be analyzed, embedded and upserted on its own.
+
+URLs are canonicalised before they become RAG article IDs, and the content
+gets a 64-bit SimHash over word shingles. The fingerprint is split into four
+16-bit bands stored in the shared `article_fingerprints` table; two texts
+within FINGERPRINT_MAX_DISTANCE bits (at most 3) share at least one band
+exactly, so an indexed band lookup finds every candidate. A text that
+matches resolves to the first copy's article ID and content hash, so it is
+served that copy's cached analysis and vectors.
+
+Resolutions are cached in the tiered cache by exact content hash, so an
+article is only fingerprinted once per host.
+"""
+import hashlib
+import logging
+import os
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
+
+from cache import TieredCache
+from database import find_similar_fingerprints, get_article_fingerprint, save_article_fingerprint
+
+FINGERPRINT_MAX_DISTANCE = min(int(os.getenv("FINGERPRINT_MAX_DISTANCE", "3")), 3)
+FINGERPRINT_CACHE_SIZE = int(os.getenv("FINGERPRINT_CACHE_SIZE", "2048"))
+FINGERPRINT_CACHE_TTL = float(os.getenv("FINGERPRINT_CACHE_TTL", str(24 * 3600)))
+# Too few shingles make SimHash unreliable; short texts only match exactly
+MIN_SHINGLES = 50
+SHINGLE_WORDS = 3
+BAND_BITS = 16
+
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src", "amp"}
+TRACKING_PREFIXES = ("utm_",)
+HOST_PREFIXES = ("www.", "m.", "amp.", "mobile.")
+
+logger = logging.getLogger(__name__)
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so tracking, AMP and mobile variants of a page compare equal"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r"/amp/?$", "", parts.path)
+    path = re.sub(r"\.amp(\.html?)?$", r"\1", path) or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urlunsplit(("https" if parts.scheme in ("http", "https") else parts.scheme, host, path, urlencode(query), ""))
+
+def simhash(text: str):
+    """64-bit SimHash of the text's word shingles, or None if it is too short"""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    digests = b"".join(hashlib.blake2b(shingle.encode(), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), 8), axis=1)
+    # Each bit is set where most shingle hashes have it set
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+def bands(fingerprint: int) -> list:
+    return [(fingerprint >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(4)]
+
+def to_signed(fingerprint: int) -> int:
+    """Fit a 64-bit fingerprint into a Postgres BIGINT"""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & ((1 << 64) - 1)).bit_count()
+
+class ArticleIndex:
+    def __init__(self, max_distance: int, cache_size: int, cache_ttl: float):
+        self.max_distance = max_distance
+        self.memory = TieredCache("fingerprints", cache_size, cache_ttl)
+        self.resolved = 0
+        self.db_hits = 0
+        self.new = 0
+        self.url_duplicates = 0
+        self.near_duplicates = 0
+
+    async def resolve(self, url: str, content: str) -> dict:
+        """The canonical identity of an article: its RAG article ID and the
+        content hash its cached responses are keyed on
+
+        duplicate is True when the content was matched to an earlier copy.
+        """
+        self.resolved += 1
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        identity = await self.memory.get(content_hash)
+        if identity is not None:
+            return identity
+
+        known = await get_article_fingerprint(content_hash)
+        if known is not None:
+            self.db_hits += 1
+            identity = {
+                "article_id": known["article_id"],
+                "content_hash": known["canonical_hash"],
+                "duplicate": known["canonical_hash"] != content_hash
+            }
+            self.memory.set(content_hash, identity)
+            return identity
+
+        url = canonical_url(url)
+        article_id = hashlib.md5(url.encode()).hexdigest()
+        fingerprint = simhash(content)
+        match = await self._find_match(fingerprint, url) if fingerprint is not None else None
+
+        if match is not None:
+            identity = {"article_id": match["article_id"], "content_hash": match["content_hash"], "duplicate": True}
+            if match["canonical_url"] == url:
+                self.url_duplicates += 1
+            else:
+                self.near_duplicates += 1
+            logger.info("Near-duplicate article", extra={"url": url, "canonical_url": match["canonical_url"]})
+        else:
+            identity = {"article_id": article_id, "content_hash": content_hash, "duplicate": False}
+            self.new += 1
+
+        await save_article_fingerprint(
+            content_hash, identity["article_id"], identity["content_hash"], url,
+            to_signed(fingerprint) if fingerprint is not None else None,
+            bands(fingerprint) if fingerprint is not None else None
+        )
+        self.memory.set(content_hash, identity)
+        return identity
+
+    async def _find_match(self, fingerprint: int, url: str):
+        """The closest indexed article within max_distance bits, preferring the same URL"""
+        best, best_key = None, None
+        for candidate in await find_similar_fingerprints(bands(fingerprint)):
+            distance = hamming(candidate["simhash"], fingerprint)
+            if distance > self.max_distance:
+                continue
+            key = (candidate["canonical_url"] != url, distance)
+            if best is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "resolved": self.resolved,
+            "db_hits": self.db_hits,
+            "new": self.new,
+            "url_duplicates": self.url_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "max_distance": self.max_distance
+        }
+
+article_index = ArticleIndex(FINGERPRINT_MAX_DISTANCE, FINGERPRINT_CACHE_SIZE, FINGERPRINT_CACHE_TTL)
@@ -1,27 +1,72 @@
-from fastapi import FastAPI, HTTPException
+# Boot timing starts before the heavy imports below
+import time
+boot_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-import openai
+import asyncio
+import importlib
+import math
 import os
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 import hashlib
+import json
+import logging
 from datetime import datetime
 from typing import Optional, List
 
 # Import database functions
 from database import (
-    connect_db, disconnect_db,
-    create_conversation, save_message,
+    database, connect_db, disconnect_db,
+    create_conversation, save_messages,
     get_conversations, get_conversation_messages,
     search_conversations, delete_conversation,
-    get_conversation_stats
+    get_conversation_stats, iterate_conversation_export,
+    import_records, import_conversations
+)
+from clients import (
+    chat_completion, stream_chat_completion, close_clients, upstream_stats,
+    openai_upstream, pinecone_upstream
+)
+from upstream import BREAKER_RESET_TIMEOUT, CircuitOpenError
+from cache import LRUCache, response_cache, tiered_cache_stats, tiered_caches
+from chunking import split_into_chunks
+from embeddings import EMBEDDING_MODEL, embedding_service
+from tokens import load_encoder, count_message_tokens, count_tokens, token_usage
+from rag_queue import rag_queue
+from admission import AdmissionRejected, admission, client_key
+from articles import article_store
+from fingerprint import article_index
+from memory import conversation_memory
+from retention import retention
+from singleflight import singleflight, run_exclusive
+from middleware import GZipRequestMiddleware, MAX_DECOMPRESSED_IMPORT_BODY
+from readiness import boot
+from telemetry import MetricsMiddleware, configure_logging, render_metrics, stage, timed
+from vector_store import create_vector_store
+from prompts import (
+    CHAT_MODEL, ANSWER_MAX_TOKENS, ANALYSIS_MAX_TOKENS, TEMPERATURE,
+    ANALYSIS_RESPONSE_FORMAT, build_analysis_messages, build_question_messages,
+    parse_analysis, format_key_points, AnalysisStream
 )
 
 load_dotenv()
+configure_logging()
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Resonance API", version="0.3.0")
 
+# Middleware added later wraps what was added before. Gzip decoding sits
+# inside CORS so its 400/413 rejections still carry CORS headers.
+app.add_middleware(
+    GZipRequestMiddleware,
+    route_max_sizes={"/api/conversations/import": MAX_DECOMPRESSED_IMPORT_BODY}
+)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -30,63 +75,122 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
-# Initialize OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Vector store (Pinecone or local), set at startup once initialized;
+# None when RAG is disabled or the store failed to initialize
+vector_store = None
+warmup_task = None
 
-# Initialize Pinecone
-pc = None
-index = None
+# RAG configuration
+SIMILARITY_THRESHOLD = 0.7
+CHUNK_NAMESPACE = "chunks"
+CHUNK_TOP_K = int(os.getenv("CHUNK_TOP_K", "4"))
+RELATED_CHUNK_TOP_K = int(os.getenv("RELATED_CHUNK_TOP_K", "3"))
+UPSERT_BATCH_SIZE = 100
 
-try:
-    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-    if PINECONE_API_KEY:
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        
-        index_name = "resonance-articles"
-        
-        if index_name not in pc.list_indexes().names():
-            print(f"Creating Pinecone index: {index_name}")
-            pc.create_index(
-                name=index_name,
-                dimension=1536,
-                metric="cosine",
-                spec=ServerlessSpec(cloud="aws", region="us-east-1")
-            )
-        
-        index = pc.Index(index_name)
-        print("✅ Pinecone connected successfully")
-    else:
-        print("⚠️  Pinecone API key not found - RAG features disabled")
-except Exception as e:
-    print(f"⚠️  Pinecone initialization failed: {e}")
+# Articles whose current content has already been queued for chunk indexing
+indexed_chunks = LRUCache(4096, 24 * 3600)
+
+# /api/stats reports the vector counts (articles, chunks) from this cache
+# instead of asking the store on every poll
+VECTOR_COUNT_TTL = float(os.getenv("VECTOR_COUNT_TTL", "60"))
+vector_count_cache = LRUCache(2, VECTOR_COUNT_TTL)
+
+# Conversations per COPY batch when importing history
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = 10
 
 # Startup/Shutdown events
 @app.on_event("startup")
 async def startup():
-    """Connect to database on startup"""
-    await connect_db()
+    """Connect the database and vector store, then start the RAG workers, the
+    retention job and the background warm-up of the OpenAI client
+
+    Requests are only accepted once the stores they write to are connected.
+    """
+    global warmup_task
+    await asyncio.gather(warm_database(), warm_vector_store())
+    rag_queue.start(upsert_rag_jobs)
+    retention.start()
+    warmup_task = asyncio.create_task(warm_up())
+    boot.mark("started")
+
+async def warm_database():
+    async with boot.component("database") as state:
+        await connect_db()
+        if not database:
+            state["status"] = "disabled"
+        elif not database.is_connected:
+            state["status"] = "failed"
+        else:
+            # Drop cached responses from older prompt versions
+            await response_cache.invalidate_stale()
+
+async def warm_vector_store():
+    global vector_store
+    async with boot.component("vector_store") as state:
+        store = create_vector_store()
+        if store is None:
+            state["status"] = "disabled"
+            return
+        await store.initialize()
+        vector_store = store
+        state["backend"] = store.name
+
+async def warm_openai():
+    async with boot.component("openai"):
+        # Import the SDK off the event loop; the client itself is created on first use
+        await asyncio.to_thread(importlib.import_module, "openai")
+        # Load the tokenizers too (the first load may download them); token
+        # counts are estimated until they are ready
+        await asyncio.gather(*(asyncio.to_thread(load_encoder, model) for model in (CHAT_MODEL, EMBEDDING_MODEL)))
+
+async def warm_up():
+    """Load the OpenAI SDK and tokenizers, then mark the worker ready"""
+    await warm_openai()
+    boot.mark("ready")
 
 @app.on_event("shutdown")
 async def shutdown():
-    """Disconnect from database on shutdown"""
+    """Flush pending RAG writes, then disconnect from database and upstream clients"""
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        await asyncio.gather(warmup_task, return_exceptions=True)
+    await rag_queue.drain()
+    await retention.close()
+    await conversation_memory.close()
     await disconnect_db()
+    await close_clients()
 
 # Data Models
 class SummaryRequest(BaseModel):
     title: str
-    content: str
     url: str
+    content: Optional[str] = None
+    article_id: Optional[str] = None
     type: str = "summary"
     conversation_id: Optional[str] = None
 
 class QuestionRequest(BaseModel):
     question: str
     title: str
-    content: str
     url: str
+    content: Optional[str] = None
+    article_id: Optional[str] = None
     conversation_id: Optional[str] = None
 
+class AnalysisRequest(BaseModel):
+    title: str
+    url: str
+    content: Optional[str] = None
+    article_id: Optional[str] = None
+
+class ArticleRequest(BaseModel):
+    title: str
+    content: str
+    url: str
+
 class ConversationResponse(BaseModel):
     id: str
     article_title: str
@@ -94,68 +198,175 @@ class ConversationResponse(BaseModel):
     started_at: datetime
     message_count: int
     first_question: Optional[str] = None
+    last_message_at: Optional[datetime] = None
 
 # Helper Functions
-def generate_article_id(url: str) -> str:
-    return hashlib.md5(url.encode()).hexdigest()
-
-def get_embedding(text: str) -> list:
+async def get_embedding(text: str) -> list:
     try:
-        response = openai.embeddings.create(
-            model="text-embedding-ada-002",
-            input=text[:8000]
-        )
-        return response.data[0].embedding
+        return await embedding_service.embed(text)
     except Exception as e:
-        print(f"Embedding error: {e}")
+        logger.error("Embedding error", extra={"error": str(e)})
         return None
 
-def store_article_in_rag(article_id: str, title: str, url: str, content: str, summary: str):
-    if not index:
+def store_article_in_rag(article_id: str, title: str, url: str, content: str, summary: str,
+                         content_hash: str = None):
+    """Queue the article and its chunks for embedding and upsert by the background RAG workers"""
+    if not vector_store:
         return False
-    
+
+    store_article_chunks(article_id, title, url, content, split_into_chunks(content), content_hash)
+    return rag_queue.enqueue(article_id, {
+        "kind": "article",
+        "id": article_id,
+        "title": title,
+        "url": url,
+        "summary": summary,
+        "content": content,
+        "timestamp": datetime.now().isoformat()
+    })
+
+def store_article_chunks(article_id: str, title: str, url: str, content: str, chunks: list,
+                         content_hash: str = None):
+    """Queue the article's chunks for the chunk namespace, once per content version
+
+    content_hash identifies the version; near-duplicates pass their canonical
+    copy's, so they are not indexed again.
+    """
+    if not vector_store or not chunks:
+        return False
+
+    indexed_key = f"{article_id}:{content_hash or hashlib.md5(content.encode()).hexdigest()}"
+    if indexed_chunks.get(indexed_key):
+        return True
+    indexed_chunks.set(indexed_key, True)
+
+    return rag_queue.enqueue(f"{article_id}:chunks", {
+        "kind": "chunks",
+        "id": article_id,
+        "title": title,
+        "url": url,
+        "chunks": chunks
+    })
+
+async def upsert_rag_jobs(jobs: list):
+    """Embed a batch of queued RAG writes and upsert them in as few store calls as possible
+
+    Raises on failure so the queue can retry the batch.
+    """
+    articles = [job for job in jobs if job["kind"] == "article"]
+    chunk_jobs = [job for job in jobs if job["kind"] == "chunks"]
+
+    if articles:
+        texts = [f"{article['title']}\n\n{article['summary']}" for article in articles]
+        embeddings = await embedding_service.embed_many(texts)
+
+        await vector_store.upsert([
+            {
+                "id": article["id"],
+                "values": embedding,
+                "metadata": {
+                    "title": article["title"],
+                    "url": article["url"],
+                    "summary": article["summary"][:1000],
+                    "timestamp": article["timestamp"],
+                    "content_preview": article["content"][:500]
+                }
+            }
+            for article, embedding in zip(articles, embeddings)
+        ])
+        logger.info("Stored articles in RAG", extra={"count": len(articles)})
+
+    if chunk_jobs:
+        entries = [(job, i, chunk) for job in chunk_jobs for i, chunk in enumerate(job["chunks"])]
+        embeddings = await embedding_service.embed_many([chunk for _, _, chunk in entries])
+        vectors = [
+            {
+                "id": f"{job['id']}-{i}",
+                "values": embedding,
+                "metadata": {
+                    "article_id": job["id"],
+                    "title": job["title"],
+                    "url": job["url"],
+                    "chunk_index": i,
+                    "text": chunk
+                }
+            }
+            for (job, i, chunk), embedding in zip(entries, embeddings)
+        ]
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            await vector_store.upsert(
+                vectors[start:start + UPSERT_BATCH_SIZE],
+                namespace=CHUNK_NAMESPACE
+            )
+        logger.info("Stored chunks in RAG", extra={"count": len(vectors), "articles": len(chunk_jobs)})
+
+def cosine_similarity(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+async def embed_chunks(chunks: list):
     try:
-        text_to_embed = f"{title}\n\n{summary}"
-        embedding = get_embedding(text_to_embed)
-        
-        if not embedding:
-            return False
-        
-        index.upsert(vectors=[{
-            "id": article_id,
-            "values": embedding,
-            "metadata": {
-                "title": title,
-                "url": url,
-                "summary": summary[:1000],
-                "timestamp": datetime.now().isoformat(),
-                "content_preview": content[:500]
+        return await embedding_service.embed_many(chunks)
+    except Exception as e:
+        logger.error("Chunk embedding error", extra={"error": str(e)})
+        return None
+
+def select_article_chunks(chunks: list, chunk_embeddings: list, query_embedding: list,
+                          top_k: int = CHUNK_TOP_K) -> list:
+    """Pick the top_k chunks most similar to the query, returned in document order"""
+    if len(chunks) <= top_k or not chunk_embeddings or not query_embedding:
+        return chunks[:top_k]
+
+    scores = [cosine_similarity(query_embedding, embedding) for embedding in chunk_embeddings]
+    best = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)[:top_k]
+    return [chunks[i] for i in sorted(best)]
+
+@timed("rag.related_chunks")
+async def retrieve_related_chunks(query_embedding: list, article_id: str, top_k: int = RELATED_CHUNK_TOP_K):
+    """Find relevant chunks from other articles the user has read"""
+    if not vector_store or not vector_store.available or not query_embedding:
+        return []
+
+    try:
+        matches = await vector_store.query(
+            query_embedding,
+            top_k,
+            namespace=CHUNK_NAMESPACE,
+            filter={"article_id": {"$ne": article_id}}
+        )
+
+        return [
+            {
+                "article_id": match.metadata.get("article_id", ""),
+                "title": match.metadata.get("title", "Unknown"),
+                "url": match.metadata.get("url", ""),
+                "text": match.metadata.get("text", ""),
+                "similarity": match.score
             }
-        }])
-        print(f"✅ Stored article in RAG: {title}")
-        return True
+            for match in matches
+            if match.score > SIMILARITY_THRESHOLD
+        ]
     except Exception as e:
-        print(f"Error storing in RAG: {e}")
-        return False
+        logger.error("Error retrieving related chunks", extra={"error": str(e)})
+        return []
 
-def retrieve_similar_articles(query: str, top_k: int = 3):
-    if not index:
+@timed("rag.similar_articles")
+async def retrieve_similar_articles(query: str, top_k: int = 3):
+    # RAG context is optional: skip it while the vector store is failing
+    if not vector_store or not vector_store.available:
         return []
     
     try:
-        query_embedding = get_embedding(query)
+        query_embedding = await get_embedding(query)
         if not query_embedding:
             return []
         
-        results = index.query(
-            vector=query_embedding,
-            top_k=top_k,
-            include_metadata=True
-        )
+        matches = await vector_store.query(query_embedding, top_k)
         
         similar_articles = []
-        for match in results.matches:
-            if match.score > 0.7:
+        for match in matches:
+            if match.score > SIMILARITY_THRESHOLD:
                 similar_articles.append({
                     "title": match.metadata.get("title", "Unknown"),
                     "summary": match.metadata.get("summary", ""),
@@ -165,13 +376,21 @@ def retrieve_similar_articles(query: str, top_k: int = 3):
         
         return similar_articles
     except Exception as e:
-        print(f"Error retrieving similar articles: {e}")
+        logger.error("Error retrieving similar articles", extra={"error": str(e)})
         return []
 
+async def get_vector_count(namespace: str = "") -> int:
+    """Vectors in one namespace, cached for VECTOR_COUNT_TTL and fetched once per expiry"""
+    count = vector_count_cache.get(namespace)
+    if count is None:
+        count = await singleflight.do(f"vector_count:{namespace}", lambda: vector_store.count(namespace))
+        vector_count_cache.set(namespace, count)
+    return count
+
 # API Endpoints
 @app.get("/")
 async def root():
-    rag_status = "enabled" if index else "disabled"
+    rag_status = "enabled" if vector_store else "disabled"
     return {
         "message": "Resonance API is running",
         "version": "0.3.0",
@@ -182,160 +401,583 @@ async def root():
 
 @app.get("/health")
 async def health():
+    """Liveness: the worker is up and serving"""
     return {"status": "ok"}
 
-@app.post("/api/summarize")
-async def summarize(request: SummaryRequest):
-    """Summarize an article with RAG context and save to history"""
-    try:
-        article_id = generate_article_id(request.url)
-        
-        # Get or create conversation
-        conversation_id = request.conversation_id
-        if not conversation_id:
-            conversation_id = await create_conversation(request.url, request.title)
-        
-        # Retrieve similar articles
-        similar_articles = retrieve_similar_articles(request.title)
-        
-        # Build context
-        context = ""
-        if similar_articles:
-            context = "\n\nContext - You've previously read:\n"
-            for i, article in enumerate(similar_articles, 1):
-                context += f"{i}. \"{article['title']}\" - {article['summary'][:200]}...\n"
-        
-        # Format prompt
-        if request.type == "key-points":
-            system_prompt = "Extract key points as a bulleted list. Use format:\n• Point one\n• Point two"
-            user_prompt = f"Extract 5-7 key points:\n\nTitle: {request.title}\n\n{request.content[:4000]}"
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until the background warm-up has finished"""
+    report = boot.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker: stage and HTTP latency histograms, token counters"""
+    response_stats = response_cache.stats()
+    embedding_stats = embedding_service.stats()
+    return PlainTextResponse(render_metrics({
+        "resonance_response_cache_hits_total": response_stats["hits"],
+        "resonance_response_cache_misses_total": response_stats["misses"],
+        "resonance_embedding_cache_hits_total": embedding_stats["cache"]["hits"],
+        "resonance_embedding_cache_misses_total": embedding_stats["cache"]["misses"],
+        **{
+            f"resonance_cache_{name}_{tier}_{outcome}_total": stats[tier][outcome]
+            for name, stats in ((name, cache.stats()) for name, cache in tiered_caches.items())
+            for tier in ("l1", "l2")
+            for outcome in ("hits", "misses")
+        },
+        "resonance_rag_queue_pending": rag_queue.stats()["pending"],
+        "resonance_singleflight_in_flight": singleflight.stats()["in_flight"],
+        "resonance_admission_active": admission.active,
+        "resonance_admission_queued": admission.waiting,
+        "resonance_admission_rejected_total": admission.rate_limited + admission.queue_full + admission.queue_timeouts,
+        "resonance_openai_circuit_open": int(not openai_upstream.available),
+        "resonance_pinecone_circuit_open": int(not pinecone_upstream.available),
+        **{f"resonance_boot_{phase}_seconds": seconds for phase, seconds in boot.phases.items()}
+    }), media_type="text/plain; version=0.0.4")
+
+async def save_exchange(conversation_id: str, user_content: str, assistant_content: str,
+                        input_method: str, asked_at: datetime):
+    """Save the user's message and the assistant's reply in one atomic write"""
+    if conversation_id:
+        await save_messages(conversation_id, [
+            {"role": "user", "content": user_content, "input_method": input_method, "created_at": asked_at},
+            {"role": "assistant", "content": assistant_content, "input_method": input_method}
+        ])
+
+def summary_request_text(request: SummaryRequest) -> str:
+    return "Summarize this article" if request.type == "summary" else "Give me key points"
+
+# Reported for responses served from the cache
+NO_USAGE = {"prompt_tokens": 0, "completion_tokens": 0}
+
+def record_usage(endpoint: str, messages: list, response=None, completion: str = "") -> dict:
+    """Record a completion's token usage, as reported by the API or counted locally when streaming"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return token_usage.record(endpoint, usage.prompt_tokens, usage.completion_tokens)
+    return token_usage.record(
+        endpoint, count_message_tokens(messages, CHAT_MODEL), count_tokens(completion, CHAT_MODEL)
+    )
+
+async def resolve_article_content(request):
+    """Fill in request.content from a registered article when only article_id was sent"""
+    if request.content is not None:
+        return
+    if not request.article_id:
+        raise HTTPException(status_code=422, detail="Either content or article_id is required")
+
+    article = await article_store.get(request.article_id)
+    if article is None:
+        raise HTTPException(status_code=404, detail="Article not registered")
+    request.content = article["content"]
+
+async def start_summary(request: SummaryRequest):
+    """Get or create the conversation for a summary request"""
+    await resolve_article_content(request)
+    conversation_id = request.conversation_id
+    if not conversation_id:
+        conversation_id = await create_conversation(request.url, request.title)
+    return conversation_id
+
+async def generate_analysis(request, identity: dict, cache_key: str, on_delta=None) -> dict:
+    """Summary, key points and suggested questions from one structured-output completion
+
+    The article's chunks are embedded while similar articles are retrieved,
+    so both go upstream in one embeddings batch; the RAG write and later
+    questions about the article then find the chunk vectors cached. With
+    on_delta, the completion is streamed and on_delta is called with each
+    text delta of its JSON.
+    """
+    chunks = split_into_chunks(request.content)
+    similar_articles, _ = await asyncio.gather(
+        retrieve_similar_articles(request.title),
+        embed_chunks(chunks)
+    )
+    with stage("prompt.build"):
+        messages = build_analysis_messages(request.title, request.content, similar_articles)
+
+    completion = dict(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=ANALYSIS_MAX_TOKENS,
+        temperature=TEMPERATURE,
+        response_format=ANALYSIS_RESPONSE_FORMAT
+    )
+    async with admission.slot():
+        if on_delta is None:
+            response = await chat_completion(**completion)
+            content = response.choices[0].message.content
         else:
-            system_prompt = "You are a helpful reading assistant. Provide clear, concise summaries."
-            if similar_articles:
-                system_prompt += " When the user has read related articles, point out what's NEW or DIFFERENT."
-            user_prompt = f"{context}\n\nSummarize this article in 2-3 paragraphs:\n\nTitle: {request.title}\n\n{request.content[:4000]}"
-        
-        # Save user request
-        if conversation_id and request.type == "summary":
-            await save_message(conversation_id, "user", "Summarize this article", "button")
-        elif conversation_id:
-            await save_message(conversation_id, "user", "Give me key points", "button")
-        
-        # Call OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=400,
-            temperature=0.7
+            response, parts = None, []
+            async for delta in stream_chat_completion(**completion):
+                parts.append(delta)
+                on_delta(delta)
+            content = "".join(parts)
+
+    usage = record_usage("analyze", messages, response, content)
+    result = dict(parse_analysis(content), related_articles=len(similar_articles))
+    await response_cache.set(cache_key, result)
+
+    store_article_in_rag(
+        identity["article_id"], request.title, request.url, request.content, result["summary"],
+        identity["content_hash"]
+    )
+    return dict(result, usage=usage)
+
+def analysis_cache_key(identity: dict) -> str:
+    # Keyed on the canonical copy's content hash, so near-duplicates share it
+    return response_cache.key_for_hash(identity["content_hash"], "analysis")
+
+def analysis_text(analysis: dict, summary_type: str) -> str:
+    """The part of an analysis a summary or key-points request asked for"""
+    if summary_type == "key-points":
+        return format_key_points(analysis["key_points"])
+    return analysis["summary"]
+
+async def get_or_generate(cache_key: str, generate):
+    """Return (result, cached), generating at most once across concurrent identical requests"""
+    cached = await response_cache.get(cache_key)
+    if cached:
+        return cached, True
+
+    result = await singleflight.do(cache_key, lambda: run_exclusive(
+        cache_key,
+        generate,
+        lambda: response_cache.get(cache_key)
+    ))
+    return result, False
+
+async def queued_until_done(queue: asyncio.Queue, task: asyncio.Future):
+    """Yield items put on queue until task finishes, including any left when it does"""
+    while True:
+        getter = asyncio.ensure_future(queue.get())
+        await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter.done():
+            yield getter.result()
+            continue
+        getter.cancel()
+        while not queue.empty():
+            yield queue.get_nowait()
+        return
+
+async def prepare_question(request: QuestionRequest):
+    """Create the conversation and gather the chunks and conversation memory for the question"""
+    await resolve_article_content(request)
+
+    # Get or create conversation
+    conversation_id = request.conversation_id
+    if not conversation_id:
+        conversation_id = await create_conversation(request.url, request.title)
+
+    # Embed the question and the article's chunks in the same batch, while
+    # the earlier turns load (a new conversation has none)
+    identity = await article_index.resolve(request.url, request.content)
+    article_id = identity["article_id"]
+    chunks = split_into_chunks(request.content)
+    with stage("question.embed"):
+        query_embedding, chunk_embeddings, memory = await asyncio.gather(
+            get_embedding(request.question),
+            embed_chunks(chunks),
+            conversation_memory.load(request.conversation_id)
         )
-        
-        summary = response.choices[0].message.content
-        
-        # Save assistant response
-        if conversation_id:
-            await save_message(conversation_id, "assistant", summary, "button")
-        
-        # Store in RAG
-        if request.type == "summary":
-            store_article_in_rag(article_id, request.title, request.url, request.content, summary)
-        
+
+    excerpts = select_article_chunks(chunks, chunk_embeddings, query_embedding)
+    related_chunks = await retrieve_related_chunks(query_embedding, article_id)
+    store_article_chunks(article_id, request.title, request.url, request.content, chunks, identity["content_hash"])
+
+    with stage("prompt.build"):
+        messages = build_question_messages(
+            request.title, excerpts, request.question, related_chunks,
+            history=memory["messages"], history_summary=memory["summary"]
+        )
+    related_articles = len({chunk["article_id"] for chunk in related_chunks})
+
+    return conversation_id, related_articles, messages, memory
+
+def admit_client(request: Request):
+    """Per-client rate limit of the LLM endpoints"""
+    try:
+        admission.check_rate(client_key(request))
+    except AdmissionRejected as e:
+        raise request_error(e)
+
+def request_error(error: Exception) -> HTTPException:
+    """429 when admission control turned the request away, 503 while an
+    upstream's circuit breaker is open, otherwise a logged 500"""
+    if isinstance(error, AdmissionRejected):
+        return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+    if isinstance(error, CircuitOpenError):
+        return HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(int(BREAKER_RESET_TIMEOUT))}
+        )
+    logger.exception("Request failed")
+    return HTTPException(status_code=500, detail=str(error))
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def sse_response(events, ticket=None) -> StreamingResponse:
+    """Stream events; an admission ticket is released after the response even if it never started"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release) if ticket else None
+    )
+
+@app.post("/api/articles")
+async def register_article(request: ArticleRequest):
+    """Store an article's extracted text once; returns the ID to use in later calls
+
+    The body may be sent gzip-compressed (Content-Encoding: gzip).
+    """
+    try:
+        article_id = await article_store.register(request.title, request.url, request.content)
+        return {"success": True, "article_id": article_id}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/articles/{article_id}")
+async def article_exists(article_id: str):
+    """Check whether an article is registered, so clients can skip the upload"""
+    article = await article_store.get(article_id)
+    if article is None:
+        raise HTTPException(status_code=404, detail="Article not registered")
+    return {"success": True, "article_id": article_id, "title": article["title"]}
+
+@app.post("/api/analyze", dependencies=[Depends(admit_client)])
+async def analyze(request: AnalysisRequest):
+    """Summary, key points and suggested questions for an article from one completion
+
+    Nothing is saved to history, so clients can call this as soon as an
+    article is registered; /api/summarize then answers both the summary and
+    the key-points button from the cached analysis.
+    """
+    try:
+        await resolve_article_content(request)
+        identity = await article_index.resolve(request.url, request.content)
+        cache_key = analysis_cache_key(identity)
+        result, cached = await get_or_generate(cache_key, lambda: generate_analysis(request, identity, cache_key))
+
+        return {
+            "success": True,
+            "article_title": request.title,
+            "summary": result["summary"],
+            "key_points": result["key_points"],
+            "suggested_questions": result["suggested_questions"],
+            "related_articles": result["related_articles"],
+            "cached": cached,
+            "usage": result.get("usage", NO_USAGE)
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise request_error(e)
+
+@app.post("/api/summarize", dependencies=[Depends(admit_client)])
+async def summarize(request: SummaryRequest):
+    """Summarize an article (or list its key points) with RAG context and save to history
+
+    Both types are served from the article's analysis, so whichever button
+    is pressed second costs no completion.
+    """
+    try:
+        asked_at = datetime.now()
+        conversation_id = await start_summary(request)
+
+        identity = await article_index.resolve(request.url, request.content)
+        cache_key = analysis_cache_key(identity)
+        result, cached = await get_or_generate(cache_key, lambda: generate_analysis(request, identity, cache_key))
+        summary = analysis_text(result, request.type)
+
+        # Every user gets the exchange in their own history, even when coalesced
+        await save_exchange(conversation_id, summary_request_text(request), summary, "button", asked_at)
+
         return {
             "success": True,
             "summary": summary,
             "article_title": request.title,
             "type": request.type,
-            "related_articles": len(similar_articles),
-            "conversation_id": conversation_id
+            "related_articles": result["related_articles"],
+            "suggested_questions": result["suggested_questions"],
+            "conversation_id": conversation_id,
+            "cached": cached,
+            "usage": result.get("usage", NO_USAGE)
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise request_error(e)
 
-@app.post("/api/question")
-async def answer_question(request: QuestionRequest):
-    """Answer question with RAG context and save to history"""
+@app.post("/api/summarize/stream", dependencies=[Depends(admit_client)])
+async def summarize_stream(request: SummaryRequest):
+    """Stream a summary as Server-Sent Events
+
+    Emits a `meta` event first, one `token` event per text delta, and a
+    final `done` event once the summary (or key points) has been saved.
+    Like /api/summarize it is served from the article's analysis, so the
+    other button then costs no completion. On a miss the analysis completion
+    is streamed and the requested field is forwarded as it arrives. A cached
+    analysis, or one another request is already generating, arrives as a
+    single token event.
+    """
     try:
-        # Get or create conversation
-        conversation_id = request.conversation_id
-        if not conversation_id:
-            conversation_id = await create_conversation(request.url, request.title)
-        
-        # Save user question
-        if conversation_id:
-            await save_message(conversation_id, "user", request.question, "text")
-        
-        # Retrieve similar articles
-        similar_articles = retrieve_similar_articles(request.question)
-        
-        # Build context
-        context = ""
-        if similar_articles:
-            context = "\n\nAdditional context from reading history:\n"
-            for article in similar_articles:
-                context += f"- You previously read \"{article['title']}\": {article['summary'][:150]}...\n"
-        
-        # Build prompt
-        system_prompt = "You are a helpful reading assistant. Answer accurately and concisely."
-        user_prompt = f"""
-Based on this article:
+        asked_at = datetime.now()
+        conversation_id = await start_summary(request)
+        identity = await article_index.resolve(request.url, request.content)
+        analysis_key = analysis_cache_key(identity)
+        analysis = await response_cache.get(analysis_key)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise request_error(e)
 
-Title: {request.title}
-Content: {request.content[:4000]}
+    async def events():
+        yield sse_event("meta", {
+            "article_title": request.title,
+            "type": request.type,
+            "related_articles": analysis["related_articles"] if analysis else None,
+            "conversation_id": conversation_id,
+            "cached": analysis is not None
+        })
+        generating = None
+        try:
+            result, streamed = analysis, False
+            if result is None:
+                stream, deltas = AnalysisStream(request.type), asyncio.Queue()
+                generating = asyncio.ensure_future(get_or_generate(
+                    analysis_key,
+                    lambda: generate_analysis(request, identity, analysis_key, on_delta=deltas.put_nowait)
+                ))
+                async for delta in queued_until_done(deltas, generating):
+                    text = stream.feed(delta)
+                    if text:
+                        streamed = True
+                        yield sse_event("token", {"content": text})
+                result, _ = generating.result()
 
-{context}
+            summary = analysis_text(result, request.type)
+            if not streamed:
+                yield sse_event("token", {"content": summary})
 
-Question: {request.question}
+            await save_exchange(conversation_id, summary_request_text(request), summary, "button", asked_at)
+            yield sse_event("done", {
+                "success": True,
+                "summary": summary,
+                "related_articles": result["related_articles"],
+                "conversation_id": conversation_id,
+                "usage": result.get("usage", NO_USAGE)
+            })
+        except Exception as e:
+            logger.exception("Streaming failed")
+            yield sse_event("error", {"success": False, "detail": str(e)})
+        finally:
+            # The generation itself is shared and runs on; stop waiting for it
+            if generating is not None and not generating.done():
+                generating.cancel()
+
+    return sse_response(events())
+
+@app.post("/api/question", dependencies=[Depends(admit_client)])
+async def answer_question(request: QuestionRequest):
+    """Answer question with RAG context and save to history"""
+    try:
+        asked_at = datetime.now()
+        conversation_id, related_articles, messages, memory = await prepare_question(request)
 
-Provide a clear answer. If the question relates to previous reading (shown in context), mention the connection.
-"""
-        
         # Call OpenAI
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
-        
+        async with admission.slot():
+            response = await chat_completion(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=ANSWER_MAX_TOKENS,
+                temperature=TEMPERATURE
+            )
+
         answer = response.choices[0].message.content
-        
-        # Save assistant answer
-        if conversation_id:
-            await save_message(conversation_id, "assistant", answer, "text")
-        
+        usage = record_usage("question", messages, response, answer)
+
+        # Save question and answer
+        await save_exchange(conversation_id, request.question, answer, "text", asked_at)
+        conversation_memory.after_exchange(conversation_id, memory)
+
         return {
             "success": True,
             "answer": answer,
             "question": request.question,
-            "related_articles": len(similar_articles),
-            "conversation_id": conversation_id
+            "related_articles": related_articles,
+            "conversation_id": conversation_id,
+            "usage": usage
         }
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise request_error(e)
+
+@app.post("/api/question/stream", dependencies=[Depends(admit_client)])
+async def answer_question_stream(request: QuestionRequest):
+    """Stream an answer as Server-Sent Events (same event sequence as /api/summarize/stream)"""
+    try:
+        asked_at = datetime.now()
+        conversation_id, related_articles, messages, memory = await prepare_question(request)
+        ticket = admission.ticket()
+        await ticket.acquire()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise request_error(e)
+
+    async def events():
+        yield sse_event("meta", {
+            "question": request.question,
+            "related_articles": related_articles,
+            "conversation_id": conversation_id
+        })
+        try:
+            parts = []
+            async for token in stream_chat_completion(
+                model=CHAT_MODEL,
+                messages=messages,
+                max_tokens=ANSWER_MAX_TOKENS,
+                temperature=TEMPERATURE
+            ):
+                parts.append(token)
+                yield sse_event("token", {"content": token})
+
+            answer = "".join(parts)
+            usage = record_usage("question", messages, completion=answer)
+            await save_exchange(conversation_id, request.question, answer, "text", asked_at)
+            conversation_memory.after_exchange(conversation_id, memory)
+            yield sse_event("done", {
+                "success": True,
+                "answer": answer,
+                "conversation_id": conversation_id,
+                "usage": usage
+            })
+        except Exception as e:
+            logger.exception("Streaming failed")
+            yield sse_event("error", {"success": False, "detail": str(e)})
+        finally:
+            ticket.release()
+
+    return sse_response(events(), ticket)
 
 # Conversation History Endpoints
 @app.get("/api/conversations")
-async def list_conversations(limit: int = 50):
-    """Get recent conversations"""
+async def list_conversations(limit: int = 50, cursor: Optional[str] = None):
+    """Get recent conversations; pass next_cursor back as cursor for the next page"""
     try:
-        conversations = await get_conversations(limit)
+        conversations, next_cursor = await get_conversations(limit, cursor)
         return {
             "success": True,
             "conversations": conversations,
-            "count": len(conversations)
+            "count": len(conversations),
+            "next_cursor": next_cursor
         }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/conversations/export")
+async def export_conversations():
+    """Stream all conversations with their messages as NDJSON, one conversation per line"""
+    async def lines():
+        async for conversation in iterate_conversation_export():
+            yield json.dumps(conversation, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=\"conversations.ndjson\""}
+    )
+
+@app.post("/api/conversations/import")
+async def import_conversation_history(request: Request):
+    """Import conversations from an NDJSON body (the export format), in COPY batches
+
+    Conversations that already exist only get the messages added since
+    they were last imported, so re-importing is safe. Lines that cannot be parsed are counted and reported, not fatal.
+    """
+    if not database:
+        raise HTTPException(status_code=503, detail="Database not configured")
+
+    totals = {"conversations": 0, "messages": 0, "updated": 0, "skipped": 0}
+    errors = []
+    invalid = 0
+    conversations, messages = [], []
+    batch_ids = set()
+
+    async def flush():
+        result = await import_conversations(conversations, messages)
+        for key in totals:
+            totals[key] += result[key]
+        conversations.clear()
+        messages.clear()
+        batch_ids.clear()
+
+    async def lines():
+        # Split the body into lines as it arrives; the last one may lack a newline.
+        # A line spanning chunks is collected in pieces and joined once complete
+        partial = []
+        async for chunk in request.stream():
+            first, *complete = chunk.split(b"\n")
+            partial.append(first)
+            if complete:
+                yield b"".join(partial)
+                *complete, rest = complete
+                for line in complete:
+                    yield line
+                partial = [rest]
+        line = b"".join(partial)
+        if line:
+            yield line
+
+    try:
+        line_number = 0
+        async for line in lines():
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record, records = import_records(json.loads(line))
+            except Exception as e:
+                invalid += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+            if record[0] in batch_ids:
+                # Repeated within the batch; COPY would stage its messages twice
+                totals["skipped"] += 1
+                continue
+            batch_ids.add(record[0])
+            conversations.append(record)
+            messages.extend(records)
+            if len(conversations) >= IMPORT_BATCH_SIZE:
+                await flush()
+        if conversations:
+            await flush()
+        return {
+            "success": True,
+            "imported": totals["conversations"],
+            "messages": totals["messages"],
+            "updated": totals["updated"],
+            "skipped": totals["skipped"],
+            "invalid": invalid,
+            "errors": errors
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise request_error(e)
+
 @app.get("/api/conversations/{conversation_id}")
 async def get_conversation(conversation_id: str):
     """Get a specific conversation with all messages"""
@@ -351,14 +993,16 @@ async def get_conversation(conversation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/conversations/search/{query}")
-async def search_convos(query: str, limit: int = 10):
-    """Search conversations"""
+async def search_convos(query: str, limit: int = 10, page: int = 1):
+    """Search conversations (ranked full-text search with highlighted snippets)"""
     try:
-        results = await search_conversations(query, limit)
+        results, has_more = await search_conversations(query, limit, page)
         return {
             "success": True,
             "results": results,
-            "count": len(results)
+            "count": len(results),
+            "page": page,
+            "has_more": has_more
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -382,22 +1026,41 @@ async def get_stats():
         conversation_stats = await get_conversation_stats()
         
         rag_stats = {}
-        if index:
+        if vector_store:
             try:
-                stats = index.describe_index_stats()
-                rag_stats = {"total_articles": stats.total_vector_count}
+                rag_stats = {
+                    "total_articles": await get_vector_count(),
+                    "total_chunks": await get_vector_count(CHUNK_NAMESPACE)
+                }
             except:
-                rag_stats = {"total_articles": 0}
+                rag_stats = {"total_articles": 0, "total_chunks": 0}
         
         return {
-            "rag_enabled": index is not None,
+            "rag_enabled": vector_store is not None and vector_store.available,
+            "vector_store": vector_store.name if vector_store else None,
             "history_enabled": True,
+            "response_cache": response_cache.stats(),
+            "cache_tiers": await tiered_cache_stats(),
+            "embeddings": embedding_service.stats(),
+            "rag_queue": rag_queue.stats(),
+            "articles": article_store.stats(),
+            "dedup": article_index.stats(),
+            "coalescing": singleflight.stats(),
+            "tokens": token_usage.stats(),
+            "memory": conversation_memory.stats(),
+            "retention": retention.stats(),
+            "boot": boot.report(),
+            "upstream": upstream_stats(),
+            "admission": admission.stats(),
             **rag_stats,
             **conversation_stats
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+boot.start(boot_started)
+boot.mark("imported")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Multi-turn conversation memory.
+
+A question's prompt carries the conversation so far as a rolling summary of
+older turns plus the most recent turns verbatim, so follow-ups keep their
+context while prompt size stays bounded however long the conversation runs.
+
+The summary lives on the conversation row together with the timestamp of
+the last message it covers. Messages after that are the verbatim window.
+When the window grows past MEMORY_MAX_TURNS, the oldest turns are folded
+into the summary in the background, leaving MEMORY_RECENT_TURNS. The
+summary is therefore only recomputed every few turns, and each fold reads
+only the previous summary plus the turns being folded. Saving a fold is a
+compare-and-set on that timestamp, so concurrent folds cannot lose turns.
+"""
+import asyncio
+import logging
+import os
+
+from clients import chat_completion
+from database import get_conversation_memory, save_conversation_memory
+from prompts import CHAT_MODEL, MEMORY_SUMMARY_MAX_TOKENS, TEMPERATURE, build_memory_messages
+from telemetry import stage
+from tokens import token_usage
+
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "3"))
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "6"))
+
+logger = logging.getLogger(__name__)
+
+class ConversationMemory:
+    def __init__(self, recent_turns: int, max_turns: int):
+        # A turn is a user message and the assistant's reply
+        self.recent_messages = recent_turns * 2
+        self.max_messages = max(max_turns, recent_turns) * 2
+        self._folding = {}
+        self.folds = 0
+        self.folded_messages = 0
+        self.conflicts = 0
+        self.failed = 0
+
+    async def load(self, conversation_id: str) -> dict:
+        """The rolling summary and the verbatim window for a conversation's next prompt"""
+        memory = None
+        if conversation_id:
+            memory = await get_conversation_memory(conversation_id, limit=self.max_messages)
+        return memory or {"summary": None, "summarized_until": None, "messages": []}
+
+    def after_exchange(self, conversation_id: str, memory: dict, saved: int = 2):
+        """Fold old turns in the background once the window has outgrown MEMORY_MAX_TURNS
+
+        memory is what load() returned before the exchange; saved is the
+        number of messages the exchange added to the conversation.
+        """
+        if not conversation_id or len(memory["messages"]) + saved <= self.max_messages:
+            return
+        if conversation_id in self._folding:
+            return
+        task = asyncio.create_task(self.fold(conversation_id))
+        self._folding[conversation_id] = task
+        task.add_done_callback(lambda _: self._folding.pop(conversation_id, None))
+
+    async def fold(self, conversation_id: str):
+        """Summarize everything older than the last MEMORY_RECENT_TURNS into the rolling summary"""
+        try:
+            memory = await get_conversation_memory(conversation_id)
+            if memory is None:
+                return
+            messages = memory["messages"]
+            older = messages[:len(messages) - self.recent_messages]
+            if len(messages) <= self.max_messages or not older:
+                return
+
+            prompt = build_memory_messages(memory["summary"], older)
+            with stage("memory.fold"):
+                response = await chat_completion(
+                    model=CHAT_MODEL,
+                    messages=prompt,
+                    max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+                    temperature=TEMPERATURE
+                )
+            usage = response.usage
+            token_usage.record("memory", usage.prompt_tokens, usage.completion_tokens)
+
+            saved = await save_conversation_memory(
+                conversation_id,
+                response.choices[0].message.content,
+                older[-1]["created_at"],
+                memory["summarized_until"]
+            )
+            if saved:
+                self.folds += 1
+                self.folded_messages += len(older)
+            else:
+                # Another worker folded first; its summary covers these turns
+                self.conflicts += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Conversation memory fold failed", extra={"conversation_id": conversation_id, "error": str(e)})
+
+    async def close(self):
+        """Let in-flight folds finish before the database disconnects"""
+        if self._folding:
+            await asyncio.gather(*self._folding.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "recent_turns": self.recent_messages // 2,
+            "max_turns": self.max_messages // 2,
+            "folds": self.folds,
+            "folded_messages": self.folded_messages,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+            "folding": len(self._folding)
+        }
+
+conversation_memory = ConversationMemory(MEMORY_RECENT_TURNS, MEMORY_MAX_TURNS)
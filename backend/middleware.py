@@ -0,0 +1,78 @@
+"""
+ASGI middleware.
+"""
+import os
+import zlib
+
+from fastapi import HTTPException
+
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(2 * 1024 * 1024)))
+# Conversation imports are consumed line by line, so they may be far larger
+MAX_DECOMPRESSED_IMPORT_BODY = int(os.getenv("MAX_DECOMPRESSED_IMPORT_BODY", str(512 * 1024 * 1024)))
+# Largest piece of decompressed body handed to the app at a time
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+class GZipRequestMiddleware:
+    """Transparently decompress request bodies sent with Content-Encoding: gzip
+
+    The body is decompressed as the app reads it, at most
+    DECOMPRESS_CHUNK_SIZE bytes at a time, so streaming endpoints still see
+    it arrive in pieces. Its decompressed size is capped at max_size, or at
+    the entry for the request's path in route_max_sizes, so a small
+    compressed upload cannot expand without bound. A corrupt or oversized
+    body raises HTTPException (400 or 413) from receive, so the app turns it
+    into its usual JSON error, inside CORSMiddleware.
+    """
+
+    def __init__(self, app, max_size: int = MAX_DECOMPRESSED_BODY, route_max_sizes: dict = None):
+        self.app = app
+        self.max_size = max_size
+        self.route_max_sizes = route_max_sizes or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        if headers.get(b"content-encoding", b"").lower() != b"gzip":
+            return await self.app(scope, receive, send)
+
+        max_size = self.route_max_sizes.get(scope["path"], self.max_size)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending, size = b"", 0
+        received_all = finished = False
+
+        async def receive_decompressed():
+            nonlocal pending, size, received_all, finished
+            while not finished:
+                if pending:
+                    try:
+                        body = decompressor.decompress(pending, DECOMPRESS_CHUNK_SIZE)
+                    except zlib.error:
+                        raise HTTPException(status_code=400, detail="Invalid gzip body")
+                    pending = decompressor.unconsumed_tail
+                    size += len(body)
+                    if size > max_size:
+                        raise HTTPException(status_code=413, detail="Request body too large")
+                    if body:
+                        return {"type": "http.request", "body": body, "more_body": True}
+                elif received_all:
+                    if not decompressor.eof:
+                        raise HTTPException(status_code=400, detail="Invalid gzip body")
+                    finished = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                else:
+                    message = await receive()
+                    if message["type"] != "http.request":
+                        return message
+                    pending = message.get("body", b"")
+                    received_all = not message.get("more_body", False)
+            # After the body, pass through (e.g. http.disconnect)
+            return await receive()
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        await self.app(scope, receive_decompressed, send)
@@ -0,0 +1,293 @@
+"""
+Schema migrations, applied in order on startup.
+
+Each migration is a name plus a list of SQL statements, applied in one
+transaction. Applied names are recorded in `schema_migrations`, so every
+migration runs exactly once per database. Append new migrations to the end
+of MIGRATIONS; never edit one that has already shipped.
+
+Migrations that touch large tables are marked ONLINE instead: their
+statements run one by one outside a transaction, so they can use CREATE
+INDEX CONCURRENTLY and never hold a table lock for longer than one
+statement. They must be safe to re-run from the start if interrupted (IF
+NOT EXISTS, OR REPLACE). A Backfill statement runs in batches of
+BACKFILL_BATCH_SIZE rows, each its own transaction.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+
+# Migration option: run outside a transaction
+ONLINE = "online"
+
+class Backfill:
+    """A statement repeated until done, one batch per transaction
+
+    It is given :after (the last key of the previous batch, initially
+    start) and :batch_size, and returns the last key of its batch, or no
+    row once there is nothing left.
+    """
+
+    def __init__(self, statement: str, start: str):
+        self.statement = statement
+        self.start = start
+
+MIGRATIONS = [
+    ("001_response_cache", [
+        """
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            prompt_version TEXT NOT NULL,
+            value JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache (created_at)",
+    ]),
+    ("002_full_text_search", [
+        # Nullable columns kept current by triggers: adding one does not rewrite the table
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_tsv tsvector",
+        """
+        CREATE OR REPLACE FUNCTION messages_search_tsv() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_tsv := to_tsvector('english', coalesce(NEW.content, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS messages_search_tsv ON messages",
+        """
+        CREATE TRIGGER messages_search_tsv BEFORE INSERT OR UPDATE OF content ON messages
+            FOR EACH ROW EXECUTE FUNCTION messages_search_tsv()
+        """,
+        Backfill("""
+        WITH batch AS (
+            SELECT id FROM messages WHERE id > CAST(:after AS uuid) ORDER BY id LIMIT :batch_size
+        ), updated AS (
+            UPDATE messages m SET search_tsv = to_tsvector('english', coalesce(m.content, ''))
+            FROM batch WHERE m.id = batch.id AND m.search_tsv IS NULL
+        )
+        SELECT CAST(id AS TEXT) FROM batch ORDER BY id DESC LIMIT 1
+        """, start=MIN_UUID),
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_search_tsv ON messages USING GIN (search_tsv)",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS title_tsv tsvector",
+        """
+        CREATE OR REPLACE FUNCTION conversations_title_tsv() RETURNS trigger AS $$
+        BEGIN
+            NEW.title_tsv := to_tsvector('english', coalesce(NEW.article_title, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS conversations_title_tsv ON conversations",
+        """
+        CREATE TRIGGER conversations_title_tsv BEFORE INSERT OR UPDATE OF article_title ON conversations
+            FOR EACH ROW EXECUTE FUNCTION conversations_title_tsv()
+        """,
+        Backfill("""
+        WITH batch AS (
+            SELECT id FROM conversations WHERE id > CAST(:after AS uuid) ORDER BY id LIMIT :batch_size
+        ), updated AS (
+            UPDATE conversations c SET title_tsv = to_tsvector('english', coalesce(c.article_title, ''))
+            FROM batch WHERE c.id = batch.id AND c.title_tsv IS NULL
+        )
+        SELECT CAST(id AS TEXT) FROM batch ORDER BY id DESC LIMIT 1
+        """, start=MIN_UUID),
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_title_tsv ON conversations USING GIN (title_tsv)",
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_conversation_created
+            ON messages (conversation_id, created_at)
+        """,
+    ], ONLINE),
+    ("003_conversation_list", [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS first_question TEXT",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP",
+        # Rows written since the columns were added are already filled in by the app
+        Backfill("""
+        WITH batch AS (
+            SELECT id FROM conversations WHERE id > CAST(:after AS uuid) ORDER BY id LIMIT :batch_size
+        ), updated AS (
+            UPDATE conversations c
+            SET
+                first_question = COALESCE(c.first_question, (
+                    SELECT content FROM messages
+                    WHERE conversation_id = c.id AND role = 'user'
+                    ORDER BY created_at ASC LIMIT 1
+                )),
+                last_message_at = (
+                    SELECT MAX(created_at) FROM messages WHERE conversation_id = c.id
+                )
+            FROM batch WHERE c.id = batch.id AND c.last_message_at IS NULL
+        )
+        SELECT CAST(id AS TEXT) FROM batch ORDER BY id DESC LIMIT 1
+        """, start=MIN_UUID),
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_user_started
+            ON conversations (user_id, started_at DESC, id DESC)
+        """,
+    ], ONLINE),
+    ("004_articles", [
+        """
+        CREATE TABLE IF NOT EXISTS articles (
+            id TEXT PRIMARY KEY,
+            title TEXT,
+            url TEXT,
+            content TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    ("005_conversation_memory", [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS memory_summary TEXT",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS memory_summarized_until TIMESTAMP",
+    ]),
+    ("006_user_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id UUID PRIMARY KEY,
+            conversation_count BIGINT NOT NULL DEFAULT 0,
+            message_count BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        INSERT INTO user_stats (user_id, conversation_count, message_count)
+        SELECT user_id, COUNT(*), COALESCE(SUM(message_count), 0)
+        FROM conversations
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+            SET conversation_count = EXCLUDED.conversation_count, message_count = EXCLUDED.message_count
+        """,
+    ]),
+    ("007_article_fingerprints", [
+        """
+        CREATE TABLE IF NOT EXISTS article_fingerprints (
+            content_hash TEXT PRIMARY KEY,
+            article_id TEXT NOT NULL,
+            canonical_hash TEXT NOT NULL,
+            canonical_url TEXT,
+            simhash BIGINT,
+            band0 INTEGER,
+            band1 INTEGER,
+            band2 INTEGER,
+            band3 INTEGER,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_article_fingerprints_band0 ON article_fingerprints (band0)",
+        "CREATE INDEX IF NOT EXISTS idx_article_fingerprints_band1 ON article_fingerprints (band1)",
+        "CREATE INDEX IF NOT EXISTS idx_article_fingerprints_band2 ON article_fingerprints (band2)",
+        "CREATE INDEX IF NOT EXISTS idx_article_fingerprints_band3 ON article_fingerprints (band3)",
+    ]),
+    ("008_conversation_archive", [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS digest TEXT",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP",
+        # digest is new, so there is nothing to backfill
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS digest_tsv tsvector",
+        """
+        CREATE OR REPLACE FUNCTION conversations_digest_tsv() RETURNS trigger AS $$
+        BEGIN
+            NEW.digest_tsv := to_tsvector('english', coalesce(NEW.digest, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS conversations_digest_tsv ON conversations",
+        """
+        CREATE TRIGGER conversations_digest_tsv BEFORE INSERT OR UPDATE OF digest ON conversations
+            FOR EACH ROW EXECUTE FUNCTION conversations_digest_tsv()
+        """,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_digest_tsv ON conversations USING GIN (digest_tsv)",
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversations_last_message_at
+            ON conversations (last_message_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS conversation_archive (
+            conversation_id UUID PRIMARY KEY REFERENCES conversations (id) ON DELETE CASCADE,
+            message_count INTEGER NOT NULL,
+            payload BYTEA NOT NULL,
+            archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """,
+    ], ONLINE),
+    ("009_leases", [
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        )
+        """,
+    ]),
+]
+
+# Arbitrary key for the advisory lock that serialises concurrent workers
+MIGRATION_LOCK_KEY = 7239001
+MIGRATION_LOCK_POLL = 0.5
+
+async def run_backfill(database, backfill: Backfill) -> int:
+    """Run a Backfill to completion; returns the number of batches"""
+    after, batches = backfill.start, 0
+    while True:
+        after = await database.fetch_val(
+            query=backfill.statement,
+            values={"after": after, "batch_size": BACKFILL_BATCH_SIZE}
+        )
+        if after is None:
+            return batches
+        batches += 1
+
+async def apply_migrations(database):
+    """Apply any migrations that have not been recorded yet"""
+    # Session-level advisory locks belong to a connection, so pin one. Only
+    # one worker migrates at a time; the others wait and then find nothing to
+    # do. They poll rather than block: CREATE INDEX CONCURRENTLY waits for
+    # every open statement, including one blocked on the lock.
+    async with database.connection():
+        while not await database.fetch_val(
+            query="SELECT pg_try_advisory_lock(:key)",
+            values={"key": MIGRATION_LOCK_KEY}
+        ):
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+        try:
+            await database.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """)
+
+            rows = await database.fetch_all("SELECT name FROM schema_migrations")
+            applied = {row["name"] for row in rows}
+
+            for name, statements, *options in MIGRATIONS:
+                if name in applied:
+                    continue
+                if ONLINE in options:
+                    for statement in statements:
+                        if isinstance(statement, Backfill):
+                            await run_backfill(database, statement)
+                        else:
+                            await database.execute(statement)
+                    await database.execute(
+                        query="INSERT INTO schema_migrations (name) VALUES (:name)",
+                        values={"name": name}
+                    )
+                else:
+                    async with database.transaction():
+                        for statement in statements:
+                            await database.execute(statement)
+                        await database.execute(
+                            query="INSERT INTO schema_migrations (name) VALUES (:name)",
+                            values={"name": name}
+                        )
+                logger.info("Applied migration", extra={"migration": name})
+        finally:
+            await database.execute(
+                query="SELECT pg_advisory_unlock(:key)",
+                values={"key": MIGRATION_LOCK_KEY}
+            )
@@ -0,0 +1,345 @@
+"""
+Prompt templates for the article analysis (which the summary and key-points
+endpoints are built from), for questions, and for folding old conversation
+turns into a rolling summary.
+
+Prompts are assembled within a token budget: the fixed parts (templates,
+title, question) are counted first, RAG context and conversation history may
+each take up to a share of what is left, and the article text gets the rest.
+Everything is trimmed on sentence boundaries. A conversation's rolling
+summary is counted against the history share before its recent turns.
+
+PROMPT_VERSION is derived from the templates, budgets and model settings
+below, so editing any of them automatically invalidates cached responses.
+"""
+import hashlib
+import json
+import os
+
+from tokens import count_message_tokens, count_tokens, fit_texts, truncate_to_tokens
+
+CHAT_MODEL = "gpt-4o-mini"
+ANSWER_MAX_TOKENS = 300
+ANALYSIS_MAX_TOKENS = 800
+TEMPERATURE = 0.7
+
+# Token budget of the prompt (excluding the completion)
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "3000"))
+CONTEXT_MAX_SHARE = float(os.getenv("PROMPT_CONTEXT_SHARE", "0.25"))
+HISTORY_MAX_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.25"))
+SUMMARY_CONTEXT_ITEM_TOKENS = 60
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "250"))
+
+# ============================================
+# TEMPLATES
+# ============================================
+
+SUMMARY_RELATED_INSTRUCTION = " When the user has read related articles, point out what's NEW or DIFFERENT."
+SUMMARY_CONTEXT_HEADER = "\n\nContext - You've previously read:\n"
+SUMMARY_CONTEXT_ITEM = "{i}. \"{title}\" - {summary}...\n"
+
+ANALYSIS_SYSTEM_PROMPT = (
+    "You are a helpful reading assistant. Analyze the article and reply with JSON containing "
+    "a clear, concise summary of 2-3 paragraphs, 5-7 key points and 3 questions a reader "
+    "might want to ask about it next."
+)
+ANALYSIS_USER_TEMPLATE = "{context}\n\nAnalyze this article:\n\nTitle: {title}\n\n{content}"
+ANALYSIS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "article_analysis",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "summary": {"type": "string"},
+                "key_points": {"type": "array", "items": {"type": "string"}},
+                "suggested_questions": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["summary", "key_points", "suggested_questions"],
+            "additionalProperties": False
+        }
+    }
+}
+KEY_POINT_ITEM = "• {point}"
+
+QUESTION_SYSTEM_PROMPT = "You are a helpful reading assistant. Answer accurately and concisely."
+QUESTION_CONTEXT_HEADER = "\n\nRelated passages from your reading history:\n"
+QUESTION_CONTEXT_ITEM = "- From \"{title}\": {text}\n"
+QUESTION_USER_TEMPLATE = """
+Based on these excerpts from the article:
+
+Title: {title}
+{excerpts}
+
+{context}
+
+Question: {question}
+
+Provide a clear answer. If the question relates to previous reading (shown in context), mention the connection.
+"""
+CONVERSATION_SUMMARY_TEMPLATE = "Summary of the earlier conversation about this article:\n{summary}"
+
+MEMORY_SYSTEM_PROMPT = (
+    "You keep a running summary of a conversation about an article. Keep what was asked, "
+    "the answers given and any conclusions; leave out pleasantries."
+)
+MEMORY_MESSAGE_ITEM = "{role}: {content}\n"
+MEMORY_USER_TEMPLATE = """
+Summary so far:
+{summary}
+
+Newer messages:
+{messages}
+
+Rewrite the summary so it also covers the newer messages. Reply with the summary only.
+"""
+
+def _compute_prompt_version() -> str:
+    parts = [
+        CHAT_MODEL, str(ANSWER_MAX_TOKENS), str(ANALYSIS_MAX_TOKENS), str(TEMPERATURE),
+        str(PROMPT_MAX_TOKENS), str(CONTEXT_MAX_SHARE), str(HISTORY_MAX_SHARE),
+        str(SUMMARY_CONTEXT_ITEM_TOKENS),
+        SUMMARY_RELATED_INSTRUCTION, SUMMARY_CONTEXT_HEADER, SUMMARY_CONTEXT_ITEM,
+        ANALYSIS_SYSTEM_PROMPT, ANALYSIS_USER_TEMPLATE, json.dumps(ANALYSIS_RESPONSE_FORMAT, sort_keys=True),
+        KEY_POINT_ITEM,
+        QUESTION_SYSTEM_PROMPT, QUESTION_CONTEXT_HEADER, QUESTION_CONTEXT_ITEM,
+        QUESTION_USER_TEMPLATE, CONVERSATION_SUMMARY_TEMPLATE,
+        str(MEMORY_SUMMARY_MAX_TOKENS), MEMORY_SYSTEM_PROMPT, MEMORY_MESSAGE_ITEM, MEMORY_USER_TEMPLATE,
+    ]
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()[:12]
+
+PROMPT_VERSION = _compute_prompt_version()
+
+# ============================================
+# PROMPT BUILDERS
+# ============================================
+
+def _available_tokens(messages: list) -> int:
+    """Tokens left in the budget after the fixed parts of the prompt"""
+    return max(PROMPT_MAX_TOKENS - count_message_tokens(messages, CHAT_MODEL), 0)
+
+def _build_context(header: str, items: list, budget: int) -> str:
+    """Fit formatted context items under header within budget; empty if none fit"""
+    if not items:
+        return ""
+    items = fit_texts(items, budget - count_tokens(header, CHAT_MODEL), CHAT_MODEL)
+    return header + "".join(items) if items else ""
+
+def build_analysis_messages(title: str, content: str, similar_articles: list) -> list:
+    """Build the chat messages for an article analysis"""
+    system_prompt = ANALYSIS_SYSTEM_PROMPT
+    if similar_articles:
+        system_prompt += SUMMARY_RELATED_INSTRUCTION
+
+    def messages(context: str, text: str) -> list:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": ANALYSIS_USER_TEMPLATE.format(context=context, title=title, content=text)}
+        ]
+
+    available = _available_tokens(messages("", ""))
+
+    # Build context
+    summaries = [
+        truncate_to_tokens(article['summary'], SUMMARY_CONTEXT_ITEM_TOKENS, CHAT_MODEL)
+        for article in similar_articles
+    ]
+    context = _build_context(SUMMARY_CONTEXT_HEADER, [
+        SUMMARY_CONTEXT_ITEM.format(i=i, title=article['title'], summary=summary)
+        for i, (article, summary) in enumerate(zip(similar_articles, summaries), 1)
+    ], int(available * CONTEXT_MAX_SHARE))
+
+    # The article gets whatever the context left over
+    article_budget = available - count_tokens(context, CHAT_MODEL)
+    return messages(context, truncate_to_tokens(content, article_budget, CHAT_MODEL))
+
+def build_question_messages(title: str, excerpts: list, question: str, related_chunks: list,
+                            history: list = None, history_summary: str = None) -> list:
+    """Build the chat messages for a question from the most relevant article chunks
+
+    history is a list of earlier {"role", "content"} messages of the
+    conversation, oldest first; the most recent ones that fit are kept.
+    history_summary is the rolling summary of the turns before those, and
+    may take up to half of the history budget.
+    """
+    def messages(previous: list, excerpt_text: str, context: str) -> list:
+        user_prompt = QUESTION_USER_TEMPLATE.format(
+            title=title, excerpts=excerpt_text, context=context, question=question
+        )
+        return [
+            {"role": "system", "content": QUESTION_SYSTEM_PROMPT},
+            *previous,
+            {"role": "user", "content": user_prompt}
+        ]
+
+    available = _available_tokens(messages([], "", ""))
+
+    # Build context
+    context = _build_context(QUESTION_CONTEXT_HEADER, [
+        QUESTION_CONTEXT_ITEM.format(title=chunk['title'], text=chunk['text'])
+        for chunk in related_chunks
+    ], int(available * CONTEXT_MAX_SHARE))
+
+    history_budget = int(available * HISTORY_MAX_SHARE)
+    summary = []
+    if history_summary:
+        text = truncate_to_tokens(history_summary, history_budget // 2, CHAT_MODEL)
+        if text:
+            summary = [{"role": "system", "content": CONVERSATION_SUMMARY_TEMPLATE.format(summary=text)}]
+            history_budget -= count_tokens(summary[0]["content"], CHAT_MODEL)
+
+    # Most recent turns first, so the oldest are the ones dropped
+    previous = []
+    if history:
+        recent = list(reversed(history))
+        contents = fit_texts([message["content"] for message in recent], history_budget, CHAT_MODEL)
+        previous = [
+            {"role": message["role"], "content": text}
+            for message, text in reversed(list(zip(recent, contents)))
+        ]
+    previous = summary + previous
+
+    # The article excerpts get whatever context and history left over
+    used = count_message_tokens(messages(previous, "", context), CHAT_MODEL)
+    excerpts = fit_texts(excerpts, max(PROMPT_MAX_TOKENS - used, 0), CHAT_MODEL)
+    return messages(previous, "\n\n".join(excerpts), context)
+
+def parse_analysis(text: str) -> dict:
+    """Validate the JSON of an analysis completion; raises ValueError if malformed"""
+    try:
+        analysis = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Analysis is not valid JSON: {e}") from e
+
+    if not isinstance(analysis, dict) or not isinstance(analysis.get("summary"), str):
+        raise ValueError("Analysis has no summary")
+    return {
+        "summary": analysis["summary"].strip(),
+        "key_points": [str(point).strip() for point in analysis.get("key_points") or []],
+        "suggested_questions": [str(question).strip() for question in analysis.get("suggested_questions") or []]
+    }
+
+def format_key_points(key_points: list) -> str:
+    """Render key points as the bulleted list the key-points button shows"""
+    return "\n".join(KEY_POINT_ITEM.format(point=point.lstrip("•-* ")) for point in key_points)
+
+_JSON_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "\\": "\\", "/": "/"}
+
+class AnalysisStream:
+    """Incremental parser for a streamed analysis completion
+
+    feed() takes each text delta of the JSON and returns the newly arrived
+    part of what a summary or key-points request shows, formatted as
+    format_key_points() formats the finished analysis. Leading whitespace
+    and bullets are dropped as they arrive; the finished text (from
+    parse_analysis) may still differ in trailing whitespace.
+    """
+
+    def __init__(self, summary_type: str):
+        self.field = "key_points" if summary_type == "key-points" else "summary"
+        self.text = []
+        self._depth = 0
+        self._in_array = False
+        self._expect_key = False
+        self._in_string = False
+        self._is_key = False
+        self._key = []
+        self._current = None
+        self._escape = None
+        self._high_surrogate = None
+        self._item = -1
+        self._item_started = False
+
+    def feed(self, delta: str) -> str:
+        self.text.append(delta)
+        out = []
+        for char in delta:
+            if self._in_string:
+                self._string_char(char, out)
+            elif char == '"':
+                self._in_string = True
+                self._is_key = self._depth == 1 and self._expect_key
+                if self._is_key:
+                    self._key = []
+                elif self._current == self.field:
+                    self._start_value(out)
+            elif char == "{":
+                self._depth += 1
+                self._expect_key = True
+            elif char == "}":
+                self._depth -= 1
+            elif char == "[":
+                self._in_array = True
+            elif char == "]":
+                self._in_array = False
+            elif char == ":":
+                self._expect_key = False
+            elif char == "," and not self._in_array:
+                self._expect_key = True
+        return "".join(out)
+
+    def _start_value(self, out: list):
+        self._item += 1
+        self._item_started = False
+        if self.field == "key_points":
+            if self._item:
+                out.append("\n")
+            out.append(KEY_POINT_ITEM.format(point=""))
+
+    def _string_char(self, char: str, out: list):
+        if self._escape is not None:
+            self._escape += char
+            if self._escape[0] == "u":
+                if len(self._escape) < 5:
+                    return
+                code = int(self._escape[1:], 16)
+                self._escape = None
+                if 0xD800 <= code < 0xDC00:
+                    self._high_surrogate = code
+                    return
+                if self._high_surrogate is not None and 0xDC00 <= code < 0xE000:
+                    code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+                self._high_surrogate = None
+                char = chr(code)
+            else:
+                char = _JSON_ESCAPES.get(char, char)
+            self._escape = None
+        elif char == "\\":
+            self._escape = ""
+            return
+        elif char == '"':
+            self._in_string = False
+            if self._is_key:
+                self._current = "".join(self._key)
+            return
+
+        if self._is_key:
+            self._key.append(char)
+        elif self._current == self.field:
+            if not self._item_started:
+                strip = "•-* \t\n" if self.field == "key_points" else " \t\n"
+                if char in strip:
+                    return
+                self._item_started = True
+            out.append(char)
+
+    def result(self) -> dict:
+        """The finished analysis; raises ValueError if malformed"""
+        return parse_analysis("".join(self.text))
+
+def build_memory_messages(summary: str, messages: list) -> list:
+    """Build the chat messages that fold older turns into a conversation's rolling summary"""
+    def prompt(text: str) -> list:
+        return [
+            {"role": "system", "content": MEMORY_SYSTEM_PROMPT},
+            {"role": "user", "content": MEMORY_USER_TEMPLATE.format(summary=summary or "(none yet)", messages=text)}
+        ]
+
+    # Oldest messages are the ones dropped if the turns do not all fit
+    items = [
+        MEMORY_MESSAGE_ITEM.format(role=message["role"], content=message["content"])
+        for message in reversed(messages)
+    ]
+    items = fit_texts(items, _available_tokens(prompt("")), CHAT_MODEL)
+    return prompt("".join(reversed(items)))
@@ -0,0 +1,125 @@
+"""
+Background ingestion queue for RAG writes.
+
+Articles are queued by ID and written off the response path by a small pool
+of workers. Re-queuing an article that is still waiting replaces its payload
+instead of adding a second write. Each worker takes up to RAG_UPSERT_BATCH
+articles at a time, hands them to the upsert callable in one call and
+retries failed batches with jittered exponential backoff.
+"""
+import asyncio
+import logging
+import os
+import random
+
+from telemetry import stage
+
+RAG_QUEUE_WORKERS = int(os.getenv("RAG_QUEUE_WORKERS", "2"))
+RAG_UPSERT_BATCH = int(os.getenv("RAG_UPSERT_BATCH", "50"))
+RAG_MAX_RETRIES = int(os.getenv("RAG_MAX_RETRIES", "4"))
+RAG_RETRY_BASE_DELAY = float(os.getenv("RAG_RETRY_BASE_DELAY", "0.5"))
+RAG_DRAIN_TIMEOUT = float(os.getenv("RAG_DRAIN_TIMEOUT", "20"))
+
+logger = logging.getLogger(__name__)
+
+class RagIngestQueue:
+    def __init__(self, workers: int, batch_size: int, max_retries: int, base_delay: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.upsert = None
+        self._jobs = {}
+        self._queue = None
+        self._tasks = []
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self, upsert):
+        """Start the worker pool; `upsert` is an async callable taking a list of jobs"""
+        self.upsert = upsert
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def enqueue(self, article_id: str, job: dict) -> bool:
+        """Queue an article write; returns False if the queue is not running"""
+        if self._queue is None:
+            return False
+
+        if article_id in self._jobs:
+            # Still waiting: keep one write with the newest payload
+            self._jobs[article_id] = job
+            self.deduplicated += 1
+            return True
+
+        self._jobs[article_id] = job
+        self._queue.put_nowait(article_id)
+        self.enqueued += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            article_ids = [await self._queue.get()]
+            while len(article_ids) < self.batch_size and not self._queue.empty():
+                article_ids.append(self._queue.get_nowait())
+
+            jobs = [self._jobs.pop(article_id) for article_id in article_ids]
+            try:
+                await self._write_with_retries(jobs)
+            finally:
+                for _ in article_ids:
+                    self._queue.task_done()
+
+    async def _write_with_retries(self, jobs: list):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stage("rag.upsert_batch"):
+                    await self.upsert(jobs)
+                self.batches += 1
+                self.written += len(jobs)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(jobs)
+                    logger.error("Error storing articles in RAG", extra={"count": len(jobs), "attempts": attempt + 1, "error": str(e)})
+                    return
+                self.retries += 1
+                delay = self.base_delay * (2 ** attempt)
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+
+    async def drain(self, timeout: float = RAG_DRAIN_TIMEOUT):
+        """Wait for queued writes to finish, then stop the workers"""
+        if self._queue is None:
+            return
+
+        pending = self._queue.qsize()
+        if pending:
+            logger.info("Draining pending RAG writes", extra={"count": pending})
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning("RAG drain timed out", extra={"count": self._queue.qsize()})
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._jobs),
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed
+        }
+
+rag_queue = RagIngestQueue(RAG_QUEUE_WORKERS, RAG_UPSERT_BATCH, RAG_MAX_RETRIES, RAG_RETRY_BASE_DELAY)
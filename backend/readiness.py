@@ -0,0 +1,64 @@
+"""
+Worker boot timing and readiness.
+
+Startup connects the database and initializes the vector store before the
+worker accepts requests, so no request can write to a store that is not
+there yet. Loading the OpenAI client and tokenizers, which only makes the
+first completion faster, runs afterwards in a background warm-up task. Each
+step is tracked here per component. /health stays a pure liveness check.
+/ready returns 503 until the warm-up has finished, so a load balancer only
+routes to warm workers.
+Components that fail are reported but do not block readiness, because the
+app degrades without them (no RAG, no history).
+
+Boot phases are measured from when main.py started importing:
+    imported  module import finished
+    started   startup event finished (stores connected), accepting requests
+    ready     warm-up finished
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class BootTracker:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases = {}
+        self.components = {}
+        self.ready = False
+
+    def start(self, origin: float):
+        """Measure phases from origin (a time.perf_counter() value)"""
+        self.origin = origin
+
+    def mark(self, phase: str):
+        self.phases[phase] = round(time.perf_counter() - self.origin, 3)
+        if phase == "ready":
+            self.ready = True
+            logger.info("Worker ready", extra={"boot_seconds": self.phases, "components": self.components})
+
+    @asynccontextmanager
+    async def component(self, name: str):
+        """Track one warm-up step; failures are recorded and logged, not raised"""
+        self.components[name] = {"status": "pending"}
+        start = time.perf_counter()
+        try:
+            yield self.components[name]
+            if self.components[name]["status"] == "pending":
+                self.components[name]["status"] = "ok"
+        except Exception as e:
+            self.components[name]["status"] = "failed"
+            self.components[name]["error"] = str(e)
+            logger.warning("Warm-up step failed", extra={"component": name, "error": str(e)})
+        self.components[name]["seconds"] = round(time.perf_counter() - start, 3)
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "boot_seconds": self.phases,
+            "components": self.components
+        }
+
+boot = BootTracker()
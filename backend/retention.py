@@ -0,0 +1,163 @@
+"""
+Tiered retention for conversation history.
+
+A background job runs every RETENTION_INTERVAL seconds and compacts
+conversations with no messages for RETENTION_DAYS: each gets a digest, and
+its raw messages move from the `messages` table into one zstd-compressed
+JSON row in `conversation_archive`. The hot tables then only hold recent
+conversations, which keeps history, search and memory queries small.
+
+The digest is the conversation memory's rolling summary brought up to date,
+so a conversation that already has one costs at most one short completion,
+and it becomes the summary that later questions in the conversation build
+on. Archived conversations are still found by search through their digest,
+and their messages are rehydrated from the archive when the conversation is
+opened or exported.
+
+Retention is off unless RETENTION_DAYS is set, since every run spends
+completions. Only one worker runs the job at a time: it holds a lease row
+for up to RETENTION_LEASE_TTL seconds, so no database connection is held
+while digests are generated. Each run handles at most RETENTION_BATCH
+conversations.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from clients import chat_completion
+from database import (
+    archive_conversation, database, get_conversation_memory, get_retention_candidates,
+    release_lease, try_acquire_lease
+)
+from prompts import CHAT_MODEL, MEMORY_SUMMARY_MAX_TOKENS, TEMPERATURE, build_memory_messages
+from telemetry import stage
+from tokens import token_usage
+
+# 0 (the default) disables retention
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "0"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "20"))
+# First run shortly after startup rather than a full interval later
+RETENTION_START_DELAY = 60
+RETENTION_LEASE_KEY = "retention"
+# Longest a run may take before another worker may start one
+RETENTION_LEASE_TTL = float(os.getenv("RETENTION_LEASE_TTL", "900"))
+
+logger = logging.getLogger(__name__)
+
+class RetentionJob:
+    def __init__(self, days: float, interval: float, batch_size: int):
+        self.days = days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self.runs = 0
+        self.skipped_runs = 0
+        self.archived = 0
+        self.archived_messages = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.conflicts = 0
+        self.failed = 0
+        self.last_run = None
+
+    def start(self):
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        delay = min(RETENTION_START_DELAY, self.interval)
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.interval
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error("Retention run failed", extra={"error": str(e)})
+
+    async def run_once(self) -> int:
+        """Compact one batch of stale conversations; returns how many were archived"""
+        if not database or not database.is_connected:
+            return 0
+
+        holder = uuid.uuid4().hex
+        if not await try_acquire_lease(RETENTION_LEASE_KEY, holder, RETENTION_LEASE_TTL):
+            self.skipped_runs += 1
+            return 0
+        try:
+            self.runs += 1
+            self.last_run = datetime.now().isoformat()
+            cutoff = datetime.now() - timedelta(days=self.days)
+            archived = 0
+            for conversation in await get_retention_candidates(cutoff, self.batch_size):
+                if await self.compact(str(conversation["id"])):
+                    archived += 1
+            if archived:
+                logger.info("Archived conversations", extra={"count": archived})
+            return archived
+        finally:
+            await release_lease(RETENTION_LEASE_KEY, holder)
+
+    async def compact(self, conversation_id: str) -> bool:
+        """Digest a conversation and move its messages to the archive"""
+        try:
+            memory = await get_conversation_memory(conversation_id)
+            if memory is None:
+                return False
+
+            digest, until = memory["summary"], memory["summarized_until"]
+            if memory["messages"]:
+                prompt = build_memory_messages(memory["summary"], memory["messages"])
+                with stage("retention.digest"):
+                    response = await chat_completion(
+                        model=CHAT_MODEL,
+                        messages=prompt,
+                        max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+                        temperature=TEMPERATURE
+                    )
+                usage = response.usage
+                token_usage.record("retention", usage.prompt_tokens, usage.completion_tokens)
+                digest = response.choices[0].message.content
+                until = memory["messages"][-1]["created_at"]
+
+            result = await archive_conversation(conversation_id, digest, until, memory["summarized_until"])
+            if result is None:
+                # A memory fold moved the summary on; the next run picks it up again
+                self.conflicts += 1
+                return False
+
+            messages, raw_bytes, compressed_bytes = result
+            self.archived += 1
+            self.archived_messages += messages
+            self.raw_bytes += raw_bytes
+            self.compressed_bytes += compressed_bytes
+            return True
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Conversation compaction failed", extra={"conversation_id": conversation_id, "error": str(e)})
+            return False
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.days > 0,
+            "days": self.days,
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "skipped_runs": self.skipped_runs,
+            "last_run": self.last_run,
+            "archived": self.archived,
+            "archived_messages": self.archived_messages,
+            "compression_ratio": round(self.raw_bytes / self.compressed_bytes, 2) if self.compressed_bytes else None,
+            "conflicts": self.conflicts,
+            "failed": self.failed
+        }
+
+retention = RetentionJob(RETENTION_DAYS, RETENTION_INTERVAL, RETENTION_BATCH)
@@ -0,0 +1,99 @@
+"""
+Single-flight coalescing of identical concurrent LLM requests.
+
+Within a worker, concurrent calls with the same key share one in-flight task
+and all receive its result. Across gunicorn workers, the leader holds a lease
+row on the key while it generates. Other workers poll the shared response
+cache until the result lands, and give up waiting after
+SINGLEFLIGHT_LOCK_WAIT seconds. Taking, releasing and polling are single
+statements, so no pool connection is held while the model runs or while a
+follower waits.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from database import database, release_lease, try_acquire_lease
+
+SINGLEFLIGHT_LOCK_WAIT = float(os.getenv("SINGLEFLIGHT_LOCK_WAIT", "30"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.2"))
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn):
+        """Run fn() once for all concurrent callers with the same key
+
+        The work runs in its own task, so a leader whose client disconnects
+        does not cancel it for the followers.
+        """
+        existing = self._calls.get(key)
+        if existing is not None:
+            return await self.follow(existing)
+
+        task = asyncio.ensure_future(fn())
+        self._track(key, task)
+        return await asyncio.shield(task)
+
+    async def follow(self, future: asyncio.Future):
+        """Wait for another caller's in-flight result"""
+        self.followers += 1
+        return await asyncio.shield(future)
+
+    def _track(self, key: str, future: asyncio.Future):
+        self.leaders += 1
+        self._calls[key] = future
+
+        def done(finished):
+            if self._calls.get(key) is finished:
+                del self._calls[key]
+            # Mark the exception as retrieved even when nobody else was waiting
+            if not finished.cancelled():
+                finished.exception()
+
+        future.add_done_callback(done)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
+
+async def run_exclusive(key: str, fn, lookup):
+    """Run fn() under a cross-worker lease on key
+
+    If another worker holds the lease, poll lookup() (the shared cache) until
+    its result appears. Whoever gets the lease checks lookup() first, in case
+    the previous holder has just finished. The lease expires on its own after
+    SINGLEFLIGHT_LOCK_WAIT, so a worker that dies mid-generation cannot block
+    the key for longer than followers would wait anyway.
+    """
+    if not database or not database.is_connected:
+        return await fn()
+
+    lease_key = f"singleflight:{key}"
+    holder = uuid.uuid4().hex
+    deadline = time.monotonic() + SINGLEFLIGHT_LOCK_WAIT
+    while True:
+        if await try_acquire_lease(lease_key, holder, SINGLEFLIGHT_LOCK_WAIT):
+            try:
+                result = await lookup()
+                if result is not None:
+                    return result
+                return await fn()
+            finally:
+                await release_lease(lease_key, holder)
+
+        result = await lookup()
+        if result is not None:
+            return result
+        if time.monotonic() > deadline:
+            return await fn()
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+
+singleflight = SingleFlight()
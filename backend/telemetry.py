@@ -0,0 +1,284 @@
+"""
+Metrics, tracing and structured logging.
+
+- stage() times a unit of work (an upstream call, a query, a prompt build)
+  into the resonance_stage_duration_seconds histogram and opens a span when
+  tracing is enabled. timed() does the same for a whole async function.
+- MetricsMiddleware records per-handler HTTP latency and opens the root span.
+- render_metrics() produces the Prometheus text format served on /metrics.
+  Metrics are per worker process; scrape each worker or aggregate by pod.
+- configure_logging() makes the root logger write one JSON object per line;
+  `extra` fields become keys and the current trace ID is attached.
+
+TRACING selects spans: "off" (default), "log" (each finished span is logged
+with its trace, span and parent IDs) or "otel" (spans go to the
+OpenTelemetry API, which must be installed and configured separately).
+"""
+import contextvars
+import json
+import logging
+import os
+import secrets
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+TRACING = os.getenv("TRACING", "off").lower()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# METRICS
+# ============================================
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts, sum, count]
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        position = bisect_left(self.buckets, value)
+        if position < len(self.buckets):
+            series[0][position] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ("le",), label_values + (bucket,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+stage_seconds = Histogram(
+    "resonance_stage_duration_seconds",
+    "Duration of request stages (upstream calls, queries, prompt assembly)",
+    ("stage", "outcome")
+)
+http_request_seconds = Histogram(
+    "resonance_http_request_duration_seconds",
+    "HTTP request duration by handler, including streamed bodies",
+    ("method", "handler", "status")
+)
+tokens_total = Counter(
+    "resonance_tokens_total",
+    "Prompt and completion tokens used, by endpoint",
+    ("endpoint", "kind")
+)
+
+def render_metrics(snapshot: dict = None) -> str:
+    """Prometheus text format of all metrics
+
+    snapshot adds {name: value} samples read from existing stats; names
+    ending in _total are exposed as counters, the rest as gauges.
+    """
+    lines = []
+    for metric in (http_request_seconds, stage_seconds, tokens_total):
+        lines.extend(metric.render())
+    for name, value in (snapshot or {}).items():
+        lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# ============================================
+# TRACING
+# ============================================
+
+# (trace_id, span_id) of the innermost open span
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+if TRACING == "otel":
+    try:
+        from opentelemetry import trace as otel_trace
+        _tracer = otel_trace.get_tracer("resonance")
+    except ImportError:
+        logger.warning("opentelemetry is not installed; tracing disabled")
+        TRACING = "off"
+
+@contextmanager
+def _log_span(name: str, attributes: dict):
+    parent = _current_span.get()
+    trace_id = parent[0] if parent else secrets.token_hex(16)
+    span_id = secrets.token_hex(8)
+    token = _current_span.set((trace_id, span_id))
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a finalized async generator)
+            pass
+        logger.info("span", extra={
+            "span": name,
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent[1] if parent else None,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "error": error,
+            **attributes
+        })
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a tracing span (no-op unless TRACING is enabled)"""
+    if TRACING == "log":
+        with _log_span(name, attributes):
+            yield
+    elif TRACING == "otel":
+        with _tracer.start_as_current_span(name, attributes=attributes):
+            yield
+    else:
+        yield
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a stage into the stage histogram, inside a span of the same name"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(name, **attributes):
+            yield
+        outcome = "ok"
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, name, outcome)
+
+def timed(name: str):
+    """Decorator form of stage() for async functions"""
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing each HTTP request by the handler that served it"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            with span(f"{scope['method']} {scope['path']}"):
+                await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched endpoint in the scope
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            http_request_seconds.observe(time.perf_counter() - start, scope["method"], handler, str(status))
+
+# ============================================
+# LOGGING
+# ============================================
+
+# Attributes every LogRecord has; anything else came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "color_message"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+
+        current = _current_span.get()
+        if current and "trace_id" not in entry:
+            entry["trace_id"] = current[0]
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines with `extra` fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = " ".join(
+            f"{key}={value}" for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES
+        )
+        return f"{line} {fields}" if fields else line
+
+def configure_logging():
+    """Send all logging to stderr, as JSON lines unless LOG_FORMAT=text"""
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL.upper())
@@ -0,0 +1,172 @@
+"""
+Token counting and token-bounded trimming.
+
+Counts use the model's tiktoken encoder, loaded once per model and cached.
+If tiktoken or its encoding files are unavailable (e.g. offline), counts fall
+back to a ~4 characters per token estimate. Loading an encoder may download
+its encoding, so it never happens on the event loop: until the app's warm-up
+has loaded it, counts made on the loop use the estimate too.
+"""
+import asyncio
+import logging
+import os
+import re
+
+from telemetry import tokens_total
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Per-message framing overhead of the chat format
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?=\s)|\n{2,}")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)"""
+    return max(1, (len(text) + 3) // 4)
+
+_encoders = {}
+_loading = set()
+
+def load_encoder(model: str):
+    """Load (once) and return the tiktoken encoder for model, or None to use the estimate
+
+    Blocks, possibly on a download; run it in a thread from async code.
+    """
+    if model not in _encoders:
+        _encoders[model] = _load_encoder(model)
+    return _encoders[model]
+
+def get_encoder(model: str):
+    """Return the tiktoken encoder for model, or None to use the estimate
+
+    On the event loop this does not block: before the encoder is loaded it
+    returns None and starts loading it in a thread.
+    """
+    if model in _encoders:
+        return _encoders[model]
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return load_encoder(model)
+    if model not in _loading:
+        _loading.add(model)
+        loop.run_in_executor(None, load_encoder, model).add_done_callback(lambda _: _loading.discard(model))
+    return None
+
+def _load_encoder(model: str):
+    if tiktoken is None or os.getenv("TOKENIZER", "tiktoken") == "estimate":
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating token counts", extra={"model": model, "error": str(e)})
+        return None
+
+def count_tokens(text: str, model: str) -> int:
+    encoder = get_encoder(model)
+    if encoder is None:
+        return estimate_tokens(text) if text else 0
+    return len(encoder.encode_ordinary(text))
+
+def count_tokens_batch(texts: list, model: str) -> list:
+    """Count tokens for many texts at once (encoded in parallel by tiktoken)"""
+    encoder = get_encoder(model)
+    if encoder is None:
+        return [estimate_tokens(text) if text else 0 for text in texts]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
+
+def count_message_tokens(messages: list, model: str) -> int:
+    """Prompt tokens of a chat request, including the per-message framing"""
+    counts = count_tokens_batch([message["content"] for message in messages], model)
+    return sum(counts) + TOKENS_PER_MESSAGE * len(messages) + TOKENS_PER_REPLY
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Trim text to at most max_tokens, cutting at the last sentence end that fits
+
+    Falls back to a word boundary when the first sentence alone is too long.
+    """
+    if max_tokens <= 0:
+        return ""
+
+    encoder = get_encoder(model)
+    if encoder is None:
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        prefix = text[:max_tokens * 4]
+    else:
+        tokens = encoder.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        prefix = encoder.decode(tokens[:max_tokens])
+
+    ends = [match.end() for match in _SENTENCE_END.finditer(prefix)]
+    if ends:
+        return prefix[:ends[-1]].rstrip()
+    cut = prefix.rfind(" ")
+    return (prefix[:cut] if cut > 0 else prefix).rstrip()
+
+def split_to_tokens(text: str, max_tokens: int, model: str) -> list:
+    """Cut text into consecutive pieces of at most max_tokens, regardless of word boundaries"""
+    encoder = get_encoder(model)
+    if encoder is None:
+        step = max_tokens * 4
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    tokens = encoder.encode_ordinary(text)
+    return [encoder.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+def fit_texts(texts: list, budget: int, model: str, max_each: int = None) -> list:
+    """Keep texts in order while they fit in budget, trimming the one that overflows
+
+    max_each additionally caps every text. Texts that would be cut to nothing
+    are dropped.
+    """
+    fitted = []
+    for text, tokens in zip(texts, count_tokens_batch(texts, model)):
+        limit = min(budget, max_each) if max_each else budget
+        if tokens > limit:
+            text = truncate_to_tokens(text, limit, model)
+            if not text:
+                break
+            tokens = count_tokens(text, model)
+        fitted.append(text)
+        budget -= tokens
+        if budget <= 0:
+            break
+    return fitted
+
+class TokenUsage:
+    """Running prompt/completion token totals per endpoint"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def record(self, endpoint: str, prompt_tokens: int, completion_tokens: int) -> dict:
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        totals = self.totals.setdefault(endpoint, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        totals["requests"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+        tokens_total.inc(endpoint, "prompt", amount=prompt_tokens)
+        tokens_total.inc(endpoint, "completion", amount=completion_tokens)
+        return usage
+
+    def stats(self) -> dict:
+        return {
+            endpoint: dict(
+                totals,
+                avg_prompt_tokens=round(totals["prompt_tokens"] / totals["requests"], 1),
+                avg_completion_tokens=round(totals["completion_tokens"] / totals["requests"], 1)
+            )
+            for endpoint, totals in self.totals.items()
+        }
+
+token_usage = TokenUsage()
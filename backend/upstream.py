@@ -0,0 +1,205 @@
+"""
+Resilience policy for calls to upstream services.
+
+Every call has a deadline that covers all of its attempts. Idempotent calls
+(embeddings, vector queries) are retried on transient errors with jittered
+exponential backoff for as long as the deadline allows, and can be hedged:
+when an attempt has not answered within the hedge delay, a second one is
+started and whichever finishes first wins. Completions are never retried or
+hedged, since each attempt is billed.
+
+Each upstream has a circuit breaker. After BREAKER_FAILURE_THRESHOLD
+consecutive transient failures it opens and calls fail immediately with
+CircuitOpenError, so an outage costs callers nothing instead of a timeout
+each. After BREAKER_RESET_TIMEOUT seconds one probe call is let through; its
+outcome closes the breaker again or restarts the wait. Client errors (bad
+requests, auth) do not count as failures.
+"""
+import asyncio
+import os
+import random
+import time
+
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Statuses worth retrying; other 4xx responses are the caller's fault
+RETRYABLE_STATUSES = {408, 409, 429}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+def is_transient(error: BaseException) -> bool:
+    """Whether an error says the upstream is unhealthy rather than the request is wrong"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        # Timeouts and connection errors
+        return not isinstance(error, (ValueError, TypeError, KeyError))
+    return status >= 500 or status in RETRYABLE_STATUSES
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one probe at a time"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release_probe(self):
+        """Forget an unfinished probe (e.g. cancelled) so another can be sent"""
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.opened += 1
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+class Upstream:
+    """Deadline, retry, hedging and circuit-breaking policy for one upstream service"""
+
+    def __init__(self, name: str, timeout: float, max_concurrency: int, hedge_after_ms: float = 0,
+                 retries: int = UPSTREAM_RETRIES, retry_base_delay: float = UPSTREAM_RETRY_BASE_DELAY):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_after = hedge_after_ms / 1000
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @property
+    def available(self) -> bool:
+        """False while the breaker is open, so callers can skip optional work"""
+        return self.breaker.state != "open"
+
+    def admit(self):
+        """Raise CircuitOpenError unless the breaker lets a call through"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record(self, error: BaseException = None):
+        """Feed a call's outcome to the breaker"""
+        if error is None:
+            self.breaker.record_success()
+        elif is_transient(error):
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            # The upstream answered; it is healthy even if the request was not
+            self.breaker.record_success()
+
+    async def call(self, make_call, idempotent: bool = False, timeout: float = None):
+        """Run make_call() (returning a fresh awaitable) under this upstream's policy
+
+        timeout is the deadline for all attempts together.
+        """
+        self.calls += 1
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            self.admit()
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                if idempotent and self.hedge_after:
+                    result = await asyncio.wait_for(self._hedged(make_call), timeout=remaining)
+                else:
+                    result = await asyncio.wait_for(self._attempt(make_call), timeout=remaining)
+                self.record()
+                return result
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                self.record(e)
+                delay = self.retry_base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if (not idempotent or attempt >= self.retries or not is_transient(e)
+                        or time.monotonic() + delay >= deadline):
+                    raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, make_call):
+        async with self.semaphore:
+            return await make_call()
+
+    async def _hedged(self, make_call):
+        """Start a second attempt if the first is slower than hedge_after; first success wins"""
+        first = asyncio.ensure_future(self._attempt(make_call))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            pending.add(asyncio.ensure_future(self._attempt(make_call)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "circuit": self.breaker.stats(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_after_ms": self.hedge_after * 1000
+        }
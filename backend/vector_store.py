@@ -0,0 +1,468 @@
+"""
+Pluggable vector stores for RAG.
+
+Two backends implement the same async interface:
+
+- PineconeVectorStore wraps the hosted Pinecone index.
+- LocalVectorStore keeps float32 vectors in a contiguous NumPy matrix per
+  namespace and answers top-k cosine queries in-process. Filtered fields
+  are indexed as integer code columns, so a filter is an array comparison.
+  Queries over LOCAL_QUERY_THREAD_ROWS or more vectors, and all writes to
+  the matrix, run in a thread. With a path, each namespace is persisted as
+  an append-only log shared by the workers on the host: an upsert appends
+  its records under an exclusive file lock, and every worker (including the
+  writer) applies new log records in log order before reading, so they all
+  see the same vectors. A log that has grown to several times its live size
+  is compacted by rewriting it and renaming it into place; workers notice
+  the new file and re-read it. Without a path the store is purely
+  in-memory and per worker.
+
+  The log is not memory-mapped: its records interleave variable-length
+  JSON metadata with the vectors, and upserts overwrite rows in place, so
+  each worker replays it into its own matrix instead. It is read in
+  LOCAL_READ_BYTES pieces, so replaying a large log does not also hold a
+  full copy of the file in memory.
+
+Constructing a store does no I/O: connecting to Pinecone (creating the
+index if needed) and loading local files happen in initialize(), which the
+app awaits during startup.
+
+VECTOR_STORE selects the backend ("pinecone", "local", "memory" or "none").
+It defaults to Pinecone when PINECONE_API_KEY is set; otherwise RAG is off
+unless a local backend is chosen explicitly.
+"""
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+from collections import namedtuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from clients import pinecone_upstream, run_pinecone
+from telemetry import timed
+
+load_dotenv()
+
+PINECONE_INDEX_NAME = "resonance-articles"
+EMBEDDING_DIMENSION = 1536
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "vector_data")
+LOCAL_QUERY_THREAD_ROWS = int(os.getenv("LOCAL_QUERY_THREAD_ROWS", "20000"))
+LOCAL_READ_BYTES = 64 * 1024 * 1024
+# Compact a namespace's log once it is this many times its live size...
+LOCAL_COMPACT_RATIO = 2
+# ...and at least this large
+LOCAL_COMPACT_MIN_BYTES = 8 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+Match = namedtuple("Match", ["id", "score", "metadata"])
+
+class VectorStore:
+    """Interface shared by the vector store backends"""
+
+    name = "base"
+
+    async def initialize(self):
+        """Connect or load; called once before the store is used"""
+        pass
+
+    @property
+    def available(self) -> bool:
+        """False while the backing service is failing; RAG is skipped meanwhile"""
+        return True
+
+    async def upsert(self, vectors: list, namespace: str = ""):
+        raise NotImplementedError
+
+    async def query(self, vector: list, top_k: int, namespace: str = "", filter: dict = None) -> list:
+        raise NotImplementedError
+
+    async def count(self, namespace: str = "") -> int:
+        """Vectors in one namespace (articles are in the default one)"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+# ============================================
+# PINECONE
+# ============================================
+
+class PineconeVectorStore(VectorStore):
+    name = "pinecone"
+
+    def __init__(self, api_key: str = None, index=None):
+        self.api_key = api_key
+        self.index = index
+
+    def _connect(self):
+        # Imported here so the SDK's import cost stays off worker boot
+        from pinecone import Pinecone, ServerlessSpec
+
+        pc = Pinecone(api_key=self.api_key)
+        if PINECONE_INDEX_NAME not in pc.list_indexes().names():
+            logger.info("Creating Pinecone index", extra={"index": PINECONE_INDEX_NAME})
+            pc.create_index(
+                name=PINECONE_INDEX_NAME,
+                dimension=EMBEDDING_DIMENSION,
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+        self.index = pc.Index(PINECONE_INDEX_NAME)
+
+    @property
+    def available(self) -> bool:
+        return pinecone_upstream.available
+
+    async def initialize(self):
+        if self.index is None:
+            # No per-call timeout here: creating an index can take a while
+            await asyncio.to_thread(self._connect)
+            logger.info("Pinecone connected")
+
+    @timed("vector_store.upsert")
+    async def upsert(self, vectors: list, namespace: str = ""):
+        await run_pinecone(self.index.upsert, vectors=vectors, namespace=namespace)
+
+    @timed("vector_store.query")
+    async def query(self, vector: list, top_k: int, namespace: str = "", filter: dict = None) -> list:
+        kwargs = {"filter": filter} if filter else {}
+        results = await run_pinecone(
+            self.index.query,
+            vector=vector,
+            top_k=top_k,
+            include_metadata=True,
+            namespace=namespace,
+            idempotent=True,
+            **kwargs
+        )
+        return [Match(match.id, match.score, match.metadata or {}) for match in results.matches]
+
+    async def count(self, namespace: str = "") -> int:
+        stats = await run_pinecone(self.index.describe_index_stats, idempotent=True)
+        summary = stats.namespaces.get(namespace)
+        return summary.vector_count if summary else 0
+
+# ============================================
+# LOCAL (NUMPY)
+# ============================================
+
+# Record header: length of the JSON part that precedes the vector
+_RECORD_HEADER = struct.Struct("<I")
+
+def _hashable(value):
+    """Metadata values as dictionary keys (lists and dicts by their JSON)"""
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return json.dumps(value, sort_keys=True)
+
+class _Column:
+    """One metadata field as integer codes per row, so filters are array comparisons"""
+
+    def __init__(self, capacity: int):
+        self.codes = {}
+        self.values = np.full(capacity, -1, dtype=np.int32)
+
+    def code(self, value) -> int:
+        return self.codes.setdefault(_hashable(value), len(self.codes))
+
+    def lookup(self, value) -> int:
+        """The code of value, or -1 (matching no row) if no row has it"""
+        return self.codes.get(_hashable(value), -1)
+
+class _Namespace:
+    """Vectors of one namespace: a float32 matrix of unit-length rows plus ids and metadata
+
+    Filtered fields get a _Column on first use, kept current by apply().
+    apply() and the filter mask hold self.lock, so a query running in a
+    thread never sees a half-applied batch of metadata.
+    """
+
+    def __init__(self, dimension: int):
+        self.matrix = np.empty((0, dimension), dtype=np.float32)
+        self.size = 0
+        self.ids = []
+        self.metadata = []
+        self.positions = {}
+        self.columns = {}
+        self.lock = threading.Lock()
+        # Log file this namespace was read from, and how far
+        self.inode = None
+        self.offset = 0
+
+    def _ensure_capacity(self, rows: int):
+        needed = self.size + rows
+        if needed <= self.matrix.shape[0]:
+            return
+        # Grow geometrically; queries keep using the old matrix until it is replaced
+        capacity = max(needed, 2 * self.matrix.shape[0], 64)
+        grown = np.empty((capacity, self.matrix.shape[1]), dtype=np.float32)
+        grown[:self.size] = self.matrix[:self.size]
+        for column in self.columns.values():
+            values = np.full(capacity, -1, dtype=np.int32)
+            values[:self.size] = column.values[:self.size]
+            column.values = values
+        self.matrix = grown
+
+    def apply(self, records: list):
+        """Apply (id, metadata, unit-length row) records in order"""
+        with self.lock:
+            self._ensure_capacity(len(records))
+            for vector_id, metadata, row in records:
+                position = self.positions.get(vector_id)
+                if position is None:
+                    position = self.size
+                    self.ids.append(vector_id)
+                    self.metadata.append(metadata)
+                    self.positions[vector_id] = position
+                    self.size += 1
+                else:
+                    self.metadata[position] = metadata
+                self.matrix[position] = row
+                for field, column in self.columns.items():
+                    column.values[position] = column.code(metadata.get(field))
+
+    def _column(self, field: str) -> _Column:
+        column = self.columns.get(field)
+        if column is None:
+            column = _Column(self.matrix.shape[0])
+            for position, metadata in enumerate(self.metadata):
+                column.values[position] = column.code(metadata.get(field))
+            self.columns[field] = column
+        return column
+
+    def _mask(self, filter: dict, size: int) -> np.ndarray:
+        """Rows matching the subset of Pinecone's filter syntax we use ($eq, $ne, $in)"""
+        mask = np.ones(size, dtype=bool)
+        for field, condition in filter.items():
+            column = self._column(field)
+            values = column.values[:size]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, expected in condition.items():
+                if op == "$eq":
+                    mask &= values == column.lookup(expected)
+                elif op == "$ne":
+                    mask &= values != column.lookup(expected)
+                elif op == "$in":
+                    mask &= np.isin(values, [column.lookup(value) for value in expected])
+        return mask
+
+    def query(self, vector: list, top_k: int, filter: dict = None) -> list:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        with self.lock:
+            size, matrix = self.size, self.matrix
+            mask = self._mask(filter, size) if filter and size else None
+        if size == 0 or norm == 0:
+            return []
+
+        scores = matrix[:size] @ (query / norm)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+
+        k = min(top_k, size)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            Match(self.ids[i], float(scores[i]), self.metadata[i])
+            for i in best
+            if np.isfinite(scores[i])
+        ]
+
+def _normalize(vectors: list) -> list:
+    values = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    values /= np.where(norms == 0, 1, norms)
+    return [(vector["id"], vector.get("metadata", {}), row) for vector, row in zip(vectors, values)]
+
+def _encode_records(records: list) -> bytes:
+    parts = []
+    for vector_id, metadata, row in records:
+        header = json.dumps({"id": vector_id, "metadata": metadata}).encode()
+        parts.extend((_RECORD_HEADER.pack(len(header)), header, row.tobytes()))
+    return b"".join(parts)
+
+def _decode_records(data: bytes, dimension: int):
+    """Records in data and the bytes they take; a trailing partial record is left for later"""
+    records, offset, row_bytes = [], 0, dimension * 4
+    while offset + _RECORD_HEADER.size <= len(data):
+        (length,) = _RECORD_HEADER.unpack_from(data, offset)
+        end = offset + _RECORD_HEADER.size + length + row_bytes
+        if end > len(data):
+            break
+        header = json.loads(data[offset + _RECORD_HEADER.size:end - row_bytes])
+        row = np.frombuffer(data, dtype=np.float32, count=dimension, offset=end - row_bytes)
+        records.append((header["id"], header["metadata"], row))
+        offset = end
+    return records, offset
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, path: str = None, dimension: int = EMBEDDING_DIMENSION):
+        self.name = "local" if path else "memory"
+        self.path = path
+        self.dimension = dimension
+        self.namespaces = {}
+        self._lock = asyncio.Lock()
+
+    def _log_file(self, namespace: str) -> str:
+        return os.path.join(self.path, f"{namespace or 'default'}.log")
+
+    def _namespace_names(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return [
+            "" if filename == "default.log" else filename[:-4]
+            for filename in os.listdir(self.path) if filename.endswith(".log")
+        ]
+
+    def _sync(self, namespace: str):
+        """Apply records other workers (or this one) appended to the namespace's log"""
+        try:
+            with open(self._log_file(namespace), "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                store = self.namespaces.get(namespace)
+                if store is None or store.inode != inode:
+                    # New, or compacted by another worker: read it from the start
+                    store = _Namespace(self.dimension)
+                    store.inode = inode
+                f.seek(store.offset)
+                pending = b""
+                while True:
+                    data = f.read(LOCAL_READ_BYTES)
+                    if not data:
+                        break
+                    data = pending + data
+                    records, consumed = _decode_records(data, self.dimension)
+                    if records:
+                        store.apply(records)
+                    store.offset += consumed
+                    pending = data[consumed:]
+        except FileNotFoundError:
+            return
+
+        self.namespaces[namespace] = store
+
+    def _changed(self, namespace: str) -> bool:
+        """Whether the namespace's log has anything this worker has not read"""
+        try:
+            stat = os.stat(self._log_file(namespace))
+        except FileNotFoundError:
+            return False
+        store = self.namespaces.get(namespace)
+        return store is None or store.inode != stat.st_ino or stat.st_size > store.offset
+
+    async def _refresh(self, namespace: str):
+        if self.path and self._changed(namespace):
+            async with self._lock:
+                await asyncio.to_thread(self._sync, namespace)
+
+    def _load(self):
+        for namespace in self._namespace_names():
+            self._sync(namespace)
+        total = sum(namespace.size for namespace in self.namespaces.values())
+        logger.info("Loaded local vector store", extra={"vectors": total, "path": self.path})
+
+    async def initialize(self):
+        if self.path:
+            async with self._lock:
+                await asyncio.to_thread(self._load)
+
+    def _open_locked(self, namespace: str):
+        """Open the namespace's log with an exclusive lock, retrying if it was compacted meanwhile"""
+        os.makedirs(self.path, exist_ok=True)
+        path = self._log_file(namespace)
+        while True:
+            f = open(path, "ab")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _append(self, namespace: str, records: list):
+        """Append records to the shared log, then catch up with it (compacting if it has bloated)"""
+        with self._open_locked(namespace) as f:
+            f.write(_encode_records(records))
+            f.flush()
+            self._sync(namespace)
+            store = self.namespaces[namespace]
+            live_bytes = store.size * (self.dimension * 4 + 256)
+            if store.offset > max(LOCAL_COMPACT_MIN_BYTES, LOCAL_COMPACT_RATIO * live_bytes):
+                self._compact(namespace, store)
+
+    def _compact(self, namespace: str, store: _Namespace):
+        """Rewrite the log with only the current version of each vector (caller holds the lock)"""
+        path = self._log_file(namespace)
+        with store.lock:
+            records = [
+                (vector_id, store.metadata[i], store.matrix[i])
+                for i, vector_id in enumerate(store.ids)
+            ]
+        with open(path + ".tmp", "wb") as f:
+            f.write(_encode_records(records))
+        os.replace(path + ".tmp", path)
+        stat = os.stat(path)
+        store.inode, store.offset = stat.st_ino, stat.st_size
+        logger.info("Compacted local vector log", extra={"namespace": namespace, "vectors": len(records)})
+
+    @timed("vector_store.upsert")
+    async def upsert(self, vectors: list, namespace: str = ""):
+        if not vectors:
+            return
+
+        async with self._lock:
+            records = _normalize(vectors)
+            if self.path:
+                # Every worker applies the log in the same order, so they agree
+                await asyncio.to_thread(self._append, namespace, records)
+                return
+            store = self.namespaces.get(namespace)
+            if store is None:
+                store = self.namespaces[namespace] = _Namespace(self.dimension)
+            await asyncio.to_thread(store.apply, records)
+
+    @timed("vector_store.query")
+    async def query(self, vector: list, top_k: int, namespace: str = "", filter: dict = None) -> list:
+        await self._refresh(namespace)
+        store = self.namespaces.get(namespace)
+        if store is None:
+            return []
+        if store.size >= LOCAL_QUERY_THREAD_ROWS:
+            return await asyncio.to_thread(store.query, vector, top_k, filter)
+        return store.query(vector, top_k, filter)
+
+    async def count(self, namespace: str = "") -> int:
+        await self._refresh(namespace)
+        store = self.namespaces.get(namespace)
+        return store.size if store else 0
+
+# ============================================
+# FACTORY
+# ============================================
+
+def create_vector_store():
+    """Create (but do not initialize) the configured vector store, or None when RAG is disabled"""
+    api_key = os.getenv("PINECONE_API_KEY")
+    backend = os.getenv("VECTOR_STORE", "pinecone" if api_key else "none").lower()
+
+    if backend == "pinecone":
+        if not api_key:
+            logger.warning("Pinecone API key not found - RAG features disabled")
+            return None
+        return PineconeVectorStore(api_key)
+    if backend == "local":
+        return LocalVectorStore(LOCAL_VECTOR_STORE_PATH)
+    if backend == "memory":
+        return LocalVectorStore()
+    logger.warning("Vector store disabled - RAG features disabled")
+    return None
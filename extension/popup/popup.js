@@ -1,6 +1,7 @@
 const API_URL = 'https://resonance-backend-spandanap-aue0e7hwgsaeamcu.canadacentral-01.azurewebsites.net';
 
 let currentArticle = null;
+let currentArticleId = null;
 let currentConversationId = null;
 let currentView = 'current';
 let currentMessages = [];
@@ -25,6 +26,9 @@ document.addEventListener('DOMContentLoaded', async () => {
       
       if (response && response.success) {
         currentArticle = response.article;
+        registerArticle()
+          .then(id => { currentArticleId = id; })
+          .catch(error => console.warn('Article registration failed, sending content inline:', error));
         await checkExistingConversation(currentArticle.url);
         showArticleInfo();
         setupEventListeners();
@@ -44,6 +48,7 @@ document.addEventListener('DOMContentLoaded', async () => {
   
   // Setup search functionality
   setupSearchListener();
+  syncLocalHistory();
 });
 
 async function checkExistingConversation(url) {
@@ -267,34 +272,21 @@ async function askQuestion(question) {
   updateStatus('Processing...');
 
   try {
-    const response = await fetch(`${API_URL}/api/question`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({
-        question: question,
-        title: currentArticle.title,
-        content: currentArticle.content,
-        url: currentArticle.url,
-        conversation_id: currentConversationId
-      })
-    });
-
-    if (!response.ok) {
-      throw new Error(`Server error: ${response.status}`);
-    }
-
-    const data = await response.json();
+    const answer = await streamArticleRequest('/api/question/stream', {
+      question: question,
+      title: currentArticle.title,
+      url: currentArticle.url,
+      conversation_id: currentConversationId
+    }, (partial) => showPartialResponse(partial));
     
     currentMessages.push({
       role: 'assistant',
-      content: data.answer,
+      content: answer,
       created_at: new Date().toISOString()
     });
     
     await saveConversation();
-    showResponse(data.answer, 'question');
+    showResponse(answer, 'question');
     
   } catch (error) {
     console.error('Error:', error);
@@ -325,34 +317,21 @@ async function querySummarize(type) {
   updateStatus('Processing...');
 
   try {
-    const response = await fetch(`${API_URL}/api/summarize`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({
-        title: currentArticle.title,
-        content: currentArticle.content,
-        url: currentArticle.url,
-        type: type,
-        conversation_id: currentConversationId
-      })
-    });
-
-    if (!response.ok) {
-      throw new Error(`Server error: ${response.status}`);
-    }
-
-    const data = await response.json();
+    const summary = await streamArticleRequest('/api/summarize/stream', {
+      title: currentArticle.title,
+      url: currentArticle.url,
+      type: type,
+      conversation_id: currentConversationId
+    }, (partial) => showPartialResponse(partial));
     
     currentMessages.push({
       role: 'assistant',
-      content: data.summary,
+      content: summary,
       created_at: new Date().toISOString()
     });
     
     await saveConversation();
-    showResponse(data.summary, type);
+    showResponse(summary, type);
   } catch (error) {
     console.error('Error:', error);
     currentMessages.pop();
@@ -362,6 +341,153 @@ async function querySummarize(type) {
   }
 }
 
+// Upload the article text once (gzip-compressed) and return its ID.
+// Skips the upload when the backend already has this exact content.
+async function registerArticle() {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(currentArticle.content));
+  const articleId = Array.from(new Uint8Array(digest))
+    .map(byte => byte.toString(16).padStart(2, '0'))
+    .join('');
+
+  const existing = await fetch(`${API_URL}/api/articles/${articleId}`);
+  if (existing.ok) {
+    return articleId;
+  }
+
+  const body = JSON.stringify({
+    title: currentArticle.title,
+    content: currentArticle.content,
+    url: currentArticle.url
+  });
+  const compressed = await new Response(
+    new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'))
+  ).arrayBuffer();
+
+  const response = await fetch(`${API_URL}/api/articles`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Content-Encoding': 'gzip',
+    },
+    body: compressed
+  });
+
+  if (!response.ok) {
+    throw new Error(`Server error: ${response.status}`);
+  }
+
+  const data = await response.json();
+  return data.article_id;
+}
+
+// Upload the local conversations the backend has not seen yet as one
+// NDJSON import; the server skips any it already has. Each uploaded
+// conversation is remembered with its last_updated, so conversations
+// started or continued later are picked up by the next sync.
+async function syncLocalHistory() {
+  const data = await chrome.storage.local.get(['conversations', 'syncedConversations']);
+  const conversations = data.conversations || [];
+  const synced = data.syncedConversations || {};
+  const pending = conversations.filter(c => synced[c.id] !== c.last_updated);
+  if (pending.length === 0) return;
+
+  try {
+    const response = await fetch(`${API_URL}/api/conversations/import`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/x-ndjson' },
+      body: pending.map(c => JSON.stringify(c)).join('\n')
+    });
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+    const result = await response.json();
+    console.log(`✅ History synced: ${result.imported} imported, ${result.updated} updated, ${result.skipped} already there`);
+
+    // Only keep markers for conversations still stored locally
+    const syncedConversations = {};
+    conversations.forEach(c => {
+      if (synced[c.id] !== undefined) syncedConversations[c.id] = synced[c.id];
+    });
+    pending.forEach(c => { syncedConversations[c.id] = c.last_updated; });
+    await chrome.storage.local.set({ syncedConversations });
+    await chrome.storage.local.remove('historySynced');
+  } catch (error) {
+    console.warn('History sync failed, will retry next time:', error);
+  }
+}
+
+// Refer to the registered article by ID, falling back to sending the
+// full content if it is not registered (yet) or the server lost it.
+async function streamArticleRequest(path, body, onToken) {
+  if (currentArticleId) {
+    try {
+      return await streamRequest(path, { ...body, article_id: currentArticleId }, onToken);
+    } catch (error) {
+      if (error.status !== 404) throw error;
+      currentArticleId = null;
+    }
+  }
+  return streamRequest(path, { ...body, content: currentArticle.content }, onToken);
+}
+
+// POST to a streaming endpoint and read its Server-Sent Events.
+// Calls onToken with the text received so far; resolves with the full text.
+async function streamRequest(path, body, onToken) {
+  const response = await fetch(`${API_URL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(body)
+  });
+
+  if (!response.ok) {
+    const error = new Error(`Server error: ${response.status}`);
+    error.status = response.status;
+    throw error;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let text = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = 'message';
+      let data = '';
+      rawEvent.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === 'token') {
+        text += payload.content;
+        onToken(text);
+      } else if (event === 'error') {
+        throw new Error(payload.detail || 'Streaming failed');
+      }
+    }
+  }
+
+  return text;
+}
+
+function showPartialResponse(text) {
+  document.getElementById('loading-response').classList.add('hidden');
+  document.getElementById('response-content').textContent = text;
+  document.getElementById('response-container').classList.remove('hidden');
+  updateStatus('Streaming...');
+}
+
 function showResponse(text, type) {
   const responseElement = document.getElementById('response-content');
   